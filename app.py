@@ -1,33 +1,201 @@
-from flask import Flask, render_template, request, session, redirect, url_for, flash
+from flask import Flask, render_template, request, session, redirect, url_for, flash, g, has_app_context, jsonify
+from flask import Response, stream_with_context, send_from_directory, abort
 import random
 import sqlite3
 import os
-import hashlib
 import secrets
-from datetime import datetime
+import threading
+import atexit
+import logging
+import time
+import json
+import functools
+import copy
+import itertools
+import heapq
+import base64
+import csv
+import io
+import mimetypes
+from collections import OrderedDict
+from werkzeug.security import safe_join
+from datetime import datetime, timedelta
+
+import metrics
+import passwords
+import rng
 
 app = Flask(__name__)
-app.secret_key = 'casino_secret_key_2025'
-# Флаг для отслеживания инициализации БД
-db_initialized = False
+# Ключ подписи cookie-сессий задается через окружение. Без него генерируется случайный
+# ключ процесса (сессии не переживают перезапуск; serve.py генерирует его до fork,
+# так что все воркеры используют один ключ)
+app.secret_key = os.environ.get('CASINO_SECRET_KEY') or secrets.token_hex(32)
+# Хранилище данных: 'sqlite' (файл DATABASE) или 'memory' (в памяти процесса, без диска)
+app.config['STORAGE'] = os.environ.get('CASINO_STORAGE', 'sqlite')
+app.config['DATABASE'] = os.environ.get('CASINO_DB', 'casino.db')
+# Размер кэша подготовленных выражений на одно соединение
+app.config['DB_CACHED_STATEMENTS'] = 256
+# Отложенная пакетная запись истории игр (в режиме TESTING запись синхронная)
+app.config['HISTORY_WRITE_BEHIND'] = True
+app.config['HISTORY_BATCH_SIZE'] = 200
+app.config['HISTORY_FLUSH_INTERVAL'] = 0.5
+# Кэш проверенных сессий для check_auth: размер, время жизни записи (сек)
+# и минимальный интервал между обновлениями last_login (сек)
+app.config['SESSION_CACHE_SIZE'] = 10000
+app.config['SESSION_CACHE_TTL'] = 60
+app.config['LAST_LOGIN_INTERVAL'] = 300
+# Сколько партий блэкджека держать в памяти (остальные читаются из БД). Запись из кэша
+# используется, только если версия партии в БД не изменилась (другой воркер)
+app.config['BLACKJACK_CACHE_SIZE'] = 10000
+# Шуз блэкджека: число колод и доля карт до отрезной карты (после нее - перетасовка)
+app.config['BLACKJACK_DECKS'] = 6
+app.config['BLACKJACK_PENETRATION'] = 0.75
+# Очистка сессий: интервал фонового прохода (сек, 0 - выключена), сессий удаляется
+# за одну транзакцию, и сколько сессий входа держать на пользователя (0 - без ограничения)
+app.config['SESSION_SWEEP_INTERVAL'] = 300
+app.config['SESSION_SWEEP_BATCH'] = 500
+app.config['SESSION_MAX_PER_USER'] = 10
+# Собранная статика (assets.py): манифест сборки и срок кэширования файлов с хешем в имени
+app.config['ASSET_MANIFEST'] = os.path.join(app.static_folder, 'dist', 'manifest.json')
+app.config['ASSET_MAX_AGE'] = 365 * 24 * 3600
+# Хеширование паролей (passwords.py): схема 'scrypt' или 'pbkdf2-sha256' и стоимость
+# (N для scrypt, итерации для PBKDF2; None - по умолчанию для схемы). Хеши считаются
+# в пуле из PASSWORD_WORKERS процессов; если в очереди уже PASSWORD_MAX_PENDING задач
+# или ответа нет за PASSWORD_TIMEOUT секунд, вход и регистрация сразу отвечают 503
+app.config['PASSWORD_SCHEME'] = os.environ.get('CASINO_PASSWORD_SCHEME', 'scrypt')
+app.config['PASSWORD_COST'] = None
+app.config['PASSWORD_WORKERS'] = int(os.environ.get('CASINO_PASSWORD_WORKERS', min(4, os.cpu_count() or 1)))
+app.config['PASSWORD_MAX_PENDING'] = 32
+app.config['PASSWORD_TIMEOUT'] = 5.0
+# Аудит случайности (rng.py): каждый раунд разыгрывается из своего seed, хеш seed
+# (commitment) пишется в журнал casino.rng до розыгрыша, seed возвращается в ответе JSON API
+app.config['RNG_AUDIT'] = os.environ.get('CASINO_RNG_AUDIT') == '1'
+# Таблица лидеров: мест в каждой таблице и интервал (сек) записи накопленных результатов
+# в БД и обновления таблиц (0 - без фонового потока, обновление при каждом чтении)
+app.config['LEADERBOARD_SIZE'] = 10
+app.config['LEADERBOARD_REFRESH_INTERVAL'] = 5
+# Журнал проводок: снимок баланса сохраняется при сверке, если после прошлого снимка
+# набралось LEDGER_CHECKPOINT_ENTRIES проводок; фоновая сверка игроков, делавших ставки,
+# раз в LEDGER_CHECKPOINT_INTERVAL секунд (0 - выключена)
+app.config['LEDGER_CHECKPOINT_ENTRIES'] = 1000
+app.config['LEDGER_CHECKPOINT_INTERVAL'] = 60
+# Повторы записи при SQLITE_BUSY (другой процесс держит блокировку дольше busy_timeout)
+app.config['DB_BUSY_RETRIES'] = 5
+app.config['DB_BUSY_BACKOFF'] = 0.05
+# История игр: строк на странице по умолчанию и максимум для JSON API
+app.config['HISTORY_PAGE_SIZE'] = 50
+app.config['HISTORY_PAGE_MAX'] = 500
+# Максимум раундов в одном запросе пакетной игры JSON API
+app.config['API_MAX_BATCH_ROUNDS'] = 1000
+# Архивация истории (archive.py): строки старше HISTORY_RETENTION_DAYS дней переносятся
+# в помесячные БД в HISTORY_ARCHIVE_DIR пачками по HISTORY_ARCHIVE_BATCH строк
+app.config['HISTORY_RETENTION_DAYS'] = int(os.environ.get('CASINO_RETENTION_DAYS', 90))
+app.config['HISTORY_ARCHIVE_DIR'] = os.environ.get('CASINO_ARCHIVE_DIR', 'archive')
+app.config['HISTORY_ARCHIVE_BATCH'] = 500
+# ASGI-режим (asgi.py): число потоков пула для обработчиков и работы с БД
+# и максимальный размер тела запроса (байт)
+app.config['DB_EXECUTOR_THREADS'] = int(os.environ.get('CASINO_DB_THREADS', 16))
+app.config['ASGI_MAX_BODY_SIZE'] = 1024 * 1024
+# Инструментирование (metrics.py): таймеры БД, шаблонов и сессии по маршрутам и /metrics.
+# Под cProfile попадает доля PROFILE_SAMPLE_RATE запросов; профиль сохраняется
+# в PROFILE_DIR, если запрос шел дольше PROFILE_SLOW_SECONDS
+app.config['METRICS_ENABLED'] = os.environ.get('CASINO_METRICS') == '1'
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('CASINO_PROFILE_RATE', 0))
+app.config['PROFILE_SLOW_SECONDS'] = 0.2
+app.config['PROFILE_DIR'] = os.environ.get('CASINO_PROFILE_DIR', 'profiles')
+# Минимум карт, который должен оставаться за отрезной картой
+BLACKJACK_MIN_CARDS_LEFT = 20
 
-# Инициализация базы данных
-def init_db():
-    global db_initialized
-    if db_initialized:
-        return
-        
-    conn = sqlite3.connect('casino.db')
-    cursor = conn.cursor()
-    
-    # Проверяем существование таблиц через SELECT
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-    users_table_exists = cursor.fetchone()
-    
-    if not users_table_exists:
-        # Создаем таблицы только если они не существуют
-        cursor.execute('''
-            CREATE TABLE users (
+# Соединения с БД: по одному на поток, переиспользуются между запросами
+_db_local = threading.local()
+_db_connections = []
+_db_connections_lock = threading.Lock()
+
+# Открытие соединения с настроенными PRAGMA
+def _open_connection(path):
+    conn = sqlite3.connect(
+        path,
+        timeout=5.0,
+        cached_statements=app.config['DB_CACHED_STATEMENTS'],
+        check_same_thread=False
+    )
+    # До перехода в WAL: на новой БД место от удаленных строк возвращается
+    # через PRAGMA incremental_vacuum (archive.py), на существующей - не действует
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA busy_timeout = 5000')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute('PRAGMA cache_size = -8000')
+    return conn
+
+# Соединение текущего потока (создается при первом обращении)
+def _thread_connection():
+    path = app.config['DATABASE']
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None or _db_local.path != path:
+        conn = _open_connection(path)
+        _db_local.conn = conn
+        _db_local.path = path
+        with _db_connections_lock:
+            _db_connections.append(conn)
+    return conn
+
+# Получение соединения: внутри запроса привязано к контексту приложения
+def get_db():
+    if not has_app_context():
+        return _thread_connection()
+    if 'db' not in g:
+        g.db = _thread_connection()
+    return g.db
+
+# По завершении контекста откатываем незавершенную транзакцию, соединение остается в пуле
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop('db', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+# Закрытие всех соединений пула (при остановке, перед fork или при смене файла БД)
+def close_all_connections():
+    with _db_connections_lock:
+        while _db_connections:
+            try:
+                _db_connections.pop().close()
+            except sqlite3.ProgrammingError:
+                pass
+    _db_local.__dict__.clear()
+
+def _is_busy(exc):
+    code = getattr(exc, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    return 'locked' in str(exc) or 'busy' in str(exc)
+
+# Повтор транзакции записи при SQLITE_BUSY с растущей паузой. Функция должна
+# выполнять всю транзакцию целиком: при ошибке она откатывается и запускается заново
+def retry_busy(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = app.config['DB_BUSY_RETRIES']
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except sqlite3.OperationalError as exc:
+                if attempt == retries or not _is_busy(exc):
+                    raise
+                conn = get_db()
+                if conn.in_transaction:
+                    conn.rollback()
+                time.sleep(app.config['DB_BUSY_BACKOFF'] * (2 ** attempt) * (0.5 + random.random()))
+    return wrapper
+
+# Миграции схемы: (версия, описание, шаги). Шаг - SQL-выражение или функция от соединения.
+# Номер последней примененной миграции хранится в PRAGMA user_version
+MIGRATIONS = [
+    (1, 'Базовые таблицы', [
+        '''
+            CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 username TEXT UNIQUE NOT NULL,
                 email TEXT UNIQUE NOT NULL,
@@ -36,10 +204,9 @@ def init_db():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 last_login TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE game_history (
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS game_history (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER,
                 game_type TEXT,
@@ -49,179 +216,1573 @@ def init_db():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users (id)
             )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE user_sessions (
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS user_sessions (
                 session_id TEXT PRIMARY KEY,
                 user_id INTEGER,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 expires_at TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users (id)
             )
-        ''')
-        print("Таблицы базы данных созданы")
-    
-    conn.commit()
-    conn.close()
-    db_initialized = True
+        ''',
+    ]),
+    (2, 'Индексы истории игр и сессий', [
+        'CREATE INDEX IF NOT EXISTS idx_game_history_user_created ON game_history (user_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_game_history_user_game_result ON game_history (user_id, game_type, result)',
+        'CREATE INDEX IF NOT EXISTS idx_user_sessions_expires ON user_sessions (expires_at)',
+        'ANALYZE',
+    ]),
+    (3, 'Агрегированная статистика игр по пользователям', [
+        '''
+            CREATE TABLE IF NOT EXISTS user_game_stats (
+                user_id INTEGER NOT NULL,
+                game_type TEXT NOT NULL,
+                wins INTEGER NOT NULL DEFAULT 0,
+                losses INTEGER NOT NULL DEFAULT 0,
+                pushes INTEGER NOT NULL DEFAULT 0,
+                total_wagered INTEGER NOT NULL DEFAULT 0,
+                total_won INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, game_type),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            ) WITHOUT ROWID
+        ''',
+        # Заполнение по существующей истории. В истории блэкджека выигрыш записан
+        # за вычетом ставки, а при ничьей - нулем, поэтому выплату восстанавливаем
+        '''
+            INSERT OR REPLACE INTO user_game_stats
+                (user_id, game_type, wins, losses, pushes, total_wagered, total_won)
+            SELECT user_id, game_type,
+                   SUM(outcome = 'win'), SUM(outcome = 'loss'), SUM(outcome = 'push'),
+                   SUM(bet_amount), SUM(payout)
+            FROM (
+                SELECT user_id, game_type, bet_amount,
+                       CASE
+                           WHEN result = 'push' THEN 'push'
+                           WHEN result IN ('win', 'blackjack') OR substr(result, 1, 4) = 'win_'
+                                OR (game_type = 'slots' AND win_amount > 0) THEN 'win'
+                           ELSE 'loss'
+                       END AS outcome,
+                       CASE
+                           WHEN result = 'push' THEN bet_amount
+                           WHEN game_type = 'blackjack' AND win_amount > 0 THEN win_amount + bet_amount
+                           ELSE win_amount
+                       END AS payout
+                FROM game_history
+                WHERE user_id IS NOT NULL
+            )
+            GROUP BY user_id, game_type
+        ''',
+    ]),
+    (4, 'Серверное хранилище партий блэкджека', [
+        '''
+            CREATE TABLE IF NOT EXISTS blackjack_games (
+                session_id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            ) WITHOUT ROWID
+        ''',
+    ]),
+    # Постраничная история с фильтром по игре: keyset по (created_at, id) внутри игры.
+    # Индекс (user_id, game_type, result) больше не нужен - статистика в user_game_stats
+    (5, 'Индекс истории по игре и времени', [
+        'CREATE INDEX IF NOT EXISTS idx_game_history_user_game_created ON game_history (user_id, game_type, created_at)',
+        'DROP INDEX IF EXISTS idx_game_history_user_game_result',
+        'ANALYZE',
+    ]),
+    # Итоги по месяцам для истории, перенесенной в архив (archive.py)
+    (6, 'Помесячные итоги архивированной истории', [
+        '''
+            CREATE TABLE IF NOT EXISTS game_history_rollups (
+                user_id INTEGER NOT NULL,
+                month TEXT NOT NULL,
+                game_type TEXT NOT NULL,
+                rounds INTEGER NOT NULL DEFAULT 0,
+                wins INTEGER NOT NULL DEFAULT 0,
+                losses INTEGER NOT NULL DEFAULT 0,
+                pushes INTEGER NOT NULL DEFAULT 0,
+                total_bet INTEGER NOT NULL DEFAULT 0,
+                total_win INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, month, game_type),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            ) WITHOUT ROWID
+        ''',
+    ]),
+    # Ограничение числа сессий пользователя: сессии пользователя по сроку действия
+    (7, 'Индекс сессий по пользователю', [
+        'CREATE INDEX IF NOT EXISTS idx_user_sessions_user_expires ON user_sessions (user_id, expires_at)',
+    ]),
+    # Итоги для таблицы лидеров по периодам ('day', 'week', 'all'), играм и сводно по всем
+    # играм (game_type = 'all'); первые места каждой таблицы читаются по индексам без сортировки
+    (8, 'Итоги таблицы лидеров', [
+        '''
+            CREATE TABLE IF NOT EXISTS leaderboard_totals (
+                period TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                game_type TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                rounds INTEGER NOT NULL DEFAULT 0,
+                wagered INTEGER NOT NULL DEFAULT 0,
+                payout INTEGER NOT NULL DEFAULT 0,
+                profit INTEGER NOT NULL DEFAULT 0,
+                best_win INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (period, bucket, game_type, user_id),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_leaderboard_profit ON leaderboard_totals (period, bucket, game_type, profit)',
+        'CREATE INDEX IF NOT EXISTS idx_leaderboard_wagered ON leaderboard_totals (period, bucket, game_type, wagered)',
+        'CREATE INDEX IF NOT EXISTS idx_leaderboard_best_win ON leaderboard_totals (period, bucket, game_type, best_win)',
+        # За все время - по статистике (в ней учтена и архивированная история)
+        '''
+            INSERT OR REPLACE INTO leaderboard_totals
+                (period, bucket, game_type, user_id, rounds, wagered, payout, profit, best_win)
+            SELECT 'all', 'all', game_type, user_id, wins + losses + pushes,
+                   total_wagered, total_won, total_won - total_wagered, 0
+            FROM user_game_stats
+            UNION ALL
+            SELECT 'all', 'all', 'all', user_id, SUM(wins + losses + pushes),
+                   SUM(total_wagered), SUM(total_won), SUM(total_won - total_wagered), 0
+            FROM user_game_stats
+            GROUP BY user_id
+        ''',
+        # Текущие сутки и неделя, а также крупнейшие выигрыши за все время - по истории.
+        # Чистый выигрыш раунда восстанавливается так же, как выплата в миграции 3
+        '''
+            INSERT INTO leaderboard_totals
+                (period, bucket, game_type, user_id, rounds, wagered, payout, profit, best_win)
+            SELECT period, bucket, game, user_id, COUNT(*), SUM(bet_amount), SUM(bet_amount + net),
+                   SUM(net), MAX(0, MAX(net))
+            FROM (
+                SELECT periods.period, periods.bucket,
+                       CASE WHEN merged.value THEN 'all' ELSE game_type END AS game,
+                       user_id, bet_amount,
+                       CASE
+                           WHEN result = 'push' THEN 0
+                           WHEN game_type = 'blackjack' AND win_amount > 0 THEN win_amount
+                           WHEN game_type = 'blackjack' THEN -bet_amount
+                           ELSE win_amount - bet_amount
+                       END AS net
+                FROM game_history
+                JOIN (
+                    SELECT 'day' AS period, date('now') AS bucket, date('now') AS since
+                    UNION ALL
+                    SELECT 'week', date('now', 'weekday 0', '-6 days'), date('now', 'weekday 0', '-6 days')
+                    UNION ALL
+                    SELECT 'all', 'all', ''
+                ) AS periods ON game_history.created_at >= periods.since
+                JOIN (SELECT 0 AS value UNION ALL SELECT 1) AS merged
+                WHERE user_id IS NOT NULL
+            )
+            WHERE true
+            GROUP BY period, bucket, game, user_id
+            ON CONFLICT (period, bucket, game_type, user_id) DO UPDATE SET
+                best_win = excluded.best_win
+        ''',
+        'ANALYZE',
+    ]),
+    # Журнал движения средств: каждая проводка списывает amount со счета debit_account и
+    # зачисляет на credit_account (счета LEDGER_ACCOUNTS), balance - баланс игрока после нее.
+    # Снимки - проверенный остаток игрока на проводке entry_id: сверка идет от последнего снимка
+    (9, 'Журнал проводок и снимки балансов', [
+        '''
+            CREATE TABLE IF NOT EXISTS ledger_entries (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                game_type TEXT,
+                debit_account TEXT NOT NULL,
+                credit_account TEXT NOT NULL,
+                amount INTEGER NOT NULL CHECK (amount >= 0),
+                balance INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_ledger_entries_user ON ledger_entries (user_id, id)',
+        '''
+            CREATE TABLE IF NOT EXISTS ledger_checkpoints (
+                user_id INTEGER NOT NULL,
+                entry_id INTEGER NOT NULL,
+                balance INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, entry_id),
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            ) WITHOUT ROWID
+        ''',
+        # Прошлые движения не восстановить: текущий баланс записывается как входящий остаток
+        # и сразу становится первым снимком
+        '''
+            INSERT INTO ledger_entries (user_id, kind, debit_account, credit_account, amount, balance)
+            SELECT id, 'opening', 'grants', 'player', balance, balance
+            FROM users
+            ORDER BY id
+        ''',
+        '''
+            INSERT INTO ledger_checkpoints (user_id, entry_id, balance)
+            SELECT user_id, id, balance
+            FROM ledger_entries
+            WHERE kind = 'opening'
+        ''',
+    ]),
+    # Версия партии блэкджека: запись и расчет ставки проходят, только если партия
+    # не изменилась с момента чтения (параллельный запрос или другой воркер serve.py)
+    (10, 'Версия партий блэкджека', [
+        'ALTER TABLE blackjack_games ADD COLUMN version INTEGER NOT NULL DEFAULT 0',
+    ]),
+    # Выборка строк для архива (archive.py) по возрасту без полного просмотра game_history
+    (11, 'Индекс истории по времени', [
+        'CREATE INDEX IF NOT EXISTS idx_game_history_created ON game_history (created_at)',
+        'ANALYZE',
+    ]),
+]
+
+# Счета журнала проводок: кошелек игрока, касса казино (ставки и выплаты)
+# и начисления (стартовый баланс и сброс баланса)
+LEDGER_PLAYER = 'player'
+LEDGER_HOUSE = 'house'
+LEDGER_GRANTS = 'grants'
+LEDGER_ACCOUNTS = (LEDGER_PLAYER, LEDGER_HOUSE, LEDGER_GRANTS)
+
+# Применение недостающих миграций одной транзакцией под блокировкой записи
+# (target - применить миграции только до указанной версии включительно)
+def migrate(conn, target=None):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        current = conn.execute('PRAGMA user_version').fetchone()[0]
+        for version, description, steps in MIGRATIONS:
+            if version <= current or (target is not None and version > target):
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f'PRAGMA user_version = {version:d}')
+            print(f"Миграция {version}: {description}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+HISTORY_INSERT_SQL = '''INSERT INTO game_history
+           (user_id, game_type, bet_amount, win_amount, result, created_at)
+           VALUES (?, ?, ?, ?, ?, ?)'''
+
+LEDGER_INSERT_SQL = '''INSERT INTO ledger_entries
+           (user_id, kind, game_type, debit_account, credit_account, amount, balance)
+           VALUES (?, ?, ?, ?, ?, ?, ?)'''
+
+# Сверка по журналу: последний снимок (или нулевой остаток без снимков) плюс проводки после него.
+# Баланс в users и журнал читаются одним запросом - из одного состояния БД
+LEDGER_REPLAY_SQL = '''WITH checkpoint (entry_id, balance) AS (
+               SELECT entry_id, balance FROM ledger_checkpoints
+               WHERE user_id = ?1
+               ORDER BY entry_id DESC
+               LIMIT 1
+           )
+           SELECT users.balance, IFNULL(checkpoint.entry_id, 0), IFNULL(checkpoint.balance, 0),
+                  COUNT(entries.id), IFNULL(MAX(entries.id), IFNULL(checkpoint.entry_id, 0)),
+                  IFNULL(checkpoint.balance, 0) + IFNULL(SUM(CASE
+                      WHEN entries.credit_account = 'player' THEN entries.amount
+                      WHEN entries.debit_account = 'player' THEN -entries.amount
+                      ELSE 0
+                  END), 0)
+           FROM users
+           LEFT JOIN checkpoint ON 1
+           LEFT JOIN ledger_entries AS entries
+               ON entries.user_id = users.id AND entries.id > IFNULL(checkpoint.entry_id, 0)
+           WHERE users.id = ?1
+           GROUP BY users.id'''
+
+LEADERBOARD_UPSERT_SQL = '''INSERT INTO leaderboard_totals
+           (period, bucket, game_type, user_id, rounds, wagered, payout, profit, best_win)
+           VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, ?7 - ?6, ?8)
+           ON CONFLICT (period, bucket, game_type, user_id) DO UPDATE SET
+               rounds = rounds + excluded.rounds,
+               wagered = wagered + excluded.wagered,
+               payout = payout + excluded.payout,
+               profit = profit + excluded.profit,
+               best_win = MAX(best_win, excluded.best_win)'''
+
+STATS_UPSERT_SQL = '''INSERT INTO user_game_stats
+           (user_id, game_type, wins, losses, pushes, total_wagered, total_won)
+           VALUES (?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT (user_id, game_type) DO UPDATE SET
+               wins = wins + excluded.wins,
+               losses = losses + excluded.losses,
+               pushes = pushes + excluded.pushes,
+               total_wagered = total_wagered + excluded.total_wagered,
+               total_won = total_won + excluded.total_won'''
+
+# Исход игры по строке истории (как при заполнении user_game_stats в миграции 3)
+HISTORY_OUTCOME_SQL = '''CASE
+               WHEN result = 'push' THEN 'push'
+               WHEN result IN ('win', 'blackjack') OR substr(result, 1, 4) = 'win_'
+                    OR (game_type = 'slots' AND win_amount > 0) THEN 'win'
+               ELSE 'lose'
+           END'''
+
+HISTORY_OUTCOMES = ['win', 'lose', 'push']
+
+def history_outcome(game_type, win_amount, result):
+    if result == 'push':
+        return 'push'
+    if result in ('win', 'blackjack') or result.startswith('win_') or (game_type == 'slots' and win_amount > 0):
+        return 'win'
+    return 'lose'
+
+# Выплата раунда по строке истории (как total_won в user_game_stats). В истории блэкджека
+# выигрыш записан за вычетом ставки, а при ничьей - нулем
+def history_payout(game_type, bet_amount, win_amount, result):
+    if result == 'push':
+        return bet_amount
+    if game_type == 'blackjack' and win_amount > 0:
+        return win_amount + bet_amount
+    return win_amount
+
+USER_FIELDS = ('id', 'username', 'email', 'password_hash', 'balance')
+
+# Проводки расчета ставки (строки для LEDGER_INSERT_SQL): ставка из кошелька в кассу
+# и выплата из кассы в кошелек, нулевые суммы не записываются. balance - баланс после расчета
+def settlement_entries(user_id, game_type, debit, payout, balance):
+    entries = []
+    if debit:
+        entries.append((user_id, 'bet', game_type, LEDGER_PLAYER, LEDGER_HOUSE, debit, balance - payout))
+    if payout:
+        entries.append((user_id, 'payout', game_type, LEDGER_HOUSE, LEDGER_PLAYER, payout, balance))
+    return entries
+
+# Проводка установки баланса (kind - 'opening' или 'reset'): разница между старым
+# и новым балансом начисляется со счета начислений или возвращается на него
+def adjustment_entry(user_id, kind, old_balance, new_balance):
+    if new_balance >= old_balance:
+        return (user_id, kind, None, LEDGER_GRANTS, LEDGER_PLAYER, new_balance - old_balance, new_balance)
+    return (user_id, kind, None, LEDGER_PLAYER, LEDGER_GRANTS, old_balance - new_balance, new_balance)
+
+# Пользователь с таким именем или email уже существует
+class UserExistsError(Exception):
+    pass
+
+# Партия блэкджека изменена другим запросом после чтения (версия в хранилище новее)
+class GameConflictError(Exception):
+    pass
+
+# Интерфейс хранилища: пользователи, сессии, балансы, история, статистика и партии блэкджека.
+# Реализация выбирается через app.config['STORAGE'] (см. STORAGE_BACKENDS).
+# Строка истории - (user_id, game_type, bet_amount, win_amount, result, created_at),
+# строка статистики - (user_id, game_type, wins, losses, pushes, total_wagered, total_won)
+class Storage:
+    # Имеет ли смысл отложенная пакетная запись истории через HistoryJournal
+    write_behind = True
+
+    def __init__(self):
+        self.initialized = False
+
+    # Подготовка хранилища (схема БД), вызывается один раз через init_db
+    def initialize(self):
+        pass
+
+    # Создание пользователя с начальным балансом 1000 (проводка 'opening'); возвращает id.
+    # UserExistsError, если имя или email заняты
+    def create_user(self, username, email, password_hash):
+        raise NotImplementedError
+
+    # Пользователь по полю 'id', 'username' или 'email': словарь USER_FIELDS или None
+    def get_user(self, field, value):
+        raise NotImplementedError
+
+    # Есть ли пользователь с таким именем или таким email
+    def user_exists(self, username=None, email=None):
+        raise NotImplementedError
+
+    def touch_last_login(self, user_id):
+        raise NotImplementedError
+
+    def set_password_hash(self, user_id, password_hash):
+        raise NotImplementedError
+
+    # Новая сессия. При max_active > 0 у пользователя остается не больше max_active
+    # сессий (самые старые удаляются); возвращает список удаленных session_id
+    def create_session(self, session_id, user_id, lifetime, max_active=0):
+        raise NotImplementedError
+
+    # Действующая сессия: (user_id, секунд до истечения) или None
+    def get_session(self, session_id):
+        raise NotImplementedError
+
+    def delete_session(self, session_id):
+        raise NotImplementedError
+
+    # Удаление не более limit истекших сессий; число удаленных
+    def delete_expired_sessions(self, limit):
+        raise NotImplementedError
+
+    # Число сессий: (всего, из них истекших)
+    def count_sessions(self):
+        raise NotImplementedError
+
+    # Баланс пользователя или None, если пользователя нет
+    def get_balance(self, user_id):
+        raise NotImplementedError
+
+    # Установка баланса с проводкой 'reset' на разницу
+    def set_balance(self, user_id, balance):
+        raise NotImplementedError
+
+    # Списание ставки, если хватает средств (проводка 'bet'): новый баланс или None.
+    # game - (session_id, состояние) партии блэкджека, записывается в той же транзакции (см. save_game)
+    def debit(self, user_id, amount, game_type=None, game=None):
+        raise NotImplementedError
+
+    # Атомарный расчет: списание debit и начисление payout при balance >= debit,
+    # проводки settlement_entries, строки истории rows, приращение статистики stats
+    # и состояние партии game, как в debit. Новый баланс или None
+    def settle(self, user_id, debit, payout, stats, rows, game=None):
+        raise NotImplementedError
+
+    # Сверка баланса по журналу проводок от последнего снимка: (баланс пользователя,
+    # id проводки снимка, остаток снимка, число проводок после снимка, id последней проводки,
+    # остаток по журналу) или None, если пользователя нет
+    def replay_ledger(self, user_id):
+        raise NotImplementedError
+
+    # Снимок: остаток balance после проводки entry_id
+    def add_ledger_checkpoint(self, user_id, entry_id, balance):
+        raise NotImplementedError
+
+    def add_history(self, rows):
+        raise NotImplementedError
+
+    # Последние limit игр пользователя, новые первыми:
+    # список (game_type, bet_amount, win_amount, result, created_at)
+    def get_history(self, user_id, limit):
+        raise NotImplementedError
+
+    # Страница истории, новые первыми: строки (id, game_type, bet_amount, win_amount, result, created_at)
+    # строго до ключа before = (created_at, id); game_type и outcome ('win', 'lose', 'push') - фильтры
+    def get_history_page(self, user_id, limit, before=None, game_type=None, outcome=None):
+        raise NotImplementedError
+
+    # Статистика пользователя: список (game_type, wins, losses, pushes, total_wagered, total_won)
+    def get_stats(self, user_id):
+        raise NotImplementedError
+
+    # Удаление истории и статистики пользователя (журнал проводок не меняется)
+    def clear_history(self, user_id):
+        raise NotImplementedError
+
+    # Приращение итогов таблицы лидеров: строки (period, bucket, game_type, user_id,
+    # rounds, wagered, payout, best_win); суммы складываются, best_win - максимум
+    def add_leaderboard(self, rows):
+        raise NotImplementedError
+
+    # Первые limit мест по полю field ('best_win', 'profit' или 'wagered'):
+    # список (username, rounds, wagered, payout, best_win)
+    def get_leaderboard(self, period, bucket, game_type, field, limit):
+        raise NotImplementedError
+
+    # Удаление итогов периода period с ключом меньше bucket (прошедшие сутки и недели)
+    def prune_leaderboard(self, period, bucket):
+        raise NotImplementedError
+
+    # Состояние партии блэкджека (словарь с ключом 'version') или None, если партии нет или она чужая
+    def load_game(self, session_id, user_id):
+        raise NotImplementedError
+
+    # Версия партии или None (проверка кэша BlackjackStore без чтения состояния)
+    def get_game_version(self, session_id, user_id):
+        raise NotImplementedError
+
+    # Запись партии, если ее версия в хранилище равна state['version'] (без 'version' - новая
+    # партия, если ее еще нет); версия увеличивается на 1. GameConflictError, если версия другая
+    def save_game(self, session_id, user_id, state):
+        raise NotImplementedError
+
+    def delete_game(self, session_id):
+        raise NotImplementedError
+
+# Хранилище в SQLite (файл app.config['DATABASE'], соединения через get_db)
+class SQLiteStorage(Storage):
+    def initialize(self):
+        migrate(get_db())
+
+    @retry_busy
+    def create_user(self, username, email, password_hash):
+        conn = get_db()
+        try:
+            with conn:
+                user_id = conn.execute(
+                    'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+                    (username, email, password_hash)
+                ).lastrowid
+                balance = conn.execute('SELECT balance FROM users WHERE id = ?', (user_id,)).fetchone()[0]
+                conn.execute(LEDGER_INSERT_SQL, adjustment_entry(user_id, 'opening', 0, balance))
+        except sqlite3.IntegrityError as e:
+            raise UserExistsError(str(e)) from e
+        return user_id
+
+    def get_user(self, field, value):
+        if field not in ('id', 'username', 'email'):
+            raise ValueError(field)
+        cursor = get_db().execute(
+            f'SELECT id, username, email, password_hash, balance FROM users WHERE {field} = ?', (value,)
+        )
+        result = cursor.fetchone()
+        return dict(zip(USER_FIELDS, result)) if result else None
+
+    def user_exists(self, username=None, email=None):
+        cursor = get_db().execute(
+            'SELECT 1 FROM users WHERE username = ? OR email = ? LIMIT 1', (username, email)
+        )
+        return cursor.fetchone() is not None
+
+    @retry_busy
+    def touch_last_login(self, user_id):
+        conn = get_db()
+        with conn:
+            conn.execute('UPDATE users SET last_login = datetime("now") WHERE id = ?', (user_id,))
+
+    @retry_busy
+    def set_password_hash(self, user_id, password_hash):
+        conn = get_db()
+        with conn:
+            conn.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
+
+    @retry_busy
+    def create_session(self, session_id, user_id, lifetime, max_active=0):
+        conn = get_db()
+        evicted = []
+        with conn:
+            conn.execute(
+                'INSERT INTO user_sessions (session_id, user_id, expires_at) VALUES (?, ?, datetime("now", ?))',
+                (session_id, user_id, f'{int(lifetime):+d} seconds')
+            )
+            if max_active > 0:
+                # Срок у всех сессий одинаковый, поэтому самые старые истекают раньше
+                evicted = [row[0] for row in conn.execute(
+                    '''SELECT session_id FROM user_sessions
+                       WHERE user_id = ?
+                       ORDER BY expires_at DESC
+                       LIMIT -1 OFFSET ?''',
+                    (user_id, max_active)
+                )]
+                conn.executemany('DELETE FROM user_sessions WHERE session_id = ?',
+                                 [(old_id,) for old_id in evicted])
+        return evicted
+
+    def get_session(self, session_id):
+        cursor = get_db().execute(
+            '''SELECT user_id, (julianday(expires_at) - julianday('now')) * 86400
+               FROM user_sessions
+               WHERE session_id = ? AND expires_at > datetime("now")''',
+            (session_id,)
+        )
+        result = cursor.fetchone()
+        return tuple(result) if result else None
+
+    @retry_busy
+    def delete_session(self, session_id):
+        conn = get_db()
+        with conn:
+            conn.execute('DELETE FROM user_sessions WHERE session_id = ?', (session_id,))
+
+    # Пачка по индексу expires_at: транзакция записи не дольше одной пачки
+    @retry_busy
+    def delete_expired_sessions(self, limit):
+        conn = get_db()
+        with conn:
+            return conn.execute(
+                '''DELETE FROM user_sessions WHERE session_id IN (
+                       SELECT session_id FROM user_sessions
+                       WHERE expires_at <= datetime("now")
+                       LIMIT ?
+                   )''',
+                (limit,)
+            ).rowcount
+
+    def count_sessions(self):
+        total, expired = get_db().execute(
+            'SELECT COUNT(*), SUM(expires_at <= datetime("now")) FROM user_sessions'
+        ).fetchone()
+        return total, expired or 0
+
+    def get_balance(self, user_id):
+        result = get_db().execute('SELECT balance FROM users WHERE id = ?', (user_id,)).fetchone()
+        return result[0] if result else None
+
+    # BEGIN IMMEDIATE: старый баланс для проводки не меняется до конца транзакции
+    @retry_busy
+    def set_balance(self, user_id, balance):
+        conn = get_db()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            result = conn.execute('SELECT balance FROM users WHERE id = ?', (user_id,)).fetchone()
+            if result is None:
+                return
+            conn.execute('UPDATE users SET balance = ? WHERE id = ?', (balance, user_id))
+            conn.execute(LEDGER_INSERT_SQL, adjustment_entry(user_id, 'reset', result[0], balance))
+
+    @retry_busy
+    def debit(self, user_id, amount, game_type=None, game=None):
+        conn = get_db()
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'UPDATE users SET balance = balance - ? WHERE id = ? AND balance >= ?',
+                (amount, user_id, amount)
+            )
+            if cursor.rowcount == 0:
+                return None
+            if game is not None:
+                self._write_game(cursor, game[0], user_id, game[1])
+            cursor.execute('SELECT balance FROM users WHERE id = ?', (user_id,))
+            balance = cursor.fetchone()[0]
+            cursor.executemany(LEDGER_INSERT_SQL, settlement_entries(user_id, game_type, amount, 0, balance))
+            return balance
+
+    # Одна транзакция: условное обновление баланса, партия, проводки, история и статистика.
+    # При конфликте версии партии GameConflictError откатывает и изменение баланса
+    @retry_busy
+    def settle(self, user_id, debit, payout, stats, rows, game=None):
+        conn = get_db()
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'UPDATE users SET balance = balance - ? + ? WHERE id = ? AND balance >= ?',
+                (debit, payout, user_id, debit)
+            )
+            if cursor.rowcount == 0:
+                return None
+            if game is not None:
+                self._write_game(cursor, game[0], user_id, game[1])
+            cursor.execute('SELECT balance FROM users WHERE id = ?', (user_id,))
+            balance = cursor.fetchone()[0]
+            cursor.executemany(LEDGER_INSERT_SQL, settlement_entries(user_id, stats[1], debit, payout, balance))
+            if rows:
+                cursor.executemany(HISTORY_INSERT_SQL, rows)
+            cursor.execute(STATS_UPSERT_SQL, stats)
+            return balance
+
+    # Проводки после снимка - по индексу (user_id, id)
+    def replay_ledger(self, user_id):
+        result = get_db().execute(LEDGER_REPLAY_SQL, (user_id,)).fetchone()
+        return tuple(result) if result else None
+
+    @retry_busy
+    def add_ledger_checkpoint(self, user_id, entry_id, balance):
+        conn = get_db()
+        with conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO ledger_checkpoints (user_id, entry_id, balance) VALUES (?, ?, ?)',
+                (user_id, entry_id, balance)
+            )
+
+    @retry_busy
+    def add_history(self, rows):
+        conn = get_db()
+        with conn:
+            conn.executemany(HISTORY_INSERT_SQL, rows)
+
+    def get_history(self, user_id, limit):
+        cursor = get_db().execute(
+            '''SELECT game_type, bet_amount, win_amount, result, created_at 
+               FROM game_history 
+               WHERE user_id = ? 
+               ORDER BY created_at DESC 
+               LIMIT ?''',
+            (user_id, limit)
+        )
+        return cursor.fetchall()
+
+    # Keyset по индексам (user_id, created_at) и (user_id, game_type, created_at): без OFFSET
+    def get_history_page(self, user_id, limit, before=None, game_type=None, outcome=None):
+        sql = ['''SELECT id, game_type, bet_amount, win_amount, result, created_at
+           FROM game_history
+           WHERE user_id = ?''']
+        params = [user_id]
+        if game_type is not None:
+            sql.append('AND game_type = ?')
+            params.append(game_type)
+        if outcome is not None:
+            sql.append(f'AND {HISTORY_OUTCOME_SQL} = ?')
+            params.append(outcome)
+        if before is not None:
+            sql.append('AND (created_at, id) < (?, ?)')
+            params.extend(before)
+        sql.append('ORDER BY created_at DESC, id DESC LIMIT ?')
+        params.append(limit)
+        return get_db().execute('\n           '.join(sql), params).fetchall()
+
+    def get_stats(self, user_id):
+        cursor = get_db().execute(
+            '''SELECT game_type, wins, losses, pushes, total_wagered, total_won
+               FROM user_game_stats
+               WHERE user_id = ?''',
+            (user_id,)
+        )
+        return cursor.fetchall()
+
+    @retry_busy
+    def clear_history(self, user_id):
+        conn = get_db()
+        with conn:
+            conn.execute('DELETE FROM game_history WHERE user_id = ?', (user_id,))
+            conn.execute('DELETE FROM game_history_rollups WHERE user_id = ?', (user_id,))
+            conn.execute('DELETE FROM user_game_stats WHERE user_id = ?', (user_id,))
+            conn.execute('DELETE FROM leaderboard_totals WHERE user_id = ?', (user_id,))
+
+    @retry_busy
+    def add_leaderboard(self, rows):
+        conn = get_db()
+        with conn:
+            conn.executemany(LEADERBOARD_UPSERT_SQL, rows)
+
+    # ORDER BY по индексу (period, bucket, game_type, поле); user_id входит в ключ индекса
+    def get_leaderboard(self, period, bucket, game_type, field, limit):
+        if field not in ('best_win', 'profit', 'wagered'):
+            raise ValueError(field)
+        cursor = get_db().execute(
+            f'''SELECT users.username, totals.rounds, totals.wagered, totals.payout, totals.best_win
+               FROM leaderboard_totals AS totals
+               JOIN users ON users.id = totals.user_id
+               WHERE totals.period = ? AND totals.bucket = ? AND totals.game_type = ?
+               ORDER BY totals.{field} DESC, totals.user_id DESC
+               LIMIT ?''',
+            (period, bucket, game_type, limit)
+        )
+        return cursor.fetchall()
+
+    @retry_busy
+    def prune_leaderboard(self, period, bucket):
+        conn = get_db()
+        with conn:
+            conn.execute('DELETE FROM leaderboard_totals WHERE period = ? AND bucket < ?', (period, bucket))
 
-# Хеширование пароля
+    def load_game(self, session_id, user_id):
+        cursor = get_db().execute(
+            'SELECT state, version FROM blackjack_games WHERE session_id = ? AND user_id = ?',
+            (session_id, user_id)
+        )
+        result = cursor.fetchone()
+        if not result:
+            return None
+        state = json.loads(result[0])
+        state['version'] = result[1]
+        return state
+
+    def get_game_version(self, session_id, user_id):
+        result = get_db().execute(
+            'SELECT version FROM blackjack_games WHERE session_id = ? AND user_id = ?',
+            (session_id, user_id)
+        ).fetchone()
+        return result[0] if result else None
+
+    @retry_busy
+    def save_game(self, session_id, user_id, state):
+        conn = get_db()
+        with conn:
+            self._write_game(conn.cursor(), session_id, user_id, state)
+
+    # Условная запись партии внутри транзакции вызывающего
+    @staticmethod
+    def _write_game(cursor, session_id, user_id, state):
+        data = json.dumps({key: value for key, value in state.items() if key != 'version'},
+                          ensure_ascii=False, separators=(',', ':'))
+        if state.get('version') is None:
+            cursor.execute(
+                '''INSERT INTO blackjack_games (session_id, user_id, state, version, updated_at)
+                   VALUES (?, ?, ?, 1, datetime("now"))
+                   ON CONFLICT (session_id) DO NOTHING''',
+                (session_id, user_id, data)
+            )
+        else:
+            cursor.execute(
+                '''UPDATE blackjack_games
+                   SET state = ?, version = version + 1, updated_at = datetime("now")
+                   WHERE session_id = ? AND user_id = ? AND version = ?''',
+                (data, session_id, user_id, state['version'])
+            )
+        if cursor.rowcount == 0:
+            raise GameConflictError(session_id)
+
+    @retry_busy
+    def delete_game(self, session_id):
+        conn = get_db()
+        with conn:
+            conn.execute('DELETE FROM blackjack_games WHERE session_id = ?', (session_id,))
+
+# Хранилище в памяти процесса: словари и списки под одной блокировкой.
+# Без диска и без общего состояния между процессами - для тестов, бенчмарков
+# и запуска в один процесс; данные теряются при перезапуске
+class MemoryStorage(Storage):
+    write_behind = False
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.RLock()
+        self.users = {}
+        self.user_by_username = {}
+        self.user_by_email = {}
+        # session_id -> (user_id, истекает_в по time.time())
+        self.sessions = {}
+        # user_id -> {session_id: None} в порядке создания
+        self.user_sessions = {}
+        # user_id -> список строк истории (id, *строка) в порядке записи
+        self.history = {}
+        self.history_ids = itertools.count(1)
+        # user_id -> {game_type: [wins, losses, pushes, total_wagered, total_won]}
+        self.stats = {}
+        # session_id -> (user_id, состояние с ключом 'version')
+        self.games = {}
+        # (period, bucket, game_type) -> {user_id: [rounds, wagered, payout, best_win]}
+        self.leaderboard = {}
+        # user_id -> проводки (id, kind, game_type, debit_account, credit_account, amount, balance, created_at)
+        self.ledger = {}
+        self.ledger_ids = itertools.count(1)
+        # user_id -> снимки (entry_id, balance, число проводок пользователя на момент снимка)
+        self.checkpoints = {}
+
+    @staticmethod
+    def now():
+        return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+
+    def create_user(self, username, email, password_hash):
+        with self.lock:
+            if username in self.user_by_username or email in self.user_by_email:
+                raise UserExistsError(username)
+            user_id = len(self.users) + 1
+            self.users[user_id] = {
+                'id': user_id,
+                'username': username,
+                'email': email,
+                'password_hash': password_hash,
+                'balance': 1000,
+                'created_at': self.now(),
+                'last_login': self.now()
+            }
+            self.user_by_username[username] = user_id
+            self.user_by_email[email] = user_id
+            self._add_ledger([adjustment_entry(user_id, 'opening', 0, 1000)])
+            return user_id
+
+    def get_user(self, field, value):
+        with self.lock:
+            if field == 'id':
+                user = self.users.get(value)
+            elif field == 'username':
+                user = self.users.get(self.user_by_username.get(value))
+            elif field == 'email':
+                user = self.users.get(self.user_by_email.get(value))
+            else:
+                raise ValueError(field)
+            return {key: user[key] for key in USER_FIELDS} if user else None
+
+    def user_exists(self, username=None, email=None):
+        with self.lock:
+            return username in self.user_by_username or email in self.user_by_email
+
+    def touch_last_login(self, user_id):
+        with self.lock:
+            user = self.users.get(user_id)
+            if user is not None:
+                user['last_login'] = self.now()
+
+    def set_password_hash(self, user_id, password_hash):
+        with self.lock:
+            user = self.users.get(user_id)
+            if user is not None:
+                user['password_hash'] = password_hash
+
+    def create_session(self, session_id, user_id, lifetime, max_active=0):
+        with self.lock:
+            self.sessions[session_id] = (user_id, time.time() + lifetime)
+            own = self.user_sessions.setdefault(user_id, {})
+            own[session_id] = None
+            evicted = list(own)[:-max_active] if max_active > 0 else []
+            for old_id in evicted:
+                self._remove_session(old_id)
+            return evicted
+
+    def get_session(self, session_id):
+        with self.lock:
+            entry = self.sessions.get(session_id)
+            if entry is None:
+                return None
+            left = entry[1] - time.time()
+            if left <= 0:
+                self._remove_session(session_id)
+                return None
+            return entry[0], left
+
+    def delete_session(self, session_id):
+        with self.lock:
+            self._remove_session(session_id)
+
+    def _remove_session(self, session_id):
+        entry = self.sessions.pop(session_id, None)
+        if entry is not None:
+            own = self.user_sessions.get(entry[0])
+            own.pop(session_id, None)
+            if not own:
+                del self.user_sessions[entry[0]]
+
+    def delete_expired_sessions(self, limit):
+        now = time.time()
+        with self.lock:
+            expired = [session_id for session_id, (_, expires) in self.sessions.items() if expires <= now]
+            for session_id in expired[:limit]:
+                self._remove_session(session_id)
+            return min(len(expired), limit)
+
+    def count_sessions(self):
+        now = time.time()
+        with self.lock:
+            return len(self.sessions), sum(1 for _, expires in self.sessions.values() if expires <= now)
+
+    def get_balance(self, user_id):
+        with self.lock:
+            user = self.users.get(user_id)
+            return user['balance'] if user else None
+
+    def set_balance(self, user_id, balance):
+        with self.lock:
+            user = self.users.get(user_id)
+            if user is not None:
+                self._add_ledger([adjustment_entry(user_id, 'reset', user['balance'], balance)])
+                user['balance'] = balance
+
+    def debit(self, user_id, amount, game_type=None, game=None):
+        with self.lock:
+            user = self.users.get(user_id)
+            if user is None or user['balance'] < amount:
+                return None
+            if game is not None:
+                self._write_game(game[0], user_id, game[1])
+            user['balance'] -= amount
+            self._add_ledger(settlement_entries(user_id, game_type, amount, 0, user['balance']))
+            return user['balance']
+
+    def settle(self, user_id, debit, payout, stats, rows, game=None):
+        with self.lock:
+            user = self.users.get(user_id)
+            if user is None or user['balance'] < debit:
+                return None
+            if game is not None:
+                self._write_game(game[0], user_id, game[1])
+            user['balance'] += payout - debit
+            self._add_ledger(settlement_entries(user_id, stats[1], debit, payout, user['balance']))
+            if rows:
+                self.add_history(rows)
+            totals = self.stats.setdefault(user_id, {}).setdefault(stats[1], [0, 0, 0, 0, 0])
+            for i, value in enumerate(stats[2:]):
+                totals[i] += value
+            return user['balance']
+
+    def _add_ledger(self, entries):
+        for user_id, *entry in entries:
+            self.ledger.setdefault(user_id, []).append((next(self.ledger_ids), *entry, self.now()))
+
+    def replay_ledger(self, user_id):
+        with self.lock:
+            user = self.users.get(user_id)
+            if user is None:
+                return None
+            entry_id, balance, position = self.checkpoints.get(user_id, [(0, 0, 0)])[-1]
+            entries = self.ledger.get(user_id, [])[position:]
+            ledger_balance = balance
+            for entry in entries:
+                if entry[4] == LEDGER_PLAYER:
+                    ledger_balance += entry[5]
+                elif entry[3] == LEDGER_PLAYER:
+                    ledger_balance -= entry[5]
+            last_entry = entries[-1][0] if entries else entry_id
+            return user['balance'], entry_id, balance, len(entries), last_entry, ledger_balance
+
+    def add_ledger_checkpoint(self, user_id, entry_id, balance):
+        with self.lock:
+            entries = self.ledger.get(user_id, [])
+            # Снимок обычно ставится на одну из последних проводок: поиск с конца
+            position = len(entries)
+            while position and entries[position - 1][0] > entry_id:
+                position -= 1
+            checkpoints = self.checkpoints.setdefault(user_id, [])
+            if not checkpoints or checkpoints[-1][0] < entry_id:
+                checkpoints.append((entry_id, balance, position))
+
+    def add_history(self, rows):
+        with self.lock:
+            for row in rows:
+                self.history.setdefault(row[0], []).append((next(self.history_ids),) + row)
+
+    def get_history(self, user_id, limit):
+        with self.lock:
+            rows = self.history.get(user_id, [])
+            return [row[2:] for row in reversed(rows[-limit:])] if limit > 0 else []
+
+    def get_history_page(self, user_id, limit, before=None, game_type=None, outcome=None):
+        page = []
+        with self.lock:
+            rows = self.history.get(user_id, [])
+            for row in sorted(rows, key=lambda row: (row[6], row[0]), reverse=True):
+                if before is not None and (row[6], row[0]) >= tuple(before):
+                    continue
+                if game_type is not None and row[2] != game_type:
+                    continue
+                if outcome is not None and history_outcome(row[2], row[4], row[5]) != outcome:
+                    continue
+                page.append((row[0],) + row[2:])
+                if len(page) >= limit:
+                    break
+        return page
+
+    def get_stats(self, user_id):
+        with self.lock:
+            return [(game_type, *totals) for game_type, totals in self.stats.get(user_id, {}).items()]
+
+    def clear_history(self, user_id):
+        with self.lock:
+            self.history.pop(user_id, None)
+            self.stats.pop(user_id, None)
+            for totals in self.leaderboard.values():
+                totals.pop(user_id, None)
+
+    def add_leaderboard(self, rows):
+        with self.lock:
+            for period, bucket, game_type, user_id, rounds, wagered, payout, best_win in rows:
+                totals = self.leaderboard.setdefault((period, bucket, game_type), {})
+                entry = totals.setdefault(user_id, [0, 0, 0, 0])
+                entry[0] += rounds
+                entry[1] += wagered
+                entry[2] += payout
+                entry[3] = max(entry[3], best_win)
+
+    # Первые места - heapq.nlargest по итогам периода: O(n log limit)
+    def get_leaderboard(self, period, bucket, game_type, field, limit):
+        keys = {
+            'best_win': lambda item: (item[1][3], item[0]),
+            'profit': lambda item: (item[1][2] - item[1][1], item[0]),
+            'wagered': lambda item: (item[1][1], item[0]),
+        }
+        with self.lock:
+            totals = self.leaderboard.get((period, bucket, game_type), {})
+            top = heapq.nlargest(limit, totals.items(), key=keys[field])
+            return [(self.users[user_id]['username'], *entry) for user_id, entry in top]
+
+    def prune_leaderboard(self, period, bucket):
+        with self.lock:
+            for key in [key for key in self.leaderboard if key[0] == period and key[1] < bucket]:
+                del self.leaderboard[key]
+
+    def load_game(self, session_id, user_id):
+        with self.lock:
+            entry = self.games.get(session_id)
+            if entry is None or entry[0] != user_id:
+                return None
+            return copy.deepcopy(entry[1])
+
+    def get_game_version(self, session_id, user_id):
+        with self.lock:
+            entry = self.games.get(session_id)
+            return entry[1]['version'] if entry is not None and entry[0] == user_id else None
+
+    def save_game(self, session_id, user_id, state):
+        with self.lock:
+            self._write_game(session_id, user_id, state)
+
+    def _write_game(self, session_id, user_id, state):
+        entry = self.games.get(session_id)
+        if state.get('version') is None:
+            current = None if entry is None else entry[1]['version']
+        else:
+            current = entry[1]['version'] if entry is not None and entry[0] == user_id else -1
+        if current != state.get('version'):
+            raise GameConflictError(session_id)
+        saved = copy.deepcopy(state)
+        saved['version'] = (current or 0) + 1
+        self.games[session_id] = (user_id, saved)
+
+    def delete_game(self, session_id):
+        with self.lock:
+            self.games.pop(session_id, None)
+
+STORAGE_BACKENDS = {
+    'sqlite': SQLiteStorage,
+    'memory': MemoryStorage,
+}
+
+_storage = None
+_storage_lock = threading.Lock()
+
+# Хранилище для текущей конфигурации. Создается заново при смене STORAGE или DATABASE
+def get_storage():
+    global _storage
+    key = (app.config['STORAGE'], app.config['DATABASE'])
+    storage = _storage
+    if storage is None or storage.key != key:
+        with _storage_lock:
+            if _storage is None or _storage.key != key:
+                _storage = STORAGE_BACKENDS[app.config['STORAGE']]()
+                if 'metrics' in app.extensions:
+                    _storage = app.extensions['metrics'].wrap_storage(_storage)
+                _storage.key = key
+            storage = _storage
+    return storage
+
+# Инициализация хранилища (миграции БД) один раз на процесс.
+# serve.py вызывает init_db до fork, и воркеры наследуют инициализированное хранилище
+def init_db():
+    storage = get_storage()
+    if storage.initialized:
+        return
+    storage.initialize()
+    storage.initialized = True
+
+_password_hasher = None
+_password_hasher_lock = threading.Lock()
+
+# Пул хеширования паролей; в режиме TESTING хеши считаются в текущем потоке
+def get_password_hasher():
+    global _password_hasher
+    with _password_hasher_lock:
+        if _password_hasher is None:
+            _password_hasher = passwords.PasswordHasher(
+                0 if app.config['TESTING'] else app.config['PASSWORD_WORKERS'],
+                app.config['PASSWORD_MAX_PENDING'],
+                app.config['PASSWORD_TIMEOUT']
+            )
+        return _password_hasher
+
+# Остановка процессов пула (при остановке сервера)
+def shutdown_password_hasher():
+    global _password_hasher
+    with _password_hasher_lock:
+        hasher, _password_hasher = _password_hasher, None
+    if hasher is not None:
+        hasher.shutdown()
+
+# Хеширование пароля; PasswordHasherBusy, если пул перегружен
 def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+    return get_password_hasher().call(
+        passwords.hash_password, password, app.config['PASSWORD_SCHEME'], app.config['PASSWORD_COST'])
 
-# Проверка пароля
-def verify_password(password, password_hash):
-    return hash_password(password) == password_hash
+# Проверка пароля пользователя. Устаревший хеш (SHA-256 или другая схема и стоимость)
+# после успешной проверки заменяется новым. PasswordHasherBusy, если пул перегружен
+def verify_user_password(user, password):
+    valid, new_hash = get_password_hasher().call(
+        passwords.verify_and_rehash, password, user['password_hash'],
+        app.config['PASSWORD_SCHEME'], app.config['PASSWORD_COST'])
+    if new_hash is not None:
+        get_storage().set_password_hash(user['id'], new_hash)
+    return valid
 
-# Получение пользователя по ID через SELECT
+# Получение пользователя по ID
 def get_user_by_id(user_id):
-    conn = sqlite3.connect('casino.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, username, email, password_hash, balance FROM users WHERE id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    
-    if result:
-        return {
-            'id': result[0],
-            'username': result[1],
-            'email': result[2],
-            'password_hash': result[3],
-            'balance': result[4]
-        }
-    return None
+    return get_storage().get_user('id', user_id)
 
-# Получение пользователя по имени через SELECT
+# Получение пользователя по имени
 def get_user_by_username(username):
-    conn = sqlite3.connect('casino.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, username, email, password_hash, balance FROM users WHERE username = ?', (username,))
-    result = cursor.fetchone()
-    conn.close()
-    
-    if result:
-        return {
-            'id': result[0],
-            'username': result[1],
-            'email': result[2],
-            'password_hash': result[3],
-            'balance': result[4]
-        }
-    return None
+    return get_storage().get_user('username', username)
 
-# Проверка существования пользователя по email через SELECT
+# Проверка существования пользователя по email
 def get_user_by_email(email):
-    conn = sqlite3.connect('casino.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, username, email FROM users WHERE email = ?', (email,))
-    result = cursor.fetchone()
-    conn.close()
-    
-    if result:
-        return {
-            'id': result[0],
-            'username': result[1],
-            'email': result[2]
-        }
-    return None
+    return get_storage().get_user('email', email)
 
-# Проверка существования пользователя через SELECT (универсальная функция)
+# Проверка существования пользователя (универсальная функция)
 def check_user_exists(username=None, email=None):
-    conn = sqlite3.connect('casino.db')
-    cursor = conn.cursor()
-    
-    if username and email:
-        cursor.execute('SELECT id FROM users WHERE username = ? OR email = ?', (username, email))
-    elif username:
-        cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
-    elif email:
-        cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
-    else:
-        conn.close()
+    if not username and not email:
         return False
-    
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+    return get_storage().user_exists(username=username or None, email=email or None)
+
+# Создание пользователя; UserExistsError, если имя или email заняты
+def create_user(username, email, password):
+    return get_storage().create_user(username, email, hash_password(password))
+
+# Время жизни сессии входа (сек)
+SESSION_LIFETIME = 7 * 24 * 3600
 
-# Создание сессии
+# Создание сессии; сверх SESSION_MAX_PER_USER самые старые сессии пользователя удаляются
 def create_session(user_id):
     session_id = secrets.token_urlsafe(32)
-    conn = sqlite3.connect('casino.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        'INSERT INTO user_sessions (session_id, user_id, expires_at) VALUES (?, ?, datetime("now", "+7 days"))',
-        (session_id, user_id)
-    )
-    conn.commit()
-    conn.close()
+    evicted = get_storage().create_session(session_id, user_id, SESSION_LIFETIME,
+                                           app.config['SESSION_MAX_PER_USER'])
+    for old_id in evicted:
+        session_cache.invalidate(old_id)
+    session_sweeper.ensure_started()
     return session_id
 
-# Проверка сессии через SELECT
+# Проверка сессии без кэша
 def verify_session(session_id):
-    conn = sqlite3.connect('casino.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        'SELECT user_id FROM user_sessions WHERE session_id = ? AND expires_at > datetime("now")',
-        (session_id,)
-    )
-    result = cursor.fetchone()
-    conn.close()
+    result = get_storage().get_session(session_id)
     return result[0] if result else None
 
 # Удаление сессии
 def delete_session(session_id):
-    conn = sqlite3.connect('casino.db')
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM user_sessions WHERE session_id = ?', (session_id,))
-    conn.commit()
-    conn.close()
+    session_cache.invalidate(session_id)
+    get_storage().delete_session(session_id)
+
+# LRU-кэш проверенных сессий: session_id -> [user_id, истекает_в, last_login_обновлен_в].
+# Запись живет не дольше SESSION_CACHE_TTL и не дольше самой сессии.
+# Кэш локален для процесса: удаление сессии в другом процессе видно через TTL.
+# Истекшая по TTL запись остается до перепроверки сессии: put() переносит из нее время
+# обновления last_login, иначе перезагрузка каждые SESSION_CACHE_TTL секунд обходила бы LAST_LOGIN_INTERVAL
+class SessionCache:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(session_id)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                return None
+            self.entries.move_to_end(session_id)
+            return entry
+
+    def put(self, session_id, user_id, expires_in):
+        now = time.monotonic()
+        entry = [user_id, now + min(app.config['SESSION_CACHE_TTL'], expires_in), 0.0]
+        with self.lock:
+            previous = self.entries.get(session_id)
+            if previous is not None and previous[0] == user_id:
+                entry[2] = previous[2]
+            self.entries[session_id] = entry
+            self.entries.move_to_end(session_id)
+            while len(self.entries) > app.config['SESSION_CACHE_SIZE']:
+                self.entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, session_id):
+        with self.lock:
+            self.entries.pop(session_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+session_cache = SessionCache()
+
+# Проверка сессии с кэшем: запись кэша или None, если сессия недействительна
+def verify_session_cached(session_id):
+    entry = session_cache.get(session_id)
+    if entry is not None:
+        return entry
+
+    result = get_storage().get_session(session_id)
+    if not result:
+        session_cache.invalidate(session_id)
+        return None
+    return session_cache.put(session_id, result[0], result[1])
+
+# Обновление времени последнего входа не чаще LAST_LOGIN_INTERVAL на сессию
+def touch_last_login(entry):
+    now = time.monotonic()
+    if entry[2] and now - entry[2] < app.config['LAST_LOGIN_INTERVAL']:
+        return
+    entry[2] = now
+    get_storage().touch_last_login(entry[0])
+
+# Фоновая очистка истекших сессий: раз в SESSION_SWEEP_INTERVAL секунд удаляет их
+# пачками по SESSION_SWEEP_BATCH (между пачками база свободна для запросов).
+# Поток запускается при первом входе; в режиме TESTING не запускается - sweep() вызывается явно
+class SessionSweeper:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = None
+        self.deleted_total = 0
+        self.last_run = None
+
+    def ensure_started(self):
+        if self.thread is not None or app.config['TESTING'] or not app.config['SESSION_SWEEP_INTERVAL']:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='session-sweeper', daemon=True)
+                self.thread.start()
+
+    # Один проход: удаляет все истекшие сессии; число удаленных
+    def sweep(self):
+        storage = get_storage()
+        batch = app.config['SESSION_SWEEP_BATCH']
+        deleted = 0
+        while not self.stopping:
+            count = storage.delete_expired_sessions(batch)
+            deleted += count
+            if count < batch:
+                break
+        self.deleted_total += deleted
+        self.last_run = time.time()
+        if deleted:
+            total, expired = storage.count_sessions()
+            logging.info('Очистка сессий: удалено %d истекших, осталось %d (истекших %d)',
+                         deleted, total, expired)
+        return deleted
+
+    def _run(self):
+        while not self.stopping:
+            try:
+                self.sweep()
+            except sqlite3.Error:
+                logging.exception('Ошибка очистки сессий')
+            self.wakeup.wait(app.config['SESSION_SWEEP_INTERVAL'])
+
+    def stop(self):
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.wakeup.clear()
+        self.stopping = False
 
-# Получение баланса пользователя через SELECT
+session_sweeper = SessionSweeper()
+atexit.register(session_sweeper.stop)
+
+# Получение баланса пользователя
 def get_user_balance(user_id):
-    conn = sqlite3.connect('casino.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT balance FROM users WHERE id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else 1000
-
-# Обновление баланса
+    balance = get_storage().get_balance(user_id)
+    return balance if balance is not None else 1000
+
+# Обновление баланса (разница записывается в журнал проводкой 'reset')
 def update_user_balance(user_id, new_balance):
-    conn = sqlite3.connect('casino.db')
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET balance = ? WHERE id = ?', (new_balance, user_id))
-    conn.commit()
-    conn.close()
+    get_storage().set_balance(user_id, new_balance)
+    ledger_checkpointer.mark(user_id)
+
+ledger_log = logging.getLogger('casino.ledger')
+
+# Сверка баланса с журналом проводок: остаток последнего снимка плюс проводки после него,
+# поэтому время сверки не зависит от длины истории счета. Если балансы сошлись и после снимка
+# набралось не меньше LEDGER_CHECKPOINT_ENTRIES проводок, сохраняется новый снимок.
+# Словарь (balance, ledger_balance, checkpoint - id проводки снимка, replayed, ok) или None
+def verify_balance(user_id):
+    storage = get_storage()
+    result = storage.replay_ledger(user_id)
+    if result is None:
+        return None
+    balance, checkpoint, _, replayed, last_entry, ledger_balance = result
+    ok = balance == ledger_balance
+    if not ok:
+        ledger_log.warning('Баланс пользователя %s (%s) не сходится с журналом (%s)',
+                           user_id, balance, ledger_balance)
+    elif replayed >= app.config['LEDGER_CHECKPOINT_ENTRIES']:
+        storage.add_ledger_checkpoint(user_id, last_entry, ledger_balance)
+        checkpoint, replayed = last_entry, 0
+    return {
+        'balance': balance,
+        'ledger_balance': ledger_balance,
+        'checkpoint': checkpoint,
+        'replayed': replayed,
+        'ok': ok
+    }
+
+# Фоновая сверка: раз в LEDGER_CHECKPOINT_INTERVAL секунд сверяет балансы игроков, у которых
+# с прошлого прохода были проводки в этом процессе, и при необходимости ставит снимки.
+# Поток запускается при первой проводке; в режиме TESTING не запускается - run_once() вызывается явно
+class LedgerCheckpointer:
+    def __init__(self):
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = None
+
+    def mark(self, user_id):
+        with self.lock:
+            self.dirty.add(user_id)
+        if self.thread is not None or app.config['TESTING'] or not app.config['LEDGER_CHECKPOINT_INTERVAL']:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='ledger-checkpointer', daemon=True)
+                self.thread.start()
+
+    # Один проход; число сверенных счетов
+    def run_once(self):
+        with self.lock:
+            users, self.dirty = self.dirty, set()
+        for user_id in users:
+            if self.stopping:
+                break
+            verify_balance(user_id)
+        return len(users)
+
+    def _run(self):
+        while not self.stopping:
+            self.wakeup.wait(app.config['LEDGER_CHECKPOINT_INTERVAL'])
+            try:
+                self.run_once()
+            except sqlite3.Error:
+                logging.exception('Ошибка сверки журнала проводок')
+
+    def stop(self):
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.wakeup.clear()
+        self.stopping = False
+
+ledger_checkpointer = LedgerCheckpointer()
+atexit.register(ledger_checkpointer.stop)
+
+# Журнал истории игр: строки копятся в очереди и записываются фоновым потоком
+# одной транзакцией через executemany (по размеру пакета или по таймеру)
+class HistoryJournal:
+    def __init__(self):
+        self.pending = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = None
+
+    # Синхронный режим: каждая строка пишется сразу (для тестов)
+    @property
+    def synchronous(self):
+        return (app.config['TESTING'] or not app.config['HISTORY_WRITE_BEHIND']
+                or not get_storage().write_behind)
+
+    @staticmethod
+    def make_row(user_id, game_type, bet_amount, win_amount, result):
+        created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        return (user_id, game_type, bet_amount, win_amount, result, created_at)
+
+    def append(self, row):
+        if self.synchronous:
+            get_storage().add_history([row])
+            return
+
+        with self.lock:
+            self.pending.append(row)
+            full = len(self.pending) >= app.config['HISTORY_BATCH_SIZE']
+            if self.thread is None:
+                self._start()
+        if full:
+            self.wakeup.set()
+
+    # Запись всех накопленных строк одной транзакцией
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                rows, self.pending = self.pending, []
+            if not rows:
+                return 0
+            try:
+                get_storage().add_history(rows)
+            except sqlite3.Error:
+                # Возвращаем строки в начало очереди, повторим при следующем сбросе
+                with self.lock:
+                    self.pending[:0] = rows
+                raise
+            return len(rows)
+
+    def _start(self):
+        self.thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopping:
+            self.wakeup.wait(app.config['HISTORY_FLUSH_INTERVAL'])
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                logging.exception('Ошибка записи истории игр')
+
+    # Остановка писателя с гарантированным сбросом очереди
+    def stop(self):
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+        self.stopping = False
+
+history_journal = HistoryJournal()
+atexit.register(history_journal.stop)
 
 # Добавление в историю игр
 def add_game_history(user_id, game_type, bet_amount, win_amount, result):
-    conn = sqlite3.connect('casino.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        '''INSERT INTO game_history 
-           (user_id, game_type, bet_amount, win_amount, result) 
-           VALUES (?, ?, ?, ?, ?)''',
-        (user_id, game_type, bet_amount, win_amount, result)
+    history_journal.append(HistoryJournal.make_row(user_id, game_type, bet_amount, win_amount, result))
+
+# Списание ставки без расчета (блэкджек: раунд продолжается). game - (session_id, состояние)
+# партии, записываемое вместе со списанием; GameConflictError, если партию уже изменили.
+# Возвращает новый баланс или None, если средств недостаточно
+def debit_bet(user_id, bet, game_type='blackjack', game=None):
+    balance = get_storage().debit(user_id, bet, game_type, game)
+    if balance is not None:
+        ledger_checkpointer.mark(user_id)
+    return balance
+
+# Расчет ставки одной транзакцией: списание ставки, выплата и запись в историю.
+# payout - сумма, возвращаемая на баланс; history_win - сумма для истории (по умолчанию payout);
+# prepaid=True - ставка уже списана через debit_bet; game - как в debit_bet.
+# Возвращает новый баланс или None, если средств недостаточно
+def settle_bet(user_id, game_type, bet, payout, result, history_win=None, prepaid=False, game=None):
+    return settle_bets(user_id, game_type, [(bet, payout, result, history_win)], prepaid, game)
+
+# Расчет серии раундов одной транзакцией. rounds - список (ставка, выплата, результат, history_win).
+# Баланс должен покрывать сумму всех ставок серии
+def settle_bets(user_id, game_type, rounds, prepaid=False, game=None):
+    stake = sum(bet for bet, _, _, _ in rounds)
+    payout = sum(win for _, win, _, _ in rounds)
+    debit = 0 if prepaid else stake
+    rows = [HistoryJournal.make_row(user_id, game_type, bet, win if history_win is None else history_win, result)
+            for bet, win, result, history_win in rounds]
+    stats = (
+        user_id, game_type,
+        sum(1 for bet, win, _, _ in rounds if win > bet),
+        sum(1 for bet, win, _, _ in rounds if win < bet),
+        sum(1 for bet, win, _, _ in rounds if win == bet),
+        stake, payout
     )
-    conn.commit()
-    conn.close()
+    synchronous = history_journal.synchronous
+
+    new_balance = get_storage().settle(user_id, debit, payout, stats, rows if synchronous else None, game)
+    if new_balance is None:
+        return None
+
+    # В режиме отложенной записи строки истории попадают в журнал только после фиксации баланса
+    if not synchronous:
+        for row in rows:
+            history_journal.append(row)
+    leaderboard.record(user_id, game_type, rounds)
+    ledger_checkpointer.mark(user_id)
+    return new_balance
+
+GAME_TYPES = ['slots', 'blackjack', 'coinflip', 'dice']
 
-# Получение истории игр через SELECT
+# Статистика пользователя по играм (поддерживается в settle_bet, без сканирования истории).
+# Без game_type возвращает словарь по всем играм
+def get_user_game_stats(user_id, game_type=None):
+    stats = {game: {'wins': 0, 'losses': 0, 'pushes': 0, 'total': 0, 'wagered': 0, 'won': 0}
+             for game in GAME_TYPES}
+    for row in get_storage().get_stats(user_id):
+        stats[row[0]] = {
+            'wins': row[1],
+            'losses': row[2],
+            'pushes': row[3],
+            'total': row[1] + row[2] + row[3],
+            'wagered': row[4],
+            'won': row[5]
+        }
+    if game_type is not None:
+        return stats[game_type]
+    return stats
+
+# Получение последних игр пользователя
 def get_game_history(user_id, limit=5):
-    conn = sqlite3.connect('casino.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        '''SELECT game_type, bet_amount, win_amount, result, created_at 
-           FROM game_history 
-           WHERE user_id = ? 
-           ORDER BY created_at DESC 
-           LIMIT ?''',
-        (user_id, limit)
-    )
-    history = cursor.fetchall()
-    conn.close()
+    history_journal.flush()
+    history = get_storage().get_history(user_id, limit)
     
     return [{
         'game': row[0],
@@ -231,6 +1792,266 @@ def get_game_history(user_id, limit=5):
         'timestamp': row[4][11:19] if row[4] else '00:00:00'
     } for row in history]
 
+# Курсор страницы истории: ключ (created_at, id) последней строки в base64
+def encode_history_cursor(row):
+    key = json.dumps([row[5], row[0]], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(key).decode().rstrip('=')
+
+# Ключ из курсора; ValueError, если курсор поврежден
+def decode_history_cursor(cursor):
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError('Некорректный курсор') from e
+    if not isinstance(created_at, str) or not isinstance(row_id, int):
+        raise ValueError('Некорректный курсор')
+    return created_at, row_id
+
+def history_item(row):
+    row_id, game_type, bet, win, result, created_at = row
+    return {
+        'id': row_id,
+        'game': game_type,
+        'bet': bet,
+        'win': win,
+        'result': result,
+        'outcome': history_outcome(game_type, win, result),
+        'created_at': created_at
+    }
+
+# Страница истории: (записи, курсор следующей страницы или None).
+# ValueError при поврежденном курсоре
+def get_history_page(user_id, limit, cursor=None, game_type=None, outcome=None):
+    before = decode_history_cursor(cursor) if cursor else None
+    history_journal.flush()
+    rows = get_storage().get_history_page(user_id, limit + 1, before, game_type, outcome)
+    next_cursor = encode_history_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return [history_item(row) for row in rows[:limit]], next_cursor
+
+# Вся история пользователя пачками по keyset: в памяти одна пачка,
+# и транзакция чтения не удерживается между пачками
+def iter_history(user_id, game_type=None, outcome=None, batch=1000):
+    history_journal.flush()
+    before = None
+    while True:
+        rows = get_storage().get_history_page(user_id, batch, before, game_type, outcome)
+        yield from rows
+        if len(rows) < batch:
+            return
+        before = (rows[-1][5], rows[-1][0])
+
+# Таблица лидеров: периоды (текущие сутки и неделя по UTC, все время), показатели
+# (название в API -> поле итогов) и сводная таблица по всем играм
+LEADERBOARD_PERIODS = ['day', 'week', 'all']
+LEADERBOARD_METRICS = {'biggest_win': 'best_win', 'profit': 'profit', 'volume': 'wagered'}
+LEADERBOARD_ALL_GAMES = 'all'
+
+# Ключ текущего периода: дата для суток, дата понедельника для недели
+# (как date('now') и date('now', 'weekday 0', '-6 days') в миграции 8)
+def leaderboard_bucket(period, now=None):
+    today = (now or datetime.utcnow()).date()
+    if period == 'day':
+        return today.isoformat()
+    if period == 'week':
+        return (today - timedelta(days=today.weekday())).isoformat()
+    return 'all'
+
+# Таблица лидеров. Результаты раундов складываются в памяти процесса при расчете ставки,
+# фоновый поток раз в LEADERBOARD_REFRESH_INTERVAL секунд записывает их в хранилище одной
+# транзакцией и перечитывает первые LEADERBOARD_SIZE мест каждой таблицы по индексам.
+# Чтение отдает готовые списки из памяти - O(K) независимо от числа игроков; ставки других
+# воркеров serve.py видны после их очередной записи. Без фонового потока (TESTING или
+# интервал 0) запись и обновление выполняются при каждом чтении
+class Leaderboard:
+    def __init__(self):
+        # (period, bucket, game_type, user_id) -> [rounds, wagered, payout, best_win]
+        self.pending = {}
+        # (period, game_type, показатель) -> список мест
+        self.boards = {}
+        # Ключи периодов при последнем обновлении: смена ключа - сигнал удалить старые итоги
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.thread = None
+
+    def ensure_started(self):
+        if self.thread is not None or app.config['TESTING'] or not app.config['LEADERBOARD_REFRESH_INTERVAL']:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='leaderboard', daemon=True)
+                self.thread.start()
+
+    def _add(self, key, rounds, wagered, payout, best_win):
+        entry = self.pending.setdefault(key, [0, 0, 0, 0])
+        entry[0] += rounds
+        entry[1] += wagered
+        entry[2] += payout
+        entry[3] = max(entry[3], best_win)
+
+    # Учет рассчитанной серии раундов (rounds - как в settle_bets)
+    def record(self, user_id, game_type, rounds):
+        wagered = sum(bet for bet, _, _, _ in rounds)
+        payout = sum(win for _, win, _, _ in rounds)
+        best_win = max(0, max(win - bet for bet, win, _, _ in rounds))
+        now = datetime.utcnow()
+        with self.lock:
+            for period in LEADERBOARD_PERIODS:
+                bucket = leaderboard_bucket(period, now)
+                for game in (game_type, LEADERBOARD_ALL_GAMES):
+                    self._add((period, bucket, game, user_id), len(rounds), wagered, payout, best_win)
+        self.ensure_started()
+
+    # Накопленные результаты пользователя больше не нужны (сброс баланса)
+    def discard(self, user_id):
+        with self.lock:
+            for key in [key for key in self.pending if key[3] == user_id]:
+                del self.pending[key]
+
+    # Запись накопленных результатов одной транзакцией
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        try:
+            get_storage().add_leaderboard([key + tuple(entry) for key, entry in pending.items()])
+        except sqlite3.Error:
+            # Возвращаем результаты в очередь, повторим при следующей записи
+            with self.lock:
+                for key, entry in pending.items():
+                    self._add(key, *entry)
+            raise
+        return len(pending)
+
+    # Запись накопленного и перечитывание первых мест всех таблиц
+    def refresh(self):
+        with self.refresh_lock:
+            self.flush()
+            storage = get_storage()
+            size = app.config['LEADERBOARD_SIZE']
+            boards = {}
+            for period in LEADERBOARD_PERIODS:
+                bucket = leaderboard_bucket(period)
+                if self.buckets.get(period) != bucket:
+                    storage.prune_leaderboard(period, bucket)
+                    self.buckets[period] = bucket
+                for game in GAME_TYPES + [LEADERBOARD_ALL_GAMES]:
+                    for metric, field in LEADERBOARD_METRICS.items():
+                        rows = storage.get_leaderboard(period, bucket, game, field, size)
+                        boards[period, game, metric] = [leaderboard_entry(rank, row, metric)
+                                                        for rank, row in enumerate(rows, 1)]
+            self.boards = boards
+
+    # Места таблицы: список словарей leaderboard_entry
+    def top(self, period, game_type, metric):
+        self.ensure_started()
+        if self.thread is None or not self.boards:
+            self.refresh()
+        return self.boards.get((period, game_type, metric), [])
+
+    def _run(self):
+        while not self.stopping:
+            self.wakeup.wait(app.config['LEADERBOARD_REFRESH_INTERVAL'])
+            self.wakeup.clear()
+            try:
+                self.refresh()
+            except sqlite3.Error:
+                logging.exception('Ошибка обновления таблицы лидеров')
+
+    # Остановка потока с записью накопленных результатов
+    def stop(self):
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+        self.stopping = False
+
+leaderboard = Leaderboard()
+atexit.register(leaderboard.stop)
+
+# Место в таблице лидеров для шаблона и JSON API; value - значение показателя таблицы
+def leaderboard_entry(rank, row, metric):
+    username, rounds, wagered, payout, best_win = row
+    entry = {
+        'rank': rank,
+        'username': username,
+        'rounds': rounds,
+        'volume': wagered,
+        'profit': payout - wagered,
+        'biggest_win': best_win
+    }
+    entry['value'] = entry[metric]
+    return entry
+
+# Параметры таблицы лидеров из строки запроса: (period, game_type).
+# ValueError при неизвестном периоде или игре
+def leaderboard_filters():
+    period = request.args.get('period') or 'day'
+    game_type = request.args.get('game_type') or LEADERBOARD_ALL_GAMES
+    if period not in LEADERBOARD_PERIODS:
+        raise ValueError(f'Неизвестный период {period}')
+    if game_type != LEADERBOARD_ALL_GAMES and game_type not in GAME_TYPES:
+        raise ValueError(f'Неизвестная игра {game_type}')
+    return period, game_type
+
+# Манифест сборки статики: исходное имя -> имя с хешем; пустой, если сборки нет.
+# Читается заново, только если файл манифеста изменился
+_asset_manifest = (None, {})
+
+def asset_manifest():
+    global _asset_manifest
+    path = app.config['ASSET_MANIFEST']
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    if _asset_manifest[0] != (path, mtime):
+        with open(path, encoding='utf-8') as f:
+            _asset_manifest = ((path, mtime), json.load(f))
+    return _asset_manifest[1]
+
+# Ссылка на статический файл в шаблонах: собранный файл с хешем, если есть сборка,
+# иначе исходный файл из static/
+@app.template_global()
+def asset_url(name):
+    built = asset_manifest().get(name)
+    if built is None:
+        return url_for('static', filename=name)
+    return url_for('asset', filename=built)
+
+# Сжатые заранее варианты собранных файлов в порядке предпочтения
+ASSET_ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# Собранные файлы: имя меняется вместе с содержимым, поэтому кэшируются навсегда
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    directory = os.path.dirname(app.config['ASSET_MANIFEST'])
+    if filename == os.path.basename(app.config['ASSET_MANIFEST']):
+        abort(404)
+    
+    mimetype = mimetypes.guess_type(filename)[0]
+    encoding = None
+    for name, suffix in ASSET_ENCODINGS:
+        path = safe_join(directory, filename + suffix)
+        if request.accept_encodings[name] and path is not None and os.path.isfile(path):
+            encoding = name
+            filename += suffix
+            break
+    
+    response = send_from_directory(directory, filename, mimetype=mimetype,
+                                   max_age=app.config['ASSET_MAX_AGE'])
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 # Middleware для проверки аутентификации
 @app.before_request
 def check_auth():
@@ -238,59 +2059,100 @@ def check_auth():
     init_db()
     
     # Исключаем статические файлы и страницы аутентификации
-    if request.endpoint in ['static', 'login', 'register', 'auth_login', 'auth_register']:
+    if request.endpoint in ['static', 'asset', 'login', 'register', 'auth_login', 'auth_register', 'metrics']:
         return
     
     user_id = session.get('user_id')
     session_id = session.get('session_id')
     
     if user_id and session_id:
-        # Проверяем валидность сессии через SELECT
-        valid_user_id = verify_session(session_id)
-        if valid_user_id and valid_user_id == user_id:
+        # Проверяем валидность сессии (через кэш, при промахе - SELECT)
+        entry = verify_session_cached(session_id)
+        if entry is not None and entry[0] == user_id:
             # Обновляем время последнего входа
-            conn = sqlite3.connect('casino.db')
-            cursor = conn.cursor()
-            cursor.execute('UPDATE users SET last_login = datetime("now") WHERE id = ?', (user_id,))
-            conn.commit()
-            conn.close()
+            touch_last_login(entry)
             return
     
-    # Если не авторизован, перенаправляем на страницу входа
+    # Если не авторизован, перенаправляем на страницу входа (JSON API отвечает 401)
+    if request.path.startswith('/api/'):
+        return jsonify({'error': 'unauthorized', 'message': 'Требуется вход'}), 401
     return redirect(url_for('login'))
 
+# Карта - число 0..51: масть * 13 + ранг (ранг 0 - двойка, 12 - туз).
+# Строки вида "10♥" используются только при выводе в шаблон
+CARD_SUITS = ['♠', '♥', '♦', '♣']
+CARD_RANKS = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
+CARD_NAMES = [f"{rank}{suit}" for suit in CARD_SUITS for rank in CARD_RANKS]
+CARD_CODES = {name: code for code, name in enumerate(CARD_NAMES)}
+# Очки карты по ее коду (туз - 11)
+CARD_VALUES = [11 if rank == 12 else min(rank + 2, 10)
+               for suit in range(len(CARD_SUITS)) for rank in range(len(CARD_RANKS))]
+
 class BlackjackGame:
+    # Колода (шуз из decks колод) с seed всегда перемешивается одинаково (rng.SeededRandom
+    # от 64-битного seed), что позволяет хранить вместо нее только seed и число сданных карт
     @staticmethod
-    def new_deck():
-        suits = ['♠', '♥', '♦', '♣']
-        values = ['2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K', 'A']
-        deck = []
-        for suit in suits:
-            for value in values:
-                deck.append(f"{value}{suit}")
-        random.shuffle(deck)
+    def new_deck(seed=None, decks=1):
+        deck = list(range(len(CARD_NAMES))) * decks
+        if seed is None:
+            rng.system().shuffle(deck)
+        else:
+            rng.SeededRandom(seed.to_bytes(8, 'big')).shuffle(deck)
         return deck
 
+    # Перемешанный шуз кэшируется: тасовка выполняется один раз на шуз, а не на каждый запрос
     @staticmethod
-    def calculate_hand_value(hand):
+    @functools.lru_cache(maxsize=1024)
+    def shoe_cards(seed, decks):
+        return tuple(BlackjackGame.new_deck(seed, decks))
+
+    # Остаток шуза после сдачи position карт (карты сдаются с конца)
+    @staticmethod
+    def restore_deck(seed, position, decks=1):
+        shoe = BlackjackGame.shoe_cards(seed, decks)
+        return list(shoe[:len(shoe) - position])
+
+    # Позиция отрезной карты для шуза из decks колод
+    @staticmethod
+    def cut_card_position(decks, penetration):
+        total = decks * len(CARD_NAMES)
+        return max(0, min(int(total * penetration), total - BLACKJACK_MIN_CARDS_LEFT))
+
+    # Строковые названия карт для шаблона
+    @staticmethod
+    def card_names(hand):
+        return [CARD_NAMES[card] for card in hand]
+
+    # Накопитель очков руки: (сумма, число тузов, которые еще считаются за 11)
+    @staticmethod
+    def add_card(total, card):
+        value, soft_aces = total
+        card_value = CARD_VALUES[card]
+        value += card_value
+        if card_value == 11:
+            soft_aces += 1
+        while value > 21 and soft_aces > 0:
+            value -= 10
+            soft_aces -= 1
+        return value, soft_aces
+
+    @staticmethod
+    def hand_total(hand):
         value = 0
-        aces = 0
-        
+        soft_aces = 0
         for card in hand:
-            card_value = card[:-1]
-            if card_value in ['J', 'Q', 'K']:
-                value += 10
-            elif card_value == 'A':
-                aces += 1
-                value += 11
-            else:
-                value += int(card_value)
-        
-        while value > 21 and aces > 0:
+            card_value = CARD_VALUES[card]
+            value += card_value
+            if card_value == 11:
+                soft_aces += 1
+        while value > 21 and soft_aces > 0:
             value -= 10
-            aces -= 1
-            
-        return value
+            soft_aces -= 1
+        return value, soft_aces
+
+    @staticmethod
+    def calculate_hand_value(hand):
+        return BlackjackGame.hand_total(hand)[0]
 
     @staticmethod
     def deal_initial_cards(deck):
@@ -305,8 +2167,11 @@ class BlackjackGame:
 
     @staticmethod
     def dealer_play(dealer_hand, deck):
-        while BlackjackGame.calculate_hand_value(dealer_hand) < 17:
-            dealer_hand, deck = BlackjackGame.hit(dealer_hand, deck)
+        total = BlackjackGame.hand_total(dealer_hand)
+        while total[0] < 17:
+            card = deck.pop()
+            dealer_hand.append(card)
+            total = BlackjackGame.add_card(total, card)
         return dealer_hand, deck
 
     @staticmethod
@@ -322,6 +2187,365 @@ class BlackjackGame:
         else:
             return "push"
 
+# Правила выплат игр - чистые функции без обращения к БД и запросу.
+# Используются маршрутами и симулятором RTP (simulator.py)
+SLOT_SYMBOLS = ['🍒', '🍋', '🍊', '⭐', '🔔', '💎']
+COIN_SIDES = ['heads', 'tails']
+
+def slots_payout(reels, bet):
+    if reels[0] == reels[1] == reels[2]:
+        multiplier = 10 if reels[0] == '💎' else 5
+        return bet * multiplier
+    elif reels[0] == reels[1] or reels[1] == reels[2]:
+        return bet * 2
+    return 0
+
+def coinflip_payout(choice, coin_result, bet):
+    return bet * 2 if choice == coin_result else 0
+
+# Исход броска костей: (результат, выплата, множитель для сообщения)
+def dice_outcome(player_dice, dealer_dice, bet):
+    player_score = sum(player_dice)
+    dealer_score = sum(dealer_dice)
+    if player_score > dealer_score:
+        # Дубль у игрока - x3
+        if player_dice[0] == player_dice[1]:
+            return 'win', bet * 3, "x3 (дубль!)"
+        return 'win', bet * 2, "x2"
+    elif player_score < dealer_score:
+        return 'lose', 0, None
+    # Ничья - ставка возвращается
+    return 'push', bet, None
+
+# Выплата блэкджека по исходу раунда: 'blackjack', 'win', 'push', 'lose' или 'bust'.
+# При блэкджеке с раздачи дилер добирает карты, и его 21 дает ничью
+def blackjack_payout(outcome, bet):
+    if outcome == 'blackjack':
+        return int(bet * 2.5)
+    elif outcome == 'win':
+        return bet * 2
+    elif outcome == 'push':
+        return bet
+    return 0
+
+# Хранилище партий блэкджека на сервере, ключ - session_id пользователя.
+# Состояние: seed и позиция колоды, руки, стадия игры и ставка.
+# Партии кэшируются в памяти (LRU), каждое изменение записывается в хранилище
+# (в SQLite - таблица blackjack_games), откуда партия читается при промахе
+class BlackjackStore:
+    def __init__(self):
+        self.games = OrderedDict()
+        self.lock = threading.Lock()
+
+    # Новая партия с новым перетасованным шузом
+    @staticmethod
+    def new_state():
+        decks = app.config['BLACKJACK_DECKS']
+        return {
+            'seed': rng.system().getrandbits(64),
+            'decks': decks,
+            'position': 0,
+            'cut_card': BlackjackGame.cut_card_position(decks, app.config['BLACKJACK_PENETRATION']),
+            'player_hand': [],
+            'dealer_hand': [],
+            'game_state': 'betting',
+            'bet': 0
+        }
+
+    # Следующий раунд на том же шузе; после отрезной карты шуз перетасовывается.
+    # Возвращает (состояние, был ли шуз перетасован)
+    @staticmethod
+    def next_round(state):
+        if state['position'] >= state['cut_card']:
+            return dict(BlackjackStore.new_state(), version=state.get('version')), True
+        state = dict(state)
+        state.update(player_hand=[], dealer_hand=[], game_state='betting', bet=0)
+        return state, False
+
+    # Кэш локален для процесса, поэтому запись из кэша отдается, только если ее версия
+    # совпадает с версией в хранилище (партию мог изменить другой воркер). Отдается глубокая
+    # копия: ход меняет руки на месте, и несохраненный ход не должен попасть в кэш
+    def load(self, session_id, user_id):
+        storage = get_storage()
+        with self.lock:
+            cached = self.games.get(session_id)
+            if cached is not None:
+                self.games.move_to_end(session_id)
+        if cached is not None and cached[0] == user_id:
+            if storage.get_game_version(session_id, user_id) == cached[1]['version']:
+                return copy.deepcopy(cached[1])
+
+        state = storage.load_game(session_id, user_id)
+        if state is None:
+            self.forget(session_id)
+            return None
+        # Партии, сохраненные до перехода на числовые карты и шуз
+        for hand in ('player_hand', 'dealer_hand'):
+            state[hand] = [CARD_CODES[card] if isinstance(card, str) else card for card in state[hand]]
+        state.setdefault('decks', 1)
+        state.setdefault('cut_card', BlackjackGame.cut_card_position(1, app.config['BLACKJACK_PENETRATION']))
+        self._remember(session_id, user_id, state)
+        return copy.deepcopy(state)
+
+    # Запись партии с проверкой версии; GameConflictError, если партию уже изменили
+    def save(self, session_id, user_id, state):
+        try:
+            get_storage().save_game(session_id, user_id, state)
+        except GameConflictError:
+            self.forget(session_id)
+            raise
+        self.saved(session_id, user_id, state)
+
+    # Партия записана (save_game или вместе с расчетом ставки): версия увеличилась на 1
+    def saved(self, session_id, user_id, state):
+        state['version'] = (state.get('version') or 0) + 1
+        self._remember(session_id, user_id, copy.deepcopy(state))
+
+    def forget(self, session_id):
+        with self.lock:
+            self.games.pop(session_id, None)
+
+    def delete(self, session_id):
+        self.forget(session_id)
+        get_storage().delete_game(session_id)
+
+    def _remember(self, session_id, user_id, state):
+        with self.lock:
+            self.games[session_id] = (user_id, state)
+            self.games.move_to_end(session_id)
+            while len(self.games) > app.config['BLACKJACK_CACHE_SIZE']:
+                self.games.popitem(last=False)
+
+blackjack_store = BlackjackStore()
+
+rng_log = logging.getLogger('casino.rng')
+
+# Запись commitment seed в журнал аудита (до того, как seed использован)
+def commit_seed(user_id, game_type, seed):
+    rng_log.info(json.dumps({'user_id': user_id, 'game': game_type, 'commitment': rng.commitment(seed)}))
+
+# Генератор для раунда: (генератор, seed или None). Без RNG_AUDIT - буферизованный
+# генератор потока; с RNG_AUDIT - детерминированный поток из нового seed раунда
+def round_random(user_id, game_type):
+    if not app.config['RNG_AUDIT']:
+        return rng.system(), None
+    seed = rng.new_seed()
+    commit_seed(user_id, game_type, seed)
+    return rng.SeededRandom(seed), seed
+
+# Повтор раунда мгновенной игры по seed из ответа (проверка аудита): детали раунда
+def replay_round(game_type, seed, bet, **options):
+    _, details = INSTANT_GAMES[game_type](bet, rng.SeededRandom(bytes.fromhex(seed)), **options)
+    return details
+
+# Раунды мгновенных игр без обращения к БД и без шаблонов. Случайность - из генератора rand.
+# Каждая функция возвращает (раунд для settle_bets, детали раунда для ответа)
+def slots_round(bet, rand):
+    reels = [rand.choice(SLOT_SYMBOLS) for _ in range(3)]
+    win = slots_payout(reels, bet)
+    return (bet, win, str(reels), None), {'reels': reels, 'win': win}
+
+def coinflip_round(bet, rand, choice='heads'):
+    coin = rand.choice(COIN_SIDES)
+    win = coinflip_payout(choice, coin, bet)
+    return (bet, win, 'win' if win > 0 else 'lose', None), {'choice': choice, 'coin': coin, 'win': win}
+
+def dice_round(bet, rand):
+    player_dice = [rand.randint(1, 6) for _ in range(2)]
+    dealer_dice = [rand.randint(1, 6) for _ in range(2)]
+    result_type, win, multiplier = dice_outcome(player_dice, dealer_dice, bet)
+    if result_type == 'win':
+        settled = (bet, win, f'win_{multiplier}', None)
+    elif result_type == 'lose':
+        settled = (bet, win, 'lose', None)
+    else:
+        # Ничья: ставка возвращается, в истории выигрыш 0
+        settled = (bet, win, 'push', 0)
+    return settled, {
+        'player_dice': player_dice,
+        'dealer_dice': dealer_dice,
+        'result': result_type,
+        'multiplier': multiplier,
+        'win': win
+    }
+
+INSTANT_GAMES = {
+    'slots': slots_round,
+    'coinflip': coinflip_round,
+    'dice': dice_round,
+}
+
+# Розыгрыш count раундов мгновенной игры с расчетом одной транзакцией.
+# Возвращает (новый баланс или None при нехватке средств, детали раундов)
+def play_rounds(user_id, game_type, count, bet, **options):
+    played = []
+    for _ in range(count):
+        rand, seed = round_random(user_id, game_type)
+        settled, details = INSTANT_GAMES[game_type](bet, rand, **options)
+        if seed is not None:
+            details['seed'] = seed.hex()
+        played.append((settled, details))
+    balance = settle_bets(user_id, game_type, [settled for settled, _ in played])
+    return balance, [details for _, details in played]
+
+# Наибольшая ставка: INTEGER в SQLite - 64 бита
+MAX_BET = 2 ** 63 - 1
+
+# Ставка из запроса: целое от 1 до MAX_BET, иначе ValueError с сообщением для игрока
+def parse_bet(value):
+    try:
+        bet = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('Ставка должна быть целым числом')
+    if bet <= 0:
+        raise ValueError('Ставка должна быть положительной')
+    if bet > MAX_BET:
+        raise ValueError('Слишком большая ставка')
+    return bet
+
+# Действие в партии блэкджека ('new_game', 'place_bet', 'hit', 'stand' или None - только показать).
+# Возвращает (состояние партии, баланс, сообщение)
+def play_blackjack(user_id, session_id, action=None, bet=None):
+    try:
+        return _play_blackjack(user_id, session_id, action, bet)
+    except GameConflictError:
+        # Партию уже изменил параллельный запрос (другая вкладка или воркер): действие
+        # не выполнено, ставка не рассчитана - показываем актуальное состояние
+        game = blackjack_store.load(session_id, user_id) or BlackjackStore.new_state()
+        return game, get_user_balance(user_id), "⚠️ Партия изменена в другом окне, состояние обновлено"
+
+def _play_blackjack(user_id, session_id, action, bet):
+    balance = get_user_balance(user_id)
+    message = ""
+    
+    # Состояние партии хранится на сервере, в cookie остается только session_id
+    game = blackjack_store.load(session_id, user_id)
+    reshuffled = False
+    if game is None:
+        game = BlackjackStore.new_state()
+        reshuffled = True
+        blackjack_store.save(session_id, user_id, game)
+    elif action == 'new_game':
+        game, reshuffled = BlackjackStore.next_round(game)
+        if reshuffled:
+            message = "🔀 Отрезная карта! Шуз перетасован"
+        blackjack_store.save(session_id, user_id, game)
+    if reshuffled and app.config['RNG_AUDIT']:
+        # Порядок карт шуза определяется его seed (BlackjackGame.shoe_cards)
+        commit_seed(user_id, 'blackjack', game['seed'].to_bytes(8, 'big'))
+    
+    deck = BlackjackGame.restore_deck(game['seed'], game['position'], game['decks'])
+    
+    # Состояние после действия. Если действие рассчитывает ставку, состояние записывается
+    # в той же транзакции и только при неизменной версии партии - раунд не рассчитывается дважды
+    def played(**changes):
+        state = dict(game, **changes)
+        state['position'] = state['decks'] * len(CARD_NAMES) - len(deck)
+        return state
+    
+    if action == 'place_bet' and game['game_state'] == 'betting':
+        if bet > balance:
+            message = "❌ Недостаточно средств!"
+        else:
+            player_hand, dealer_hand, deck = BlackjackGame.deal_initial_cards(deck)
+            
+            player_value = BlackjackGame.calculate_hand_value(player_hand)
+            if player_value == 21:
+                # Блэкджек с раздачи: ставка и выплата рассчитываются одной транзакцией
+                dealer_hand, deck = BlackjackGame.dealer_play(dealer_hand, deck)
+                dealer_value = BlackjackGame.calculate_hand_value(dealer_hand)
+                new_game = played(player_hand=player_hand, dealer_hand=dealer_hand, bet=bet,
+                                  game_state='game_over')
+                
+                if dealer_value == 21:
+                    new_balance = settle_bet(user_id, 'blackjack', bet, blackjack_payout('push', bet), 'push',
+                                             history_win=0, game=(session_id, new_game))
+                    win_message = "🤝 Оба имеют блэкджек! Ничья!"
+                else:
+                    win_amount = blackjack_payout('blackjack', bet)
+                    new_balance = settle_bet(user_id, 'blackjack', bet, win_amount, 'blackjack',
+                                             history_win=win_amount - bet, game=(session_id, new_game))
+                    win_message = f"🎉 Блэкджек! Вы выиграли {win_amount} копейка!"
+            else:
+                new_game = played(player_hand=player_hand, dealer_hand=dealer_hand, bet=bet,
+                                  game_state='player_turn')
+                new_balance = debit_bet(user_id, bet, game=(session_id, new_game))
+                win_message = ""
+            
+            if new_balance is None:
+                message = "❌ Недостаточно средств!"
+            else:
+                blackjack_store.saved(session_id, user_id, new_game)
+                game = new_game
+                message = win_message
+                balance = new_balance
+    
+    elif action == 'hit' and game['game_state'] == 'player_turn':
+        player_hand, deck = BlackjackGame.hit(game['player_hand'], deck)
+        
+        player_value = BlackjackGame.calculate_hand_value(player_hand)
+        if player_value > 21:
+            new_game = played(player_hand=player_hand, game_state='game_over')
+            settle_bet(user_id, 'blackjack', game['bet'], blackjack_payout('bust', game['bet']), 'bust',
+                       prepaid=True, game=(session_id, new_game))
+            blackjack_store.saved(session_id, user_id, new_game)
+            message = "💥 Перебор! Дилер выиграл!"
+        else:
+            new_game = played(player_hand=player_hand)
+            blackjack_store.save(session_id, user_id, new_game)
+        game = new_game
+    
+    elif action == 'stand' and game['game_state'] == 'player_turn':
+        dealer_hand, deck = BlackjackGame.dealer_play(game['dealer_hand'], deck)
+        
+        player_value = BlackjackGame.calculate_hand_value(game['player_hand'])
+        dealer_value = BlackjackGame.calculate_hand_value(dealer_hand)
+        
+        winner = BlackjackGame.determine_winner(player_value, dealer_value)
+        
+        bet = game['bet']
+        new_game = played(dealer_hand=dealer_hand, game_state='game_over')
+        if winner == "player":
+            win_amount = blackjack_payout('win', bet)
+            balance = settle_bet(user_id, 'blackjack', bet, win_amount, 'win',
+                                 history_win=bet, prepaid=True, game=(session_id, new_game))
+            message = f"🎉 Вы выиграли {win_amount} копейка!"
+        elif winner == "dealer":
+            balance = settle_bet(user_id, 'blackjack', bet, blackjack_payout('lose', bet), 'lose',
+                                 prepaid=True, game=(session_id, new_game))
+            message = "😞 Дилер выиграл!"
+        else:
+            balance = settle_bet(user_id, 'blackjack', bet, blackjack_payout('push', bet), 'push',
+                                 history_win=0, prepaid=True, game=(session_id, new_game))
+            message = "🤝 Ничья! Ставка возвращена"
+        blackjack_store.saved(session_id, user_id, new_game)
+        game = new_game
+    
+    return game, balance, message
+
+# Данные партии для вывода: названия карт, очки, закрытая карта дилера до конца раунда
+def blackjack_view(game):
+    player_hand = game['player_hand']
+    dealer_hand = game['dealer_hand']
+    game_state = game['game_state']
+    
+    player_value = BlackjackGame.calculate_hand_value(player_hand) if player_hand else 0
+    dealer_value = BlackjackGame.calculate_hand_value(dealer_hand) if dealer_hand else 0
+    
+    show_dealer_value = game_state in ['dealer_turn', 'game_over']
+    dealer_display_hand = BlackjackGame.card_names(dealer_hand)
+    if not show_dealer_value and len(dealer_display_hand) > 1:
+        dealer_display_hand[1] = '??'
+    
+    return {
+        'player_hand': BlackjackGame.card_names(player_hand),
+        'dealer_hand': dealer_display_hand,
+        'player_value': player_value,
+        'dealer_value': dealer_value if show_dealer_value else '?',
+        'game_state': game_state,
+        'current_bet': game['bet']
+    }
+
 # Страницы аутентификации
 @app.route('/login')
 def login():
@@ -347,7 +2571,7 @@ def auth_login():
         
         # Используем SELECT для поиска пользователя
         user = get_user_by_username(username)
-        if user and verify_password(password, user['password_hash']):
+        if user and verify_user_password(user, password):
             session_id = create_session(user['id'])
             session['user_id'] = user['id']
             session['username'] = user['username']
@@ -357,6 +2581,9 @@ def auth_login():
         else:
             flash('Неверное имя пользователя или пароль', 'error')
             return redirect(url_for('login'))
+    except passwords.PasswordHasherBusy:
+        flash('Сервер перегружен, попробуйте войти через несколько секунд', 'error')
+        return render_template('login.html'), 503, {'Retry-After': '5'}
     except Exception as e:
         flash(f'Ошибка при входе: {str(e)}', 'error')
         return redirect(url_for('login'))
@@ -388,15 +2615,7 @@ def auth_register():
             return redirect(url_for('register'))
         
         # Создаем нового пользователя
-        conn = sqlite3.connect('casino.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
-            (username, email, hash_password(password))
-        )
-        user_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        user_id = create_user(username, email, password)
         
         # Получаем данные пользователя через SELECT для подтверждения
         new_user = get_user_by_id(user_id)
@@ -412,9 +2631,12 @@ def auth_register():
             flash('Ошибка при создании пользователя', 'error')
             return redirect(url_for('register'))
         
-    except sqlite3.IntegrityError as e:
+    except UserExistsError:
         flash('Ошибка: пользователь с такими данными уже существует', 'error')
         return redirect(url_for('register'))
+    except passwords.PasswordHasherBusy:
+        flash('Сервер перегружен, попробуйте зарегистрироваться через несколько секунд', 'error')
+        return render_template('register.html'), 503, {'Retry-After': '5'}
     except Exception as e:
         flash(f'Ошибка при регистрации: {str(e)}', 'error')
         return redirect(url_for('register'))
@@ -424,6 +2646,7 @@ def logout():
     session_id = session.get('session_id')
     if session_id:
         delete_session(session_id)
+        blackjack_store.delete(session_id)
     session.clear()
     flash('Вы вышли из системы', 'info')
     return redirect(url_for('login'))
@@ -437,11 +2660,109 @@ def index():
     
     balance = get_user_balance(user_id)
     history = get_game_history(user_id)
+    stats = get_user_game_stats(user_id)
     return render_template('index.html', 
                          balance=balance, 
                          history=history,
+                         stats=stats,
                          username=session.get('username'))
 
+# Фильтры истории из строки запроса: (game_type, outcome), пустые значения - без фильтра.
+# ValueError при неизвестной игре или исходе
+def history_filters():
+    game_type = request.args.get('game_type') or None
+    outcome = request.args.get('result') or None
+    if game_type is not None and game_type not in GAME_TYPES:
+        raise ValueError(f'Неизвестная игра {game_type}')
+    if outcome is not None and outcome not in HISTORY_OUTCOMES:
+        raise ValueError(f'Неизвестный исход {outcome}')
+    return game_type, outcome
+
+@app.route('/history')
+def history_page():
+    user_id = session.get('user_id')
+    if not user_id:
+        return redirect(url_for('login'))
+    
+    try:
+        game_type, outcome = history_filters()
+    except ValueError:
+        game_type, outcome = None, None
+    try:
+        history, next_cursor = get_history_page(user_id, app.config['HISTORY_PAGE_SIZE'],
+                                                request.args.get('cursor'), game_type, outcome)
+    except ValueError:
+        # Поврежденный курсор - показываем первую страницу
+        history, next_cursor = get_history_page(user_id, app.config['HISTORY_PAGE_SIZE'],
+                                                None, game_type, outcome)
+    
+    return render_template('history.html',
+                         balance=get_user_balance(user_id),
+                         history=history,
+                         next_cursor=next_cursor,
+                         first_page=not request.args.get('cursor'),
+                         game_type=game_type,
+                         outcome=outcome,
+                         game_types=GAME_TYPES,
+                         outcomes=HISTORY_OUTCOMES)
+
+# Выгрузка истории в CSV: строки формируются генератором по мере отправки,
+# память не зависит от длины истории
+@app.route('/history/export.csv')
+def history_export():
+    user_id = session.get('user_id')
+    if not user_id:
+        return redirect(url_for('login'))
+    
+    try:
+        game_type, outcome = history_filters()
+    except ValueError as e:
+        return str(e), 400
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['id', 'created_at', 'game', 'bet', 'win', 'result', 'outcome'])
+        for count, row in enumerate(iter_history(user_id, game_type, outcome), 1):
+            item = history_item(row)
+            writer.writerow([item['id'], item['created_at'], item['game'], item['bet'],
+                             item['win'], item['result'], item['outcome']])
+            if count % 500 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=history.csv'})
+
+@app.route('/leaderboard')
+def leaderboard_page():
+    user_id = session.get('user_id')
+    if not user_id:
+        return redirect(url_for('login'))
+    
+    try:
+        period, game_type = leaderboard_filters()
+    except ValueError:
+        period, game_type = 'day', LEADERBOARD_ALL_GAMES
+    boards = {metric: leaderboard.top(period, game_type, metric) for metric in LEADERBOARD_METRICS}
+    
+    return render_template('leaderboard.html',
+                         balance=get_user_balance(user_id),
+                         boards=boards,
+                         period=period,
+                         game_type=game_type,
+                         game_types=GAME_TYPES,
+                         username=session.get('username'))
+
+# Ставка из формы игры: (bet, сообщение об ошибке для страницы)
+def form_bet():
+    try:
+        return parse_bet(request.form.get('bet', 10)), None
+    except ValueError as e:
+        return None, f"❌ {e}!"
+
 @app.route('/slots', methods=['GET', 'POST'])
 def slots_page():
     user_id = session.get('user_id')
@@ -453,32 +2774,26 @@ def slots_page():
     reels = ['?', '?', '?']
     
     if request.method == 'POST':
-        bet = int(request.form.get('bet', 10))
+        bet, error = form_bet()
         
-        if bet > balance:
+        if error:
+            message = error
+        elif bet > balance:
             message = "❌ Недостаточно средств!"
         else:
-            symbols = ['🍒', '🍋', '🍊', '⭐', '🔔', '💎']
-            reels = [random.choice(symbols) for _ in range(3)]
+            new_balance, rounds = play_rounds(user_id, 'slots', 1, bet)
+            win = rounds[0]['win']
             
-            if reels[0] == reels[1] == reels[2]:
-                multiplier = 10 if reels[0] == '💎' else 5
-                win = bet * multiplier
-            elif reels[0] == reels[1] or reels[1] == reels[2]:
-                win = bet * 2
-            else:
-                win = 0
-            
-            new_balance = balance - bet + win
-            update_user_balance(user_id, new_balance)
-            add_game_history(user_id, 'slots', bet, win, str(reels))
-            
-            if win > 0:
+            if new_balance is None:
+                message = "❌ Недостаточно средств!"
+            elif win > 0:
                 message = f"🎉 Поздравляем! Вы выиграли {win} копейка!"
             else:
                 message = "😔 Повезет в следующий раз!"
             
-            balance = new_balance
+            if new_balance is not None:
+                balance = new_balance
+                reels = rounds[0]['reels']
     
     return render_template('slots.html', 
                          balance=balance, 
@@ -491,121 +2806,17 @@ def blackjack_page():
     if not user_id:
         return redirect(url_for('login'))
     
-    balance = get_user_balance(user_id)
-    message = ""
-    
-    if 'blackjack_deck' not in session or request.form.get('action') == 'new_game':
-        session['blackjack_deck'] = BlackjackGame.new_deck()
-        session['player_hand'] = []
-        session['dealer_hand'] = []
-        session['game_state'] = 'betting'
-        session['blackjack_bet'] = 0
-    
-    if request.method == 'POST':
-        action = request.form.get('action')
-        
-        if action == 'place_bet':
-            bet = int(request.form.get('bet', 10))
-            
-            if bet > balance:
-                message = "❌ Недостаточно средств!"
-            else:
-                player_hand, dealer_hand, deck = BlackjackGame.deal_initial_cards(session['blackjack_deck'])
-                session['player_hand'] = player_hand
-                session['dealer_hand'] = dealer_hand
-                session['blackjack_deck'] = deck
-                session['blackjack_bet'] = bet
-                session['game_state'] = 'player_turn'
-                
-                new_balance = balance - bet
-                update_user_balance(user_id, new_balance)
-                balance = new_balance
-                
-                player_value = BlackjackGame.calculate_hand_value(player_hand)
-                if player_value == 21:
-                    session['game_state'] = 'dealer_turn'
-                    session['dealer_hand'], session['blackjack_deck'] = BlackjackGame.dealer_play(
-                        session['dealer_hand'], session['blackjack_deck']
-                    )
-                    dealer_value = BlackjackGame.calculate_hand_value(session['dealer_hand'])
-                    
-                    if dealer_value == 21:
-                        new_balance = balance + bet
-                        update_user_balance(user_id, new_balance)
-                        message = "🤝 Оба имеют блэкджек! Ничья!"
-                        session['game_state'] = 'game_over'
-                        add_game_history(user_id, 'blackjack', bet, 0, 'push')
-                    else:
-                        win_amount = int(bet * 2.5)
-                        new_balance = balance + win_amount
-                        update_user_balance(user_id, new_balance)
-                        message = f"🎉 Блэкджек! Вы выиграли {win_amount} копейка!"
-                        session['game_state'] = 'game_over'
-                        add_game_history(user_id, 'blackjack', bet, win_amount - bet, 'blackjack')
-                    balance = new_balance
-        
-        elif action == 'hit':
-            session['player_hand'], session['blackjack_deck'] = BlackjackGame.hit(
-                session['player_hand'], session['blackjack_deck']
-            )
-            
-            player_value = BlackjackGame.calculate_hand_value(session['player_hand'])
-            if player_value > 21:
-                message = "💥 Перебор! Дилер выиграл!"
-                session['game_state'] = 'game_over'
-                add_game_history(user_id, 'blackjack', session['blackjack_bet'], 0, 'bust')
-        
-        elif action == 'stand':
-            session['game_state'] = 'dealer_turn'
-            session['dealer_hand'], session['blackjack_deck'] = BlackjackGame.dealer_play(
-                session['dealer_hand'], session['blackjack_deck']
-            )
-            
-            player_value = BlackjackGame.calculate_hand_value(session['player_hand'])
-            dealer_value = BlackjackGame.calculate_hand_value(session['dealer_hand'])
-            
-            winner = BlackjackGame.determine_winner(player_value, dealer_value)
-            
-            if winner == "player":
-                win_amount = session['blackjack_bet'] * 2
-                new_balance = balance + win_amount
-                update_user_balance(user_id, new_balance)
-                message = f"🎉 Вы выиграли {win_amount} копейка!"
-                add_game_history(user_id, 'blackjack', session['blackjack_bet'], session['blackjack_bet'], 'win')
-                balance = new_balance
-            elif winner == "dealer":
-                message = "😞 Дилер выиграл!"
-                add_game_history(user_id, 'blackjack', session['blackjack_bet'], 0, 'lose')
-            else:
-                new_balance = balance + session['blackjack_bet']
-                update_user_balance(user_id, new_balance)
-                message = "🤝 Ничья! Ставка возвращена"
-                add_game_history(user_id, 'blackjack', session['blackjack_bet'], 0, 'push')
-                balance = new_balance
-            
-            session['game_state'] = 'game_over'
-    
-    player_hand = session.get('player_hand', [])
-    dealer_hand = session.get('dealer_hand', [])
-    game_state = session.get('game_state', 'betting')
-    
-    player_value = BlackjackGame.calculate_hand_value(player_hand) if player_hand else 0
-    dealer_value = BlackjackGame.calculate_hand_value(dealer_hand) if dealer_hand else 0
-    
-    show_dealer_value = game_state in ['dealer_turn', 'game_over']
-    dealer_display_hand = dealer_hand.copy()
-    if not show_dealer_value and len(dealer_display_hand) > 1:
-        dealer_display_hand[1] = '??'
+    action = request.form.get('action') if request.method == 'POST' else None
+    bet, error = form_bet() if action == 'place_bet' else (None, None)
+    if error:
+        action = None
+    game, balance, message = play_blackjack(user_id, session.get('session_id'), action, bet)
+    message = error or message
     
     return render_template('blackjack.html',
                          balance=balance,
-                         player_hand=player_hand,
-                         dealer_hand=dealer_display_hand,
-                         player_value=player_value,
-                         dealer_value=dealer_value if show_dealer_value else '?',
                          message=message,
-                         game_state=game_state,
-                         current_bet=session.get('blackjack_bet', 0))
+                         **blackjack_view(game))
 
 @app.route('/coinflip', methods=['GET', 'POST'])
 def coinflip_page():
@@ -616,51 +2827,33 @@ def coinflip_page():
     balance = get_user_balance(user_id)
     message = ""
     result = None
-    stats = {'wins': 0, 'total': 0}
     
     if request.method == 'POST':
-        bet = int(request.form.get('bet', 10))
+        bet, error = form_bet()
         choice = request.form.get('choice', 'heads')
         
-        if bet > balance:
+        if error:
+            message = error
+        elif bet > balance:
             message = "❌ Недостаточно средств!"
         else:
             # Подбрасываем монетку (50/50 шанс)
-            coin_result = random.choice(['heads', 'tails'])
-            result = coin_result
+            new_balance, rounds = play_rounds(user_id, 'coinflip', 1, bet, choice=choice)
+            coin_result = rounds[0]['coin']
+            win = rounds[0]['win']
             
-            if choice == coin_result:
-                win = bet * 2
-                new_balance = balance - bet + win
-                message = f"🎉 Вы угадали! Выигрыш {win} копейка!"
-                result_type = 'win'
+            if new_balance is None:
+                message = "❌ Недостаточно средств!"
             else:
-                win = 0
-                new_balance = balance - bet
-                message = f"😔 Не угадали. Выпал {'орел' if coin_result == 'heads' else 'решка'}"
-                result_type = 'lose'
-            
-            update_user_balance(user_id, new_balance)
-            add_game_history(user_id, 'coinflip', bet, win, result_type)
-            balance = new_balance
+                result = coin_result
+                balance = new_balance
+                if win > 0:
+                    message = f"🎉 Вы угадали! Выигрыш {win} копейка!"
+                else:
+                    message = f"😔 Не угадали. Выпал {'орел' if coin_result == 'heads' else 'решка'}"
     
     # Получаем статистику
-    conn = sqlite3.connect('casino.db')
-    cursor = conn.cursor()
-    cursor.execute(
-        '''SELECT 
-            COUNT(CASE WHEN result = 'win' THEN 1 END) as wins,
-            COUNT(*) as total
-           FROM game_history 
-           WHERE user_id = ? AND game_type = 'coinflip' ''',
-        (user_id,)
-    )
-    stats_result = cursor.fetchone()
-    conn.close()
-    
-    if stats_result:
-        stats['wins'] = stats_result[0]
-        stats['total'] = stats_result[1]
+    stats = get_user_game_stats(user_id, 'coinflip')
     
     return render_template('coinflip.html',
                          balance=balance,
@@ -684,51 +2877,33 @@ def dice_page():
     rolled = False
     
     if request.method == 'POST':
-        bet = int(request.form.get('bet', 10))
+        bet, error = form_bet()
         
-        if bet > balance:
+        if error:
+            message = error
+        elif bet > balance:
             message = "❌ Недостаточно средств!"
         else:
-            rolled = True
             # Бросаем кости
-            player_dice = [random.randint(1, 6) for _ in range(2)]
-            dealer_dice = [random.randint(1, 6) for _ in range(2)]
-            
-            player_score = sum(player_dice)
-            dealer_score = sum(dealer_dice)
-            
-            # Проверяем дубль у игрока
-            player_double = player_dice[0] == player_dice[1]
+            new_balance, rounds = play_rounds(user_id, 'dice', 1, bet)
             
-            if player_score > dealer_score:
-                if player_double:
-                    win = bet * 3
-                    multiplier = "x3 (дубль!)"
-                else:
-                    win = bet * 2
-                    multiplier = "x2"
-                
-                new_balance = balance - bet + win
-                message = f"🎉 Вы выиграли {win} копейка! ({multiplier})"
-                result_type = 'win'
-                add_game_history(user_id, 'dice', bet, win, f'win_{multiplier}')
-                
-            elif player_score < dealer_score:
-                win = 0
-                new_balance = balance - bet
-                message = f"😔 Дилер выиграл! ({dealer_score} vs {player_score})"
-                result_type = 'lose'
-                add_game_history(user_id, 'dice', bet, 0, 'lose')
-
+            if new_balance is None:
+                message = "❌ Недостаточно средств!"
             else:
-                # Ничья
-                new_balance = balance  # Возвращаем ставку
-                message = "🤝 Ничья! Ставка возвращена"
-                result_type = 'push'
-                add_game_history(user_id, 'dice', bet, 0, 'push')
-            
-            update_user_balance(user_id, new_balance)
-            balance = new_balance
+                rolled = True
+                balance = new_balance
+                dice = rounds[0]
+                player_dice = dice['player_dice']
+                dealer_dice = dice['dealer_dice']
+                player_score = sum(player_dice)
+                dealer_score = sum(dealer_dice)
+                
+                if dice['result'] == 'win':
+                    message = f"🎉 Вы выиграли {dice['win']} копейка! ({dice['multiplier']})"
+                elif dice['result'] == 'lose':
+                    message = f"😔 Дилер выиграл! ({dealer_score} vs {player_score})"
+                else:
+                    message = "🤝 Ничья! Ставка возвращена"
     
     return render_template('dice.html',
                          balance=balance,
@@ -739,6 +2914,130 @@ def dice_page():
                          dealer_score=dealer_score,
                          rolled=rolled)
 
+# JSON API: те же игры без отрисовки шаблонов
+def api_error(error, message, status=400):
+    return jsonify({'error': error, 'message': message}), status
+
+# Параметры запроса: JSON-объект из тела или форма; None, если тело - JSON другого типа
+def api_request_data():
+    data = request.get_json(silent=True)
+    if data is None:
+        return request.form
+    return data if isinstance(data, dict) else None
+
+# Ставка и число раундов из JSON-тела или формы; (bet, rounds, ответ с ошибкой).
+# rounds читается только для пакетной игры, иначе всегда 1
+def api_bet_params(batch=False):
+    data = api_request_data()
+    if data is None:
+        return None, None, api_error('invalid_request', 'Тело запроса должно быть JSON-объектом')
+    try:
+        bet = parse_bet(data.get('bet', 10))
+    except ValueError as e:
+        return None, None, api_error('invalid_bet', str(e))
+    if not batch:
+        return bet, 1, None
+    try:
+        rounds = int(data.get('rounds', 1))
+    except (TypeError, ValueError):
+        return None, None, api_error('invalid_request', 'Число раундов должно быть целым числом')
+    if not 1 <= rounds <= app.config['API_MAX_BATCH_ROUNDS']:
+        return None, None, api_error(
+            'invalid_rounds', f"Число раундов должно быть от 1 до {app.config['API_MAX_BATCH_ROUNDS']}"
+        )
+    return bet, rounds, None
+
+def api_play(game_type, batch=False):
+    bet, count, error = api_bet_params(batch)
+    if error:
+        return error
+    options = {}
+    if game_type == 'coinflip':
+        options['choice'] = api_request_data().get('choice', 'heads')
+        if options['choice'] not in COIN_SIDES:
+            return api_error('invalid_choice', 'Выбор должен быть heads или tails')
+    # Сумма ставок серии не может превышать баланс: проверка до расчета
+    if bet * count > get_user_balance(session['user_id']):
+        return api_error('insufficient_funds', "❌ Недостаточно средств!", 409)
+    
+    balance, rounds = play_rounds(session['user_id'], game_type, count, bet, **options)
+    if balance is None:
+        return api_error('insufficient_funds', "❌ Недостаточно средств!", 409)
+    if not batch:
+        return jsonify({'balance': balance, **rounds[0]})
+    return jsonify({
+        'balance': balance,
+        'rounds': rounds,
+        'total_bet': bet * count,
+        'total_win': sum(r['win'] for r in rounds)
+    })
+
+@app.route('/api/v1/slots/spin', methods=['POST'])
+def api_slots_spin():
+    return api_play('slots')
+
+@app.route('/api/v1/coinflip', methods=['POST'])
+def api_coinflip():
+    return api_play('coinflip')
+
+@app.route('/api/v1/dice', methods=['POST'])
+def api_dice():
+    return api_play('dice')
+
+# Пакетная игра: N раундов за один запрос и одну транзакцию расчета
+@app.route('/api/v1/<game_type>/batch', methods=['POST'])
+def api_batch(game_type):
+    if game_type not in INSTANT_GAMES:
+        return api_error('unknown_game', f'Пакетная игра недоступна для {game_type}', 404)
+    return api_play(game_type, batch=True)
+
+@app.route('/api/v1/history')
+def api_history():
+    try:
+        game_type, outcome = history_filters()
+        limit = int(request.args.get('limit', app.config['HISTORY_PAGE_SIZE']))
+        if not 1 <= limit <= app.config['HISTORY_PAGE_MAX']:
+            raise ValueError(f"limit должен быть от 1 до {app.config['HISTORY_PAGE_MAX']}")
+        items, next_cursor = get_history_page(session['user_id'], limit, request.args.get('cursor'),
+                                              game_type, outcome)
+    except ValueError as e:
+        return api_error('invalid_request', str(e))
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+@app.route('/api/v1/leaderboard')
+def api_leaderboard():
+    try:
+        period, game_type = leaderboard_filters()
+        metric = request.args.get('metric') or None
+        if metric is not None and metric not in LEADERBOARD_METRICS:
+            raise ValueError(f'Неизвестный показатель {metric}')
+    except ValueError as e:
+        return api_error('invalid_request', str(e))
+    shown = [metric] if metric else list(LEADERBOARD_METRICS)
+    return jsonify({
+        'period': period,
+        'bucket': leaderboard_bucket(period),
+        'game_type': game_type,
+        'boards': {name: leaderboard.top(period, game_type, name) for name in shown}
+    })
+
+@app.route('/api/v1/balance')
+def api_balance():
+    return jsonify({'balance': get_user_balance(session['user_id'])})
+
+@app.route('/api/v1/blackjack', methods=['GET'])
+@app.route('/api/v1/blackjack/<action>', methods=['POST'])
+def api_blackjack(action=None):
+    if action not in (None, 'new_game', 'place_bet', 'hit', 'stand'):
+        return api_error('unknown_action', f'Неизвестное действие {action}', 404)
+    bet = None
+    if action == 'place_bet':
+        bet, _, error = api_bet_params()
+        if error:
+            return error
+    game, balance, message = play_blackjack(session['user_id'], session.get('session_id'), action, bet)
+    return jsonify({'balance': balance, 'message': message, **blackjack_view(game)})
+
 @app.route('/reset_balance')
 def reset_balance():
     user_id = session.get('user_id')
@@ -747,26 +3046,19 @@ def reset_balance():
     
     update_user_balance(user_id, 1000)
     
-    conn = sqlite3.connect('casino.db')
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM game_history WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
-    
-    if 'blackjack_deck' in session:
-        del session['blackjack_deck']
-    if 'player_hand' in session:
-        del session['player_hand']
-    if 'dealer_hand' in session:
-        del session['dealer_hand']
-    if 'game_state' in session:
-        del session['game_state']
-    if 'blackjack_bet' in session:
-        del session['blackjack_bet']
+    history_journal.flush()
+    leaderboard.discard(user_id)
+    get_storage().clear_history(user_id)
+    
+    blackjack_store.delete(session.get('session_id'))
     
     flash('Баланс сброшен до 1000 копейка', 'success')
     return redirect('/')
 
+if app.config['METRICS_ENABLED']:
+    metrics.init_app(app)
+
+# Сервер разработки (один процесс). Для продакшена - serve.py или asgi.py
 if __name__ == '__main__':
     init_db()
-    app.run(debug=True, host='0.0.0.0', port=5005)
+    app.run(debug=os.environ.get('CASINO_DEBUG') == '1', host='0.0.0.0', port=5005)
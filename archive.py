@@ -0,0 +1,209 @@
+# Архивация истории игр. Строки game_history старше --days дней переносятся в помесячные
+# БД (archive/history-2024-01.db), а в основной БД остаются помесячные итоги по пользователям
+# и играм (game_history_rollups) и общая статистика user_game_stats.
+#
+# Перенос идет пачками по --batch строк: каждая пачка - короткая транзакция записи, между
+# пачками основная БД свободна для игровых запросов. Освободившиеся страницы возвращаются
+# файловой системе через PRAGMA incremental_vacuum, тоже понемногу после каждой пачки.
+#
+# Повторный запуск после сбоя безопасен: пачка сначала записывается в архив (INSERT OR IGNORE
+# по id), и только потом удаляется из основной БД в одной транзакции с обновлением итогов.
+#
+# Запуск (например, раз в сутки из cron):
+#   python archive.py --days 90 --batch 500
+#   python archive.py --convert   # однократно: включить incremental_vacuum в старой БД (VACUUM)
+import argparse
+import logging
+import os
+import sys
+import time
+import sqlite3
+from datetime import datetime, timedelta
+
+import app as casino
+
+log = logging.getLogger('casino.archive')
+
+HISTORY_COLUMNS = 'id, user_id, game_type, bet_amount, win_amount, result, created_at'
+
+ARCHIVE_SCHEMA = [
+    '''
+        CREATE TABLE IF NOT EXISTS game_history (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            game_type TEXT,
+            bet_amount INTEGER,
+            win_amount INTEGER,
+            result TEXT,
+            created_at TIMESTAMP
+        )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_game_history_user_created ON game_history (user_id, created_at)',
+]
+
+ROLLUP_UPSERT_SQL = '''INSERT INTO game_history_rollups
+           (user_id, month, game_type, rounds, wins, losses, pushes, total_bet, total_win)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+           ON CONFLICT (user_id, month, game_type) DO UPDATE SET
+               rounds = rounds + excluded.rounds,
+               wins = wins + excluded.wins,
+               losses = losses + excluded.losses,
+               pushes = pushes + excluded.pushes,
+               total_bet = total_bet + excluded.total_bet,
+               total_win = total_win + excluded.total_win'''
+
+# Помесячные файлы архива; соединения открываются при первой записи в месяц
+class Archive:
+    def __init__(self, directory):
+        self.directory = directory
+        self.connections = {}
+
+    def connection(self, month):
+        conn = self.connections.get(month)
+        if conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.directory, f'history-{month}.db'))
+            for step in ARCHIVE_SCHEMA:
+                conn.execute(step)
+            conn.commit()
+            self.connections[month] = conn
+        return conn
+
+    # Запись пачки с фиксацией на диске до удаления строк из основной БД
+    def write(self, rows):
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row[6][:7], []).append(row)
+        for month, month_rows in by_month.items():
+            conn = self.connection(month)
+            with conn:
+                conn.executemany(
+                    f'INSERT OR IGNORE INTO game_history ({HISTORY_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    month_rows
+                )
+
+    def close(self):
+        for conn in self.connections.values():
+            conn.close()
+        self.connections.clear()
+
+# Итоги пачки: строки для ROLLUP_UPSERT_SQL по (user_id, месяц, игра). total_win - сумма
+# выплат, как total_won в user_game_stats, чтобы итоги архива сходились со статистикой
+def rollups(rows):
+    totals = {}
+    for _, user_id, game_type, bet_amount, win_amount, result, created_at in rows:
+        if user_id is None:
+            continue
+        entry = totals.setdefault((user_id, created_at[:7], game_type), [0, 0, 0, 0, 0, 0])
+        entry[0] += 1
+        entry[1 + casino.HISTORY_OUTCOMES.index(casino.history_outcome(game_type, win_amount, result))] += 1
+        entry[4] += bet_amount or 0
+        entry[5] += casino.history_payout(game_type, bet_amount or 0, win_amount or 0, result)
+    return [key + tuple(entry) for key, entry in totals.items()]
+
+# Перенос одной пачки: (число строк-кандидатов, перенесенные строки).
+# Старейшие строки первыми: диапазон и порядок берутся из индекса idx_game_history_created
+def archive_batch(conn, archive, cutoff, batch):
+    rows = conn.execute(
+        f'''SELECT {HISTORY_COLUMNS}
+           FROM game_history
+           WHERE created_at < ?
+           ORDER BY created_at, id
+           LIMIT ?''',
+        (cutoff, batch)
+    ).fetchall()
+    if not rows:
+        return 0, []
+
+    archive.write(rows)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Строки, удаленные между выборкой и транзакцией (сброс баланса), в итоги не попадают
+        moved = [row for row in rows
+                 if conn.execute('DELETE FROM game_history WHERE id = ?', (row[0],)).rowcount]
+        conn.executemany(ROLLUP_UPSERT_SQL, rollups(moved))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows), moved
+
+# Возврат не более pages свободных страниц; число возвращенных страниц
+def incremental_vacuum(conn, pages):
+    before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if before:
+        # Через execute выполняется только первый шаг (одна страница), executescript - до конца
+        conn.executescript(f'PRAGMA incremental_vacuum({min(before, pages):d})')
+    return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+def run(args):
+    path = args.db or casino.app.config['DATABASE']
+    casino.app.config['DATABASE'] = path
+    casino.init_db()
+    casino.close_all_connections()
+
+    conn = casino._open_connection(path)
+    conn.isolation_level = None
+    if args.convert:
+        log.info('Включение incremental_vacuum: VACUUM блокирует БД до завершения')
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    if not vacuum:
+        log.warning('incremental_vacuum выключен: файл БД не уменьшится, запустите с --convert')
+
+    size_before = os.path.getsize(path)
+    cutoff = (datetime.utcnow() - timedelta(days=args.days)).strftime('%Y-%m-%d %H:%M:%S')
+    archive = Archive(args.archive_dir)
+    months = {}
+    total = 0
+    freed = 0
+    log.info('Архивация истории до %s в %s', cutoff, args.archive_dir)
+    try:
+        while not args.max_rows or total < args.max_rows:
+            limit = args.batch if not args.max_rows else min(args.batch, args.max_rows - total)
+            selected, moved = archive_batch(conn, archive, cutoff, limit)
+            if not selected:
+                break
+            total += len(moved)
+            for row in moved:
+                months[row[6][:7]] = months.get(row[6][:7], 0) + 1
+            if vacuum:
+                freed += incremental_vacuum(conn, args.vacuum_pages)
+            time.sleep(args.pause)
+    finally:
+        archive.close()
+        conn.close()
+
+    for month in sorted(months):
+        log.info('%s: %d строк', month, months[month])
+    log.info('Перенесено строк: %d, возвращено страниц: %d, размер БД: %d -> %d байт',
+             total, freed, size_before, os.path.getsize(path))
+    return total
+
+def main():
+    config = casino.app.config
+    parser = argparse.ArgumentParser(description='Архивация старой истории игр')
+    parser.add_argument('--db', help=f"файл БД (по умолчанию {config['DATABASE']})")
+    parser.add_argument('--archive-dir', default=config['HISTORY_ARCHIVE_DIR'])
+    parser.add_argument('--days', type=int, default=config['HISTORY_RETENTION_DAYS'],
+                        help='переносить строки старше N дней')
+    parser.add_argument('--batch', type=int, default=config['HISTORY_ARCHIVE_BATCH'],
+                        help='строк в одной транзакции')
+    parser.add_argument('--pause', type=float, default=0.05, help='пауза между пачками (сек)')
+    parser.add_argument('--vacuum-pages', type=int, default=1000,
+                        help='не больше N страниц incremental_vacuum после пачки')
+    parser.add_argument('--max-rows', type=int, default=0, help='не больше N строк за запуск (0 - все)')
+    parser.add_argument('--convert', action='store_true',
+                        help='однократно включить incremental_vacuum в существующей БД (полный VACUUM)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    if config['STORAGE'] != 'sqlite':
+        log.error('Архивация работает только с хранилищем sqlite')
+        return 1
+    run(args)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,193 @@
+# ASGI-точка входа. Соединения (в том числе тысячи простаивающих keep-alive) и чтение
+# тел запросов обслуживает цикл событий, а обработчик Flask со всеми обращениями
+# к SQLite выполняется в пуле DB_EXECUTOR_THREADS потоков. Число потоков, а значит
+# и соединений с БД (по одному на поток), ограничено независимо от числа игроков.
+#
+# Запуск (нужен ASGI-сервер, например uvicorn):
+#   uvicorn asgi:application --host 0.0.0.0 --port 5005
+import asyncio
+import functools
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import (app, init_db, history_journal, session_sweeper, leaderboard, ledger_checkpointer,
+                 shutdown_password_hasher, close_all_connections)
+
+# Сколько фрагментов ответа может ждать отправки, пока поток обработчика не остановится
+RESPONSE_QUEUE_SIZE = 8
+
+db_executor = ThreadPoolExecutor(
+    max_workers=app.config['DB_EXECUTOR_THREADS'],
+    thread_name_prefix='casino-db'
+)
+
+# Выполнение блокирующей функции (запросы к БД) в пуле, не занимая цикл событий
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
+
+class ClientDisconnected(Exception):
+    pass
+
+# Чтение тела запроса целиком; None, если тело больше ASGI_MAX_BODY_SIZE
+async def read_body(receive):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ClientDisconnected()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > app.config['ASGI_MAX_BODY_SIZE']:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+# WSGI-окружение для Flask из ASGI scope
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+            continue
+        key = 'HTTP_' + name
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+# Вызов Flask в потоке пула. Запрос целиком (включая потоковый ответ) остается в одном
+# потоке, поэтому соединение с БД из get_db не переходит между потоками. Сообщения
+# ASGI передаются в цикл событий через ограниченную очередь - медленный клиент
+# притормаживает обработчик, а не накапливает ответ в памяти.
+def respond(environ, loop, queue, disconnected):
+    def put(message):
+        if disconnected.is_set():
+            raise ClientDisconnected()
+        asyncio.run_coroutine_threadsafe(queue.put(message), loop).result()
+
+    pending = {}
+
+    def send_body(data):
+        if 'start' in pending:
+            put(pending.pop('start'))
+        if data:
+            put({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+    def start_response(status, headers, exc_info=None):
+        pending['start'] = {
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                        for name, value in headers],
+        }
+        return send_body
+
+    try:
+        result = app(environ, start_response)
+        try:
+            for data in result:
+                send_body(data)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        send_body(b'')
+        put({'type': 'http.response.body', 'body': b''})
+    except ClientDisconnected:
+        pass
+    finally:
+        if not disconnected.is_set():
+            asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+
+async def send_error(send, status, text):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain; charset=utf-8')],
+    })
+    await send({'type': 'http.response.body', 'body': text.encode('utf-8')})
+
+async def handle_http(scope, receive, send):
+    try:
+        body = await read_body(receive)
+    except ClientDisconnected:
+        return
+    if body is None:
+        await send_error(send, 413, 'Request Entity Too Large')
+        return
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=RESPONSE_QUEUE_SIZE)
+    disconnected = threading.Event()
+    worker = loop.run_in_executor(db_executor, respond, build_environ(scope, body), loop, queue, disconnected)
+    try:
+        while True:
+            message = await queue.get()
+            if message is None:
+                break
+            await send(message)
+    finally:
+        if not worker.done():
+            # Клиент ушел: освобождаем поток обработчика, ожидающий места в очереди
+            disconnected.set()
+            while not queue.empty():
+                queue.get_nowait()
+    await worker
+
+# Запуск и остановка процесса: миграции один раз до первого запроса,
+# при остановке - сброс журнала истории и закрытие соединений
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await run_db(init_db)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await run_db(session_sweeper.stop)
+            await run_db(leaderboard.stop)
+            await run_db(ledger_checkpointer.stop)
+            await run_db(shutdown_password_hasher)
+            await run_db(history_journal.stop)
+            db_executor.shutdown(wait=True)
+            close_all_connections()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        await handle_http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    else:
+        raise NotImplementedError(f"Неподдерживаемый тип соединения: {scope['type']}")
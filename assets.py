@@ -0,0 +1,159 @@
+# Сборка статики. CSS и JS из static/ минифицируются и записываются в static/dist/
+# под именем с хешем содержимого (style.3f2a9c1b0d.css) вместе с заранее сжатыми
+# вариантами .gz и .br (brotli - если установлен пакет brotli). Соответствие исходных
+# имен собранным - в static/dist/manifest.json.
+#
+# Приложение отдает собранные файлы через /assets/ с Cache-Control: immutable на год
+# (шаблоны ссылаются на них через asset_url). Без сборки шаблоны ссылаются на исходные
+# файлы в static/, как при разработке.
+#
+# Файлы предыдущей сборки остаются в static/dist/: на них ссылаются закэшированные страницы
+# и воркеры, которые при плавном перезапуске (kill -HUP) еще отдают страницы по старому
+# манифесту. Удаляются только файлы более старых сборок.
+#
+# Запуск (после каждого изменения статики, перед запуском сервера):
+#   python assets.py
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+import app as casino
+
+SOURCE_EXTENSIONS = ('.css', '.js')
+MANIFEST_NAME = 'manifest.json'
+
+CSS_STRING = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''')
+
+# Минификация CSS: без комментариев и лишних пробелов (строки в кавычках не меняются)
+def minify_css(text):
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    parts = CSS_STRING.split(text)
+    for i in range(0, len(parts), 2):
+        part = re.sub(r'\s+', ' ', parts[i])
+        part = re.sub(r'\s*([{};,>])\s*', r'\1', part)
+        part = re.sub(r':\s+', ':', part)
+        parts[i] = part.replace(';}', '}')
+    return ''.join(parts).strip()
+
+# Минификация JS без разбора синтаксиса: удаляются комментарии, отступы и пустые строки.
+# Переводы строк сохраняются, поэтому автоматическая расстановка точек с запятой не меняется.
+# Литералы регулярных выражений не распознаются - в исходниках их нет
+def minify_js(text):
+    out = []
+    i = 0
+    length = len(text)
+    while i < length:
+        char = text[i]
+        if char in '\'"`':
+            end = i + 1
+            while end < length and text[end] != char:
+                end += 2 if text[end] == '\\' else 1
+            out.append(text[i:end + 1])
+            i = end + 1
+        elif text.startswith('//', i):
+            end = text.find('\n', i)
+            i = length if end < 0 else end
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = length if end < 0 else end + 2
+        else:
+            out.append(char)
+            i += 1
+    lines = (line.strip() for line in ''.join(out).split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+# Исходные файлы: пути относительно static/ (без static/dist)
+def find_sources(static_dir, dist_dir):
+    sources = []
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = [name for name in dirs if os.path.join(root, name) != dist_dir]
+        for name in files:
+            if name.endswith(SOURCE_EXTENSIONS):
+                sources.append(os.path.relpath(os.path.join(root, name), static_dir).replace(os.sep, '/'))
+    return sorted(sources)
+
+def hashed_name(name, data):
+    base, ext = os.path.splitext(name)
+    return f'{base}.{hashlib.sha256(data).hexdigest()[:10]}{ext}'
+
+# Сжатые варианты: (суффикс, данные), только если они меньше исходника
+def compressed_variants(data):
+    variants = [('.gz', gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    return [(suffix, packed) for suffix, packed in variants if len(packed) < len(data)]
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def read_manifest(dist_dir):
+    try:
+        with open(os.path.join(dist_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+# Файлы сборки по манифесту: собранные файлы и их сжатые варианты
+def manifest_files(manifest):
+    return {target + suffix for target in manifest.values() for suffix in ('', '.gz', '.br')}
+
+def build(static_dir, dist_dir):
+    previous = read_manifest(dist_dir)
+    manifest = {}
+    written = set()
+    for name in find_sources(static_dir, dist_dir):
+        with open(os.path.join(static_dir, name), encoding='utf-8') as f:
+            source = f.read()
+        data = MINIFIERS[os.path.splitext(name)[1]](source).encode('utf-8')
+        target = hashed_name(name, data)
+        manifest[name] = target
+        write_file(os.path.join(dist_dir, target), data)
+        written.add(target)
+        sizes = [f'{len(source.encode("utf-8"))} -> {len(data)}']
+        for suffix, packed in compressed_variants(data):
+            write_file(os.path.join(dist_dir, target + suffix), packed)
+            written.add(target + suffix)
+            sizes.append(f'{suffix}: {len(packed)}')
+        print(f'{name} -> {target} ({", ".join(sizes)} байт)')
+
+    with open(os.path.join(dist_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    # Новый манифест уже записан; остаются файлы этой и предыдущей сборки. Повторная сборка
+    # без изменений ничего не удаляет, иначе пропала бы сборка перед предыдущей
+    if manifest != previous:
+        keep = written | manifest_files(previous)
+        for root, _, files in os.walk(dist_dir):
+            for name in files:
+                relative = os.path.relpath(os.path.join(root, name), dist_dir).replace(os.sep, '/')
+                if relative != MANIFEST_NAME and relative not in keep:
+                    os.remove(os.path.join(root, name))
+    if brotli is None:
+        print('Пакет brotli не установлен: варианты .br не созданы')
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description='Сборка статики: минификация, хеши в именах, сжатие')
+    parser.add_argument('--static-dir', default=casino.app.static_folder)
+    parser.add_argument('--dist-dir', help='каталог сборки (по умолчанию <static-dir>/dist)')
+    args = parser.parse_args()
+
+    dist_dir = args.dist_dir or os.path.join(args.static_dir, 'dist')
+    build(os.path.abspath(args.static_dir), os.path.abspath(dist_dir))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+# Микробенчмарк подсчета очков руки блэкджека: прежний разбор строк "10♥"
+# против табличного подсчета по числовым картам и накопителя в dealer_play.
+#
+# Запуск:
+#   python -m benchmarks.hand_evaluator --hands 200000
+import argparse
+import random
+import timeit
+
+from app import BlackjackGame, CARD_NAMES
+
+# Прежняя реализация: карта - строка, очки вычисляются разбором строки
+def legacy_hand_value(hand):
+    value = 0
+    aces = 0
+
+    for card in hand:
+        card_value = card[:-1]
+        if card_value in ['J', 'Q', 'K']:
+            value += 10
+        elif card_value == 'A':
+            aces += 1
+            value += 11
+        else:
+            value += int(card_value)
+
+    while value > 21 and aces > 0:
+        value -= 10
+        aces -= 1
+
+    return value
+
+def legacy_dealer_play(dealer_hand, deck):
+    while legacy_hand_value(dealer_hand) < 17:
+        dealer_hand.append(deck.pop())
+    return dealer_hand, deck
+
+def make_hands(count, seed):
+    rng = random.Random(seed)
+    hands = []
+    for _ in range(count):
+        hands.append(rng.sample(range(len(CARD_NAMES)), rng.randint(2, 6)))
+    return hands
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк подсчета очков руки блэкджека')
+    parser.add_argument('--hands', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    hands = make_hands(args.hands, args.seed)
+    named_hands = [BlackjackGame.card_names(hand) for hand in hands]
+
+    # Обе реализации должны давать одинаковый результат
+    for hand, named in zip(hands, named_hands):
+        assert BlackjackGame.calculate_hand_value(hand) == legacy_hand_value(named), named
+
+    decks = [BlackjackGame.new_deck(seed) for seed in range(1000)]
+    named_decks = [BlackjackGame.card_names(deck) for deck in decks]
+
+    def run_legacy_hands():
+        for hand in named_hands:
+            legacy_hand_value(hand)
+
+    def run_int_hands():
+        for hand in hands:
+            BlackjackGame.calculate_hand_value(hand)
+
+    def run_legacy_dealer():
+        for deck in named_decks:
+            deck = list(deck)
+            legacy_dealer_play([deck.pop(), deck.pop()], deck)
+
+    def run_int_dealer():
+        for deck in decks:
+            deck = list(deck)
+            BlackjackGame.dealer_play([deck.pop(), deck.pop()], deck)
+
+    cases = [
+        ('calculate_hand_value, строки', run_legacy_hands, len(hands)),
+        ('calculate_hand_value, числа', run_int_hands, len(hands)),
+        ('dealer_play, строки', run_legacy_dealer, len(decks)),
+        ('dealer_play, числа', run_int_dealer, len(decks)),
+    ]
+    for name, func, count in cases:
+        best = min(timeit.repeat(func, number=1, repeat=5))
+        print(f"{name:<32} {best / count * 1e9:8.0f} нс на вызов")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# Замер времени запросов к game_history и user_sessions до и после индексов (миграция 2).
+#
+# Запуск:
+#   python -m benchmarks.history_indexes                  # 1 млн строк истории
+#   python -m benchmarks.history_indexes --rows 1000000 10000000
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import app as casino
+
+GAME_TYPES = ['slots', 'blackjack', 'coinflip', 'dice']
+RESULTS = ['win', 'lose', 'push']
+
+# Запросы приложения, которые должны использовать индексы
+QUERIES = {
+    'get_game_history': (
+        '''SELECT game_type, bet_amount, win_amount, result, created_at
+           FROM game_history
+           WHERE user_id = ?
+           ORDER BY created_at DESC
+           LIMIT 5''',
+        lambda users: (random.randint(1, users),)
+    ),
+    'coinflip_stats': (
+        '''SELECT
+            COUNT(CASE WHEN result = 'win' THEN 1 END) as wins,
+            COUNT(*) as total
+           FROM game_history
+           WHERE user_id = ? AND game_type = 'coinflip' ''',
+        lambda users: (random.randint(1, users),)
+    ),
+    'verify_session': (
+        'SELECT user_id FROM user_sessions WHERE session_id = ? AND expires_at > datetime("now")',
+        lambda users: (f'session-{random.randint(1, users)}',)
+    ),
+    'expired_sessions': (
+        'SELECT COUNT(*) FROM user_sessions WHERE expires_at <= datetime("now")',
+        lambda users: ()
+    ),
+}
+
+def populate(conn, rows, users):
+    conn.executemany(
+        'INSERT INTO users (id, username, email, password_hash) VALUES (?, ?, ?, ?)',
+        ((i, f'user{i}', f'user{i}@example.com', '') for i in range(1, users + 1))
+    )
+    now = datetime.utcnow()
+    conn.executemany(
+        'INSERT INTO user_sessions (session_id, user_id, expires_at) VALUES (?, ?, ?)',
+        ((f'session-{i}', i, (now + timedelta(days=random.randint(-30, 7))).strftime('%Y-%m-%d %H:%M:%S'))
+         for i in range(1, users + 1))
+    )
+
+    start = now - timedelta(days=365)
+    def history():
+        for i in range(rows):
+            created = start + timedelta(seconds=i * 31536000 // rows)
+            yield (random.randint(1, users), random.choice(GAME_TYPES), 10,
+                   random.choice([0, 20]), random.choice(RESULTS),
+                   created.strftime('%Y-%m-%d %H:%M:%S'))
+    conn.executemany(casino.HISTORY_INSERT_SQL, history())
+    conn.commit()
+
+def time_queries(conn, users, repeat):
+    timings = {}
+    for name, (sql, params) in QUERIES.items():
+        samples = []
+        for _ in range(repeat):
+            args = params(users)
+            started = time.perf_counter()
+            conn.execute(sql, args).fetchall()
+            samples.append((time.perf_counter() - started) * 1000)
+        plan = conn.execute('EXPLAIN QUERY PLAN ' + sql, params(users)).fetchall()
+        timings[name] = {
+            'median_ms': round(statistics.median(samples), 3),
+            'max_ms': round(max(samples), 3),
+            'plan': ' | '.join(row[-1] for row in plan),
+        }
+    return timings
+
+def run(rows, users, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'bench.db'))
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = OFF')
+
+        casino.migrate(conn, target=1)
+        started = time.perf_counter()
+        populate(conn, rows, users)
+        print(f"{rows} строк истории записано за {time.perf_counter() - started:.1f} с")
+
+        before = time_queries(conn, users, repeat)
+        started = time.perf_counter()
+        casino.migrate(conn, target=2)
+        print(f"Индексы построены за {time.perf_counter() - started:.1f} с")
+        after = time_queries(conn, users, repeat)
+        conn.close()
+    return {'rows': rows, 'users': users, 'before': before, 'after': after}
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк индексов game_history и user_sessions')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000000])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help='сохранить результаты в JSON-файл')
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        result = run(rows, args.users, args.repeat)
+        results.append(result)
+        print(f"\n{'Запрос':<20} {'без индексов, мс':>18} {'с индексами, мс':>18}")
+        for name in QUERIES:
+            print(f"{name:<20} {result['before'][name]['median_ms']:>18} {result['after'][name]['median_ms']:>18}")
+            print(f"  план: {result['after'][name]['plan']}")
+        print()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+# Нагрузочный тест маршрутов. Синтетические пользователи регистрируются через
+# /auth/register и играют смешанную нагрузку (/slots, /coinflip, /dice, /blackjack, /)
+# в несколько потоков. Цель - тестовый клиент Flask (без сети), локальный сервер
+# Werkzeug в этом же процессе или внешний адрес (serve.py, uvicorn).
+# Отчет: p50/p95/p99 по маршрутам, запросов в секунду и число COMMIT в SQLite
+# (только для клиента и локального сервера). Результат сохраняется в JSON
+# и сравнивается с прошлым прогоном через --compare.
+#
+# Запуск:
+#   python -m benchmarks.load --target client --requests 20000 --concurrency 8
+#   python -m benchmarks.load --target server --storage memory --json after.json --compare before.json
+#   python -m benchmarks.load --target http://127.0.0.1:5005 --concurrency 64
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlencode, urlsplit
+
+import app as casino
+
+DEFAULT_MIX = 'slots=3,coinflip=2,dice=2,blackjack=2,index=1'
+BLACKJACK_ACTIONS = ['new_game', 'place_bet', 'stand']
+
+def parse_mix(value):
+    mix = []
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('slots', 'coinflip', 'dice', 'blackjack', 'index'):
+            raise argparse.ArgumentTypeError(f'неизвестная операция {name}')
+        mix.append((name, float(weight or 1)))
+    return mix
+
+# Подсчет COMMIT во всех соединениях, открытых приложением после install
+class CommitCounter:
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def trace(self, statement):
+        if statement.startswith('COMMIT'):
+            with self.lock:
+                self.count += 1
+
+    def install(self):
+        open_connection = casino._open_connection
+
+        def traced(path):
+            conn = open_connection(path)
+            conn.set_trace_callback(self.trace)
+            return conn
+
+        casino._open_connection = traced
+        casino.close_all_connections()
+
+# Пользователь поверх тестового клиента Flask (cookie хранит сам клиент)
+class ClientSession:
+    def __init__(self):
+        self.client = casino.app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.get_data()
+        return response.status_code
+
+# Пользователь поверх HTTP с keep-alive и собственными cookie
+class HttpSession:
+    def __init__(self, host, port):
+        self.conn = http.client.HTTPConnection(host, port, timeout=30)
+        self.cookies = {}
+
+    def request(self, method, path, data=None):
+        headers = {}
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        try:
+            self.conn.request(method, path, body, headers)
+            response = self.conn.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            # Следующий запрос откроет соединение заново
+            self.conn.close()
+            raise
+        for header in response.headers.get_all('Set-Cookie') or []:
+            name, _, rest = header.partition('=')
+            self.cookies[name.strip()] = rest.split(';', 1)[0]
+        return response.status
+
+class Player:
+    def __init__(self, session, rng, bet):
+        self.session = session
+        self.rng = rng
+        self.bet = bet
+        self.blackjack_step = 0
+
+    def register(self, name):
+        status = self.session.request('POST', '/auth/register', {
+            'username': name,
+            'email': f'{name}@example.com',
+            'password': 'benchmark',
+            'confirm_password': 'benchmark',
+        })
+        if status >= 400:
+            raise RuntimeError(f'регистрация {name}: HTTP {status}')
+
+    def play(self, operation):
+        if operation == 'slots':
+            return self.session.request('POST', '/slots', {'bet': self.bet})
+        if operation == 'coinflip':
+            return self.session.request('POST', '/coinflip', {
+                'bet': self.bet, 'choice': self.rng.choice(casino.COIN_SIDES)
+            })
+        if operation == 'dice':
+            return self.session.request('POST', '/dice', {'bet': self.bet})
+        if operation == 'blackjack':
+            action = BLACKJACK_ACTIONS[self.blackjack_step]
+            self.blackjack_step = (self.blackjack_step + 1) % len(BLACKJACK_ACTIONS)
+            return self.session.request('POST', '/blackjack', {'action': action, 'bet': self.bet})
+        return self.session.request('GET', '/')
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    index = min(len(samples) - 1, max(0, int(round(q / 100 * len(samples) + 0.5)) - 1))
+    return round(samples[index], 3)
+
+def summarize(samples, errors, seconds):
+    samples = sorted(samples)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'rps': round(len(samples) / seconds, 1) if seconds else None,
+        'p50_ms': percentile(samples, 50),
+        'p95_ms': percentile(samples, 95),
+        'p99_ms': percentile(samples, 99),
+        'max_ms': round(samples[-1], 3) if samples else None,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(casino.__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Локальный многопоточный сервер Werkzeug на свободном порту
+def start_server():
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, code='-', size='-'):
+            pass
+
+    server = make_server('127.0.0.1', 0, casino.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def run(args):
+    mix = parse_mix(args.mix)
+    operations = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+
+    counter = None
+    server = None
+    if args.target in ('client', 'server'):
+        casino.app.config['STORAGE'] = args.storage
+        if args.storage == 'sqlite':
+            counter = CommitCounter()
+            counter.install()
+        casino.init_db()
+    if args.target == 'client':
+        make_session = ClientSession
+    else:
+        if args.target == 'server':
+            server = start_server()
+            host, port = '127.0.0.1', server.server_port
+        else:
+            url = urlsplit(args.target)
+            host, port = url.hostname, url.port or 80
+        make_session = lambda: HttpSession(host, port)
+
+    users = max(args.users, args.concurrency)
+    run_id = f'{int(time.time())}{random.randrange(1000):03d}'
+    players = []
+    for i in range(users):
+        player = Player(make_session(), random.Random(args.seed + i), args.bet)
+        player.register(f'bench{run_id}_{i}')
+        players.append(player)
+
+    results = [None] * args.concurrency
+    per_thread = args.requests // args.concurrency
+    warmup = args.warmup // args.concurrency
+    start = threading.Barrier(args.concurrency + 1)
+
+    def worker(index):
+        own = players[index::args.concurrency]
+        rng = random.Random(args.seed * 1000 + index)
+        latencies = {name: [] for name in operations}
+        errors = {name: 0 for name in operations}
+        for _ in range(warmup):
+            rng.choice(own).play(rng.choices(operations, weights)[0])
+        start.wait()
+        for _ in range(per_thread):
+            operation = rng.choices(operations, weights)[0]
+            started = time.perf_counter()
+            try:
+                status = rng.choice(own).play(operation)
+            except (http.client.HTTPException, OSError):
+                status = None
+            elapsed = (time.perf_counter() - started) * 1000
+            if status is None or status >= 400:
+                errors[operation] += 1
+            else:
+                latencies[operation].append(elapsed)
+        results[index] = (latencies, errors)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    commits_before = counter.count if counter else None
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    commits = counter.count - commits_before if counter else None
+
+    if server is not None:
+        server.shutdown()
+    # Фоновые потоки пишут в БД во временном каталоге: останавливаем до его удаления
+    casino.session_sweeper.stop()
+    casino.leaderboard.stop()
+    casino.ledger_checkpointer.stop()
+    casino.history_journal.stop()
+
+    endpoints = {}
+    all_samples = []
+    total_errors = 0
+    for name in operations:
+        samples = [ms for latencies, _ in results for ms in latencies[name]]
+        errors = sum(errors[name] for _, errors in results)
+        endpoints[name] = summarize(samples, errors, seconds)
+        all_samples.extend(samples)
+        total_errors += errors
+
+    total = summarize(all_samples, total_errors, seconds)
+    total['seconds'] = round(seconds, 3)
+    total['commits'] = commits
+    total['commits_per_request'] = round(commits / len(all_samples), 3) if commits is not None and all_samples else None
+
+    return {
+        'meta': {
+            'target': args.target,
+            'storage': args.storage if args.target in ('client', 'server') else None,
+            'requests': per_thread * args.concurrency,
+            'concurrency': args.concurrency,
+            'users': users,
+            'mix': args.mix,
+            'bet': args.bet,
+            'seed': args.seed,
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+        },
+        'total': total,
+        'endpoints': endpoints,
+    }
+
+def print_report(result, baseline=None):
+    columns = ['rps', 'p50_ms', 'p95_ms', 'p99_ms']
+
+    def cell(name, key):
+        value = result['total'][key] if name == 'всего' else result['endpoints'][name][key]
+        if baseline is None:
+            return f'{value}'
+        base = baseline['total'] if name == 'всего' else baseline['endpoints'].get(name)
+        if not base or not base.get(key) or value is None:
+            return f'{value}'
+        return f'{value} ({(value - base[key]) / base[key] * 100:+.1f}%)'
+
+    print(f"\n{'Маршрут':<12}" + ''.join(f'{column:>22}' for column in columns) + f"{'ошибок':>10}")
+    for name in list(result['endpoints']) + ['всего']:
+        errors = result['total']['errors'] if name == 'всего' else result['endpoints'][name]['errors']
+        print(f'{name:<12}' + ''.join(f'{cell(name, column):>22}' for column in columns) + f'{errors:>10}')
+
+    total = result['total']
+    line = f"\n{total['requests']} запросов за {total['seconds']} с"
+    if total['commits'] is not None:
+        line += f", COMMIT: {total['commits']} ({total['commits_per_request']} на запрос)"
+    print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест маршрутов казино')
+    parser.add_argument('--target', default='client',
+                        help="client (тестовый клиент Flask), server (локальный сервер) или http://host:port")
+    parser.add_argument('--storage', choices=sorted(casino.STORAGE_BACKENDS), default='sqlite')
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--users', type=int, default=32)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'веса операций, по умолчанию {DEFAULT_MIX}')
+    parser.add_argument('--bet', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='сохранить результат в JSON-файл')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+    parse_mix(args.mix)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.target in ('client', 'server'):
+            casino.app.config['DATABASE'] = os.path.join(tmp, 'load.db')
+        result = run(args)
+        casino.close_all_connections()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
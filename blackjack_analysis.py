@@ -0,0 +1,191 @@
+# Точный расчет блэкджека по правилам blackjack_page: оптимальная стратегия
+# (взять карту / остановиться) и преимущество казино для шуза из N колод.
+#
+# Правила, как в app.py: дилер добирает до 17 и останавливается на любых 17,
+# закрытую карту дилера не проверяют на блэкджек, блэкджек игрока платит x2.5,
+# но если дилер добрал до 21 - ничья. Удвоения и сплита нет.
+#
+# Состав шуза - кортеж остатков по классам карт (2..9, 10, туз). Распределение
+# итоговых сумм дилера и ожидание игрока кэшируются по (сумма, мягкая ли рука, состав).
+#
+# Запуск:
+#   python blackjack_analysis.py --decks 1 --json strategy.json
+import argparse
+import functools
+import itertools
+import json
+import time
+
+from app import CARD_VALUES
+
+CLASS_VALUES = sorted(set(CARD_VALUES))
+CLASS_COUNTS = [CARD_VALUES.count(value) for value in CLASS_VALUES]
+# Итоги дилера: 17, 18, 19, 20, 21 и перебор
+DEALER_OUTCOMES = [17, 18, 19, 20, 21, 'bust']
+UPCARD_LABELS = {value: ('A' if value == 11 else str(value)) for value in CLASS_VALUES}
+
+def shoe(decks):
+    return tuple(count * decks for count in CLASS_COUNTS)
+
+def remove(counts, index):
+    counts = list(counts)
+    counts[index] -= 1
+    return tuple(counts)
+
+# Сумма руки после добавления карты, как BlackjackGame.add_card
+def add_value(total, soft, value):
+    total += value
+    if value == 11:
+        soft += 1
+    while total > 21 and soft > 0:
+        total -= 10
+        soft -= 1
+    return total, soft
+
+def draws(counts):
+    n = sum(counts)
+    for index, count in enumerate(counts):
+        if count:
+            yield index, CLASS_VALUES[index], count / n
+
+# Распределение итоговых сумм дилера (вероятности DEALER_OUTCOMES)
+@functools.lru_cache(maxsize=None)
+def dealer_distribution(total, soft, counts):
+    if total > 21:
+        return (0.0, 0.0, 0.0, 0.0, 0.0, 1.0)
+    if total >= 17:
+        result = [0.0] * 6
+        result[total - 17] = 1.0
+        return tuple(result)
+
+    result = [0.0] * 6
+    for index, value, p in draws(counts):
+        new_total, new_soft = add_value(total, soft, value)
+        for i, q in enumerate(dealer_distribution(new_total, new_soft, remove(counts, index))):
+            result[i] += p * q
+    return tuple(result)
+
+# Ожидание (на ставку 1) при остановке на сумме total против открытой карты upcard
+@functools.lru_cache(maxsize=None)
+def stand_ev(total, upcard, counts):
+    if total > 21:
+        return -1.0
+    dist = dealer_distribution(*add_value(0, 0, upcard), counts)
+    ev = dist[5]
+    for dealer_total, p in zip(DEALER_OUTCOMES[:5], dist[:5]):
+        if total > dealer_total:
+            ev += p
+        elif total < dealer_total:
+            ev -= p
+    return ev
+
+# Лучшее ожидание и решение игрока: (ev, 'hit' или 'stand')
+@functools.lru_cache(maxsize=None)
+def player_ev(total, soft, upcard, counts):
+    stand = stand_ev(total, upcard, counts)
+    if total >= 21:
+        return stand, 'stand'
+
+    hit = hit_value(total, soft, upcard, counts)
+    return (hit, 'hit') if hit > stand else (stand, 'stand')
+
+# Ожидание, если взять карту и дальше играть оптимально
+def hit_value(total, soft, upcard, counts):
+    value = 0.0
+    for index, card, p in draws(counts):
+        new_total, new_soft = add_value(total, soft, card)
+        value += -p if new_total > 21 else p * player_ev(new_total, new_soft, upcard, remove(counts, index))[0]
+    return value
+
+# Ожидание блэкджека с раздачи: дилер добирает карты, его 21 - ничья
+def natural_ev(upcard, counts):
+    dist = dealer_distribution(*add_value(0, 0, upcard), counts)
+    return 1.5 * (1 - dist[4])
+
+# Полный анализ шуза: преимущество казино, таблица стратегии и распределения дилера
+def analyze(decks=1):
+    started = time.perf_counter()
+    full = shoe(decks)
+    n = sum(full)
+
+    edge = 0.0
+    # Накопление решений по (сумма, мягкая, открытая карта) с весами вероятностей раздач
+    weights = {}
+    for (i, a), (j, b), (k, up) in itertools.product(enumerate(CLASS_VALUES), repeat=3):
+        p = full[i] / n
+        counts = remove(full, i)
+        if not counts[j]:
+            continue
+        p *= counts[j] / (n - 1)
+        counts = remove(counts, j)
+        if not counts[k]:
+            continue
+        p *= counts[k] / (n - 2)
+        counts = remove(counts, k)
+
+        total, soft = add_value(*add_value(0, 0, a), b)
+        if total == 21:
+            edge += p * natural_ev(up, counts)
+            continue
+        ev, _ = player_ev(total, soft, up, counts)
+        edge += p * ev
+
+        key = (total, soft > 0, up)
+        hit_sum, stand_sum = weights.get(key, (0.0, 0.0))
+        weights[key] = (hit_sum + p * hit_value(total, soft, up, counts),
+                        stand_sum + p * stand_ev(total, up, counts))
+
+    strategy = {'hard': {}, 'soft': {}}
+    for (total, soft, up), (hit, stand) in sorted(weights.items()):
+        table = strategy['soft' if soft else 'hard'].setdefault(str(total), {})
+        table[UPCARD_LABELS[up]] = 'hit' if hit > stand else 'stand'
+
+    dealer = {}
+    for index, up in enumerate(CLASS_VALUES):
+        dist = dealer_distribution(*add_value(0, 0, up), remove(full, index))
+        dealer[UPCARD_LABELS[up]] = dict(zip(map(str, DEALER_OUTCOMES), dist))
+
+    return {
+        'decks': decks,
+        'player_ev': edge,
+        'house_edge': -edge,
+        'rtp': 1 + edge,
+        'strategy': strategy,
+        'dealer': dealer,
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+# Таблица стратегии в формате simulator.simulate_blackjack: {(сумма, мягкая, открытая карта): решение}
+def strategy_table(strategy):
+    labels = {label: value for value, label in UPCARD_LABELS.items()}
+    table = {}
+    for kind, rows in strategy.items():
+        for total, row in rows.items():
+            for up, decision in row.items():
+                table[(int(total), kind == 'soft', labels[up])] = decision
+    return table
+
+def print_strategy(strategy):
+    ups = [UPCARD_LABELS[value] for value in CLASS_VALUES]
+    for kind in ('hard', 'soft'):
+        print(f"\n{kind:<6}" + ''.join(f"{up:>4}" for up in ups))
+        for total, row in sorted(strategy[kind].items(), key=lambda item: int(item[0])):
+            print(f"{total:<6}" + ''.join(f"{('H' if row.get(up) == 'hit' else 'S'):>4}" for up in ups))
+
+def main():
+    parser = argparse.ArgumentParser(description='Точная стратегия и преимущество казино в блэкджеке')
+    parser.add_argument('--decks', type=int, default=1)
+    parser.add_argument('--json', help='сохранить результат в JSON-файл')
+    args = parser.parse_args()
+
+    result = analyze(args.decks)
+    print(f"Колод: {result['decks']}, преимущество казино {result['house_edge'] * 100:.3f}%, "
+          f"RTP {result['rtp']:.5f}, расчет за {result['seconds']} с")
+    print_strategy(result['strategy'])
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# Сверка балансов с журналом проводок (ledger_entries). Каждая ставка, выплата, стартовое
+# начисление и сброс баланса записываются проводкой в той же транзакции, что и изменение
+# users.balance, поэтому баланс любого счета восстанавливается по журналу.
+#
+# Обычная сверка идет от последнего снимка (ledger_checkpoints) и читает только проводки
+# после него; если их набралось не меньше LEDGER_CHECKPOINT_ENTRIES, ставится новый снимок.
+# С --full журнал счета читается с самого начала и проверяются также все снимки и баланс
+# после каждой проводки (столбец balance).
+#
+# Запуск:
+#   python ledger.py              # все счета, от последних снимков
+#   python ledger.py --user 42    # один счет
+#   python ledger.py --full       # полная проверка журнала
+import argparse
+import logging
+import sys
+
+import app as casino
+
+log = logging.getLogger('casino.ledger')
+
+# Полная проверка счета: (остаток по журналу, список ошибок)
+def replay_full(conn, user_id):
+    checkpoints = dict(conn.execute(
+        'SELECT entry_id, balance FROM ledger_checkpoints WHERE user_id = ?', (user_id,)
+    ))
+    errors = []
+    balance = 0
+    cursor = conn.execute(
+        '''SELECT id, debit_account, credit_account, amount, balance
+           FROM ledger_entries
+           WHERE user_id = ?
+           ORDER BY id''',
+        (user_id,)
+    )
+    for entry_id, debit_account, credit_account, amount, recorded in cursor:
+        if debit_account == credit_account or {debit_account, credit_account} - set(casino.LEDGER_ACCOUNTS):
+            errors.append(f'проводка {entry_id}: счета {debit_account} -> {credit_account}')
+        if credit_account == casino.LEDGER_PLAYER:
+            balance += amount
+        elif debit_account == casino.LEDGER_PLAYER:
+            balance -= amount
+        if recorded != balance:
+            errors.append(f'проводка {entry_id}: записан баланс {recorded}, по журналу {balance}')
+        expected = checkpoints.pop(entry_id, balance)
+        if expected != balance:
+            errors.append(f'снимок на проводке {entry_id}: {expected}, по журналу {balance}')
+    for entry_id in checkpoints:
+        errors.append(f'снимок на отсутствующей проводке {entry_id}')
+    return balance, errors
+
+def run(args):
+    path = args.db or casino.app.config['DATABASE']
+    casino.app.config['DATABASE'] = path
+    casino.init_db()
+    conn = casino.get_db()
+
+    if args.user:
+        users = args.user
+    else:
+        users = [row[0] for row in conn.execute('SELECT id FROM users ORDER BY id')]
+
+    mismatched = 0
+    replayed = 0
+    for user_id in users:
+        if args.full:
+            row = conn.execute('SELECT balance FROM users WHERE id = ?', (user_id,)).fetchone()
+            if row is None:
+                log.error('Пользователь %s не найден', user_id)
+                mismatched += 1
+                continue
+            ledger_balance, errors = replay_full(conn, user_id)
+            if row[0] != ledger_balance:
+                errors.append(f'баланс {row[0]}, по журналу {ledger_balance}')
+            for error in errors:
+                log.error('Пользователь %s: %s', user_id, error)
+            mismatched += bool(errors)
+            continue
+
+        result = casino.verify_balance(user_id)
+        if result is None:
+            log.error('Пользователь %s не найден', user_id)
+            mismatched += 1
+            continue
+        replayed += result['replayed']
+        if not result['ok']:
+            mismatched += 1
+    casino.close_all_connections()
+
+    log.info('Проверено счетов: %d, расхождений: %d%s', len(users), mismatched,
+             '' if args.full else f', проводок после снимков: {replayed}')
+    return mismatched
+
+def main():
+    config = casino.app.config
+    parser = argparse.ArgumentParser(description='Сверка балансов с журналом проводок')
+    parser.add_argument('--db', help=f"файл БД (по умолчанию {config['DATABASE']})")
+    parser.add_argument('--user', type=int, action='append', help='проверить только этот счет (можно несколько)')
+    parser.add_argument('--full', action='store_true',
+                        help='читать журнал с начала и проверить все снимки и записанные балансы')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    if config['STORAGE'] != 'sqlite':
+        log.error('Сверка работает только с хранилищем sqlite')
+        return 1
+    return 1 if run(args) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
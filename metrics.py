@@ -0,0 +1,286 @@
+# Инструментирование запросов: время обработки, вызовов хранилища (SQLite),
+# рендеринга шаблонов, открытия и сохранения cookie-сессии и размер cookie -
+# гистограммы по маршрутам в текстовом формате Prometheus на /metrics.
+# Выборочные запросы профилируются cProfile, медленные профили пишутся в PROFILE_DIR.
+#
+# Включается переменной CASINO_METRICS=1 (app.config['METRICS_ENABLED']).
+# Метрики хранятся в памяти процесса: при serve.py у каждого воркера свои.
+#
+# Просмотр профиля:
+#   python -m pstats profiles/blackjack_page-1700000000123-250ms.prof
+import cProfile
+import os
+import random
+import threading
+import time
+
+from flask import g, request, has_app_context, before_render_template, template_rendered, request_finished
+
+# Границы корзин гистограмм: секунды и байты
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield f'{self.name}{_labels(self.labels, labels)} {value}'
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # метки -> [счетчики по корзинам (последняя - +Inf), сумма]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = entry[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self.lock:
+            values = sorted((labels, list(counts), total) for labels, (counts, total) in self.values.items())
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ['+Inf'], counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f'{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labels, labels)} {total:.6f}'
+            yield f'{self.name}_count{_labels(self.labels, labels)} {cumulative}'
+
+# Таймеры текущего запроса (в g): создаются при открытии сессии или в первом before_request
+class RequestTimers:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db = 0.0
+        self.db_calls = 0
+        self.template = 0.0
+        self.template_started = None
+        self.session = 0.0
+        self.session_bytes = None
+        self.status = None
+        self.profiler = None
+
+def _timers():
+    if not has_app_context():
+        return None
+    timers = g.get('_metrics')
+    if timers is None:
+        timers = g._metrics = RequestTimers()
+    return timers
+
+# Обертка хранилища: каждый вызов метода учитывается в гистограмме по операции
+# и добавляется к времени БД текущего запроса
+class InstrumentedStorage:
+    def __init__(self, storage, metrics):
+        self._storage = storage
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        attribute = getattr(self._storage, name)
+        if not callable(attribute) or name.startswith('_'):
+            return attribute
+        metrics = self._metrics
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                metrics.db_call_seconds.observe((name,), elapsed)
+                timers = _timers()
+                if timers is not None:
+                    timers.db += elapsed
+                    timers.db_calls += 1
+
+        # Обертка создается один раз на метод
+        setattr(self, name, timed)
+        return timed
+
+# Обертка интерфейса сессий: время разбора и подписи cookie и размер cookie в ответе
+class TimedSessionInterface:
+    def __init__(self, inner):
+        self.inner = inner
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def open_session(self, app, request):
+        timers = _timers()
+        started = time.perf_counter()
+        try:
+            return self.inner.open_session(app, request)
+        finally:
+            if timers is not None:
+                timers.session += time.perf_counter() - started
+
+    def save_session(self, app, session, response):
+        started = time.perf_counter()
+        try:
+            return self.inner.save_session(app, session, response)
+        finally:
+            timers = _timers()
+            if timers is not None:
+                timers.session += time.perf_counter() - started
+                prefix = self.inner.get_cookie_name(app) + '='
+                for header in response.headers.getlist('Set-Cookie'):
+                    if header.startswith(prefix):
+                        timers.session_bytes = len(header.split(';', 1)[0]) - len(prefix)
+                if timers.session_bytes is None:
+                    cookie = request.cookies.get(self.inner.get_cookie_name(app))
+                    if cookie is not None:
+                        timers.session_bytes = len(cookie)
+
+class Metrics:
+    def __init__(self, app):
+        self.app = app
+        self.request_seconds = Histogram(
+            'casino_request_duration_seconds', 'Полное время обработки запроса', ('endpoint', 'method'))
+        self.db_seconds = Histogram(
+            'casino_request_db_seconds', 'Время вызовов хранилища за запрос', ('endpoint',))
+        self.db_calls = Histogram(
+            'casino_request_db_calls', 'Число вызовов хранилища за запрос', ('endpoint',),
+            buckets=(1, 2, 3, 5, 8, 13, 21))
+        self.db_call_seconds = Histogram(
+            'casino_db_call_duration_seconds', 'Время одного вызова хранилища', ('operation',))
+        self.template_seconds = Histogram(
+            'casino_request_template_seconds', 'Время рендеринга шаблонов за запрос', ('endpoint',))
+        self.session_seconds = Histogram(
+            'casino_request_session_seconds', 'Время открытия и сохранения cookie-сессии', ('endpoint',))
+        self.session_bytes = Histogram(
+            'casino_session_cookie_bytes', 'Размер cookie-сессии', ('endpoint',), buckets=SIZE_BUCKETS)
+        self.requests_total = Counter(
+            'casino_requests_total', 'Число запросов', ('endpoint', 'method', 'status'))
+        self.profiles_total = Counter(
+            'casino_slow_request_profiles_total', 'Сохраненные профили медленных запросов', ('endpoint',))
+        self.series = [
+            self.request_seconds, self.db_seconds, self.db_calls, self.db_call_seconds,
+            self.template_seconds, self.session_seconds, self.session_bytes,
+            self.requests_total, self.profiles_total,
+        ]
+        # cProfile профилирует один запрос за раз
+        self.profile_lock = threading.Lock()
+
+    def wrap_storage(self, storage):
+        return InstrumentedStorage(storage, self)
+
+    def before_request(self):
+        timers = _timers()
+        rate = self.app.config['PROFILE_SAMPLE_RATE']
+        if rate and random.random() < rate and self.profile_lock.acquire(blocking=False):
+            timers.profiler = cProfile.Profile()
+            timers.profiler.enable()
+
+    def before_render(self, sender, template, context, **extra):
+        timers = _timers()
+        if timers is not None:
+            timers.template_started = time.perf_counter()
+
+    def rendered(self, sender, template, context, **extra):
+        timers = _timers()
+        if timers is not None and timers.template_started is not None:
+            timers.template += time.perf_counter() - timers.template_started
+            timers.template_started = None
+
+    def finished(self, sender, response, **extra):
+        timers = _timers()
+        if timers is not None:
+            timers.status = response.status_code
+
+    # Итог запроса: после сохранения сессии и сигнала request_finished
+    def teardown(self, exc):
+        timers = g.pop('_metrics', None)
+        if timers is None:
+            return
+        elapsed = time.perf_counter() - timers.started
+        endpoint = request.endpoint or 'not_found'
+        status = timers.status if timers.status is not None else 500
+
+        self.request_seconds.observe((endpoint, request.method), elapsed)
+        self.requests_total.inc((endpoint, request.method, str(status)))
+        self.db_seconds.observe((endpoint,), timers.db)
+        self.db_calls.observe((endpoint,), timers.db_calls)
+        self.template_seconds.observe((endpoint,), timers.template)
+        self.session_seconds.observe((endpoint,), timers.session)
+        if timers.session_bytes is not None:
+            self.session_bytes.observe((endpoint,), timers.session_bytes)
+
+        if timers.profiler is not None:
+            timers.profiler.disable()
+            try:
+                if elapsed >= self.app.config['PROFILE_SLOW_SECONDS']:
+                    self.dump_profile(timers.profiler, endpoint, elapsed)
+            finally:
+                self.profile_lock.release()
+
+    def dump_profile(self, profiler, endpoint, elapsed):
+        directory = self.app.config['PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        name = f'{endpoint}-{int(time.time() * 1000)}-{int(elapsed * 1000)}ms.prof'
+        profiler.dump_stats(os.path.join(directory, name))
+        self.profiles_total.inc((endpoint,))
+
+    def render(self):
+        lines = []
+        for series in self.series:
+            lines.append(f'# HELP {series.name} {series.description}')
+            lines.append(f'# TYPE {series.name} {series.kind}')
+            lines.extend(series.samples())
+        return '\n'.join(lines) + '\n'
+
+    def view(self):
+        return self.app.response_class(self.render(), mimetype='text/plain; version=0.0.4')
+
+# Подключение к приложению: хуки запроса, сигналы шаблонов, обертка сессий и маршрут /metrics
+def init_app(app):
+    metrics = Metrics(app)
+    app.extensions['metrics'] = metrics
+    # Первым в before_request, чтобы профиль и таймеры охватывали и проверку сессии
+    app.before_request_funcs.setdefault(None, []).insert(0, metrics.before_request)
+    app.teardown_request(metrics.teardown)
+    before_render_template.connect(metrics.before_render, app)
+    template_rendered.connect(metrics.rendered, app)
+    request_finished.connect(metrics.finished, app)
+    app.session_interface = TimedSessionInterface(app.session_interface)
+    app.add_url_rule('/metrics', 'metrics', metrics.view)
+    return metrics
@@ -0,0 +1,124 @@
+# Хеши паролей. Формат с версией: $схема$параметры$соль$хеш (соль и хеш - base64 без '='):
+#   $scrypt$n=16384,r=8,p=1$...$...
+#   $pbkdf2-sha256$i=600000$...$...
+# Старые хеши - 64 hex-символа SHA-256 без соли; после успешного входа они
+# пересчитываются в текущую схему (как и хеши с другой схемой или стоимостью).
+#
+# Вычисление идет в отдельном пуле процессов (PasswordHasher): вход и регистрация
+# не занимают GIL и потоки обработчиков игр. Очередь пула ограничена - при перегрузке
+# запрос сразу получает PasswordHasherBusy вместо ожидания в хвосте очереди.
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+SCHEMES = ('scrypt', 'pbkdf2-sha256')
+# Стоимость по умолчанию: N для scrypt, число итераций для PBKDF2
+DEFAULT_COST = {'scrypt': 2 ** 14, 'pbkdf2-sha256': 600000}
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+def _b64encode(data):
+    return base64.b64encode(data).decode().rstrip('=')
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+def _derive(password, scheme, cost, salt):
+    if scheme == 'scrypt':
+        return hashlib.scrypt(password.encode(), salt=salt, n=cost, r=SCRYPT_R, p=SCRYPT_P, dklen=KEY_BYTES,
+                              maxmem=128 * SCRYPT_R * (cost + SCRYPT_P + 2) + 1024 * 1024)
+    if scheme == 'pbkdf2-sha256':
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, cost, KEY_BYTES)
+    raise ValueError(f'Неизвестная схема хеширования {scheme}')
+
+# Разбор хеша: (схема, стоимость, соль, ключ); для старого SHA-256 - ('sha256', 0, b'', digest)
+def parse_hash(stored):
+    if not stored.startswith('$'):
+        return 'sha256', 0, b'', stored
+    _, scheme, params, salt, key = stored.split('$')
+    values = dict(item.split('=') for item in params.split(','))
+    cost = int(values['n'] if scheme == 'scrypt' else values['i'])
+    return scheme, cost, _b64decode(salt), _b64decode(key)
+
+def hash_password(password, scheme='scrypt', cost=None):
+    cost = cost or DEFAULT_COST[scheme]
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = _derive(password, scheme, cost, salt)
+    params = f'n={cost},r={SCRYPT_R},p={SCRYPT_P}' if scheme == 'scrypt' else f'i={cost}'
+    return f'${scheme}${params}${_b64encode(salt)}${_b64encode(key)}'
+
+def verify_password(password, stored):
+    try:
+        scheme, cost, salt, key = parse_hash(stored)
+    except (ValueError, KeyError):
+        return False
+    if scheme == 'sha256':
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), key)
+    return hmac.compare_digest(_derive(password, scheme, cost, salt), key)
+
+# Нужно ли пересчитать хеш в текущую схему и стоимость
+def needs_rehash(stored, scheme='scrypt', cost=None):
+    try:
+        current_scheme, current_cost, _, _ = parse_hash(stored)
+    except (ValueError, KeyError):
+        return True
+    return current_scheme != scheme or current_cost != (cost or DEFAULT_COST[scheme])
+
+# Проверка и, если пароль верен и хеш устарел, новый хеш - за один вызов в пуле:
+# (пароль верен, новый хеш или None)
+def verify_and_rehash(password, stored, scheme='scrypt', cost=None):
+    if not verify_password(password, stored):
+        return False, None
+    if needs_rehash(stored, scheme, cost):
+        return True, hash_password(password, scheme, cost)
+    return True, None
+
+# Пул занят: очередь заполнена или ответ не получен вовремя
+class PasswordHasherBusy(Exception):
+    pass
+
+# Пул процессов для хеширования. workers=0 - вычисление в текущем потоке (тесты).
+# В очереди (выполняются и ждут) не больше max_pending задач
+class PasswordHasher:
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                # spawn: воркеры не наследуют потоки и блокировки сервера
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self.executor
+
+    def call(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        if not self.slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            future = self._executor().submit(func, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise PasswordHasherBusy()
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+                self.executor = None
@@ -0,0 +1,127 @@
+# Генераторы случайных чисел для игр.
+#
+# system() - криптостойкий генератор текущего потока: байты os.urandom читаются блоками
+# по BLOCK_BYTES, разбираются на 32-битные слова, и вытягивания берут готовые слова из
+# буфера потока - системный вызов приходится на блок, а не на каждое вытягивание.
+# После fork буферы сбрасываются (иначе воркеры serve.py выдавали бы одинаковые
+# числа из унаследованного буфера).
+#
+# SeededRandom - детерминированный поток из seed (SHA-256 в режиме счетчика): раунд,
+# разыгранный из seed, воспроизводится из того же seed. Для аудита публикуется
+# commitment(seed) - хеш seed, по которому проверяется, что seed раунда не подменен.
+#
+# Оба генератора - подклассы random.Random: choice, randint, shuffle и т. д. работают как обычно.
+import hashlib
+import os
+import random
+import struct
+import threading
+
+BLOCK_BYTES = 16384
+SEED_BYTES = 32
+# Блок детерминированного потока: столько хешей SHA-256 за одно пополнение
+SEEDED_BLOCK_HASHES = 8
+
+_local = threading.local()
+
+def _after_fork():
+    global _local
+    _local = threading.local()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+# Основа генераторов на потоке 32-битных слов: подкласс определяет _refill() -
+# итератор следующего блока слов
+class _WordStreamRandom(random.Random):
+    def __init__(self):
+        self.words = iter(())
+        super().__init__()
+
+    def seed(self, *args, **kwargs):
+        pass
+
+    def getstate(self):
+        raise NotImplementedError('Состояние генератора не сохраняется')
+
+    def setstate(self, state):
+        raise NotImplementedError('Состояние генератора не восстанавливается')
+
+    def _refill(self):
+        raise NotImplementedError
+
+    def _word(self):
+        for word in self.words:
+            return word
+        self.words = self._refill()
+        return next(self.words)
+
+    # Равномерное число 0..n-1: старшие биты слова с отбрасыванием значений >= n
+    def _randbelow(self, n):
+        bits = n.bit_length()
+        if bits > 32:
+            return self._randbelow_with_getrandbits(n)
+        shift = 32 - bits
+        for word in self.words:
+            value = word >> shift
+            if value < n:
+                return value
+        self.words = self._refill()
+        return self._randbelow(n)
+
+    def getrandbits(self, k):
+        if k < 0:
+            raise ValueError('Число бит должно быть неотрицательным')
+        if k <= 32:
+            return self._word() >> (32 - k)
+        count = (k + 31) // 32
+        value = 0
+        for _ in range(count):
+            value = (value << 32) | self._word()
+        return value >> (count * 32 - k)
+
+    # 53 случайных бита, как в random.Random
+    def random(self):
+        high = self._word() >> 5
+        low = self._word() >> 6
+        return (high * 67108864.0 + low) * (1.0 / 9007199254740992.0)
+
+    def randbytes(self, n):
+        return self.getrandbits(n * 8).to_bytes(n, 'big')
+
+class BufferedRandom(_WordStreamRandom):
+    def __init__(self, block_bytes=BLOCK_BYTES):
+        self.block_bytes = block_bytes
+        super().__init__()
+
+    def _refill(self):
+        return iter(memoryview(os.urandom(self.block_bytes)).cast('I'))
+
+class SeededRandom(_WordStreamRandom):
+    def __init__(self, seed):
+        self.key = bytes(seed)
+        self.counter = 0
+        super().__init__()
+
+    # Порядок байтов фиксирован, поток одинаков на любой платформе
+    def _refill(self):
+        first = self.counter
+        self.counter += SEEDED_BLOCK_HASHES
+        block = b''.join(hashlib.sha256(self.key + counter.to_bytes(8, 'big')).digest()
+                         for counter in range(first, self.counter))
+        return iter(struct.unpack(f'>{len(block) // 4}I', block))
+
+# Генератор текущего потока (буфер у каждого потока свой, без блокировок)
+def system():
+    generator = getattr(_local, 'random', None)
+    if generator is None:
+        generator = _local.random = BufferedRandom()
+    return generator
+
+# Новый seed раунда
+def new_seed():
+    return system().randbytes(SEED_BYTES)
+
+# Обязательство по seed: публикуется вместо seed и сверяется с ним при проверке
+def commitment(seed):
+    return hashlib.sha256(seed).hexdigest()
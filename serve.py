@@ -0,0 +1,227 @@
+# Продакшен-запуск с предварительным fork. Мастер-процесс один раз применяет
+# миграции, открывает слушающий сокет и запускает N воркеров (многопоточные
+# WSGI-серверы Werkzeug на общем сокете). Упавший воркер перезапускается.
+#
+# Перезапуск воркеров без простоя:
+#   - после --max-requests запросов (плюс случайный --max-requests-jitter, чтобы
+#     воркеры не уходили одновременно) воркер перестает принимать соединения,
+#     дожидается текущих запросов и завершается, мастер запускает замену;
+#   - SIGHUP мастеру запускает новый набор воркеров и плавно останавливает старый;
+#   - SIGTERM / SIGINT - плавная остановка всех воркеров (не дольше --graceful-timeout).
+#
+# Общее состояние воркеров - только в SQLite. Кэши в памяти воркера либо проверяются по БД
+# (партии блэкджека - по версии, и расчет ставки записывает партию в той же транзакции
+# с проверкой версии), либо живут ограниченное время (сессии - SESSION_CACHE_TTL,
+# таблица лидеров - LEADERBOARD_REFRESH_INTERVAL). С хранилищем memory данные у каждого
+# процесса свои, поэтому запускается один воркер.
+#
+# Запуск:
+#   CASINO_SECRET_KEY=... python serve.py --bind 0.0.0.0:5005 --per-core 2 --max-requests 10000
+import argparse
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server, WSGIRequestHandler
+from werkzeug.wsgi import ClosingIterator
+
+import app as casino
+
+log = logging.getLogger('casino.serve')
+
+# Счетчик запросов воркера: сколько обработано и сколько выполняется сейчас
+class RequestCounter:
+    def __init__(self, wsgi_app, limit, on_limit):
+        self.wsgi_app = wsgi_app
+        self.limit = limit
+        self.on_limit = on_limit
+        self.total = 0
+        self.active = 0
+        self.idle = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self.idle:
+            self.total += 1
+            self.active += 1
+            reached = self.total == self.limit
+        if reached:
+            self.on_limit()
+        try:
+            result = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self.finished()
+            raise
+        # Запрос считается завершенным, когда сервер закроет тело ответа
+        return ClosingIterator(result, [self.finished])
+
+    def finished(self):
+        with self.idle:
+            self.active -= 1
+            if self.active == 0:
+                self.idle.notify_all()
+
+    def wait_idle(self, timeout):
+        with self.idle:
+            return self.idle.wait_for(lambda: self.active == 0, timeout)
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, code='-', size='-'):
+        pass
+
+def parse_bind(value):
+    host, _, port = value.rpartition(':')
+    return host or '0.0.0.0', int(port)
+
+def run_worker(sock, args):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+    host, port = parse_bind(args.bind)
+    server = make_server(
+        host, port, casino.app, threaded=True, fd=sock.fileno(),
+        request_handler=WSGIRequestHandler if args.access_log else QuietRequestHandler
+    )
+    stopping = threading.Event()
+
+    # serve_forever нельзя останавливать из его же потока - shutdown в отдельном потоке
+    def stop(*_):
+        if not stopping.is_set():
+            stopping.set()
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+    limit = 0
+    if args.max_requests:
+        limit = args.max_requests + random.randint(0, args.max_requests_jitter)
+    counter = RequestCounter(casino.app, limit, stop)
+    server.app = counter
+    signal.signal(signal.SIGTERM, stop)
+
+    log.info('Воркер %d запущен', os.getpid())
+    code = 0
+    try:
+        server.serve_forever()
+        if not counter.wait_idle(args.graceful_timeout):
+            log.warning('Воркер %d: %d запросов не завершились за %s с',
+                        os.getpid(), counter.active, args.graceful_timeout)
+        log.info('Воркер %d остановлен после %d запросов', os.getpid(), counter.total)
+    except Exception:
+        log.exception('Воркер %d упал', os.getpid())
+        code = 1
+    finally:
+        try:
+            casino.session_sweeper.stop()
+            casino.leaderboard.stop()
+            casino.ledger_checkpointer.stop()
+            casino.shutdown_password_hasher()
+            casino.history_journal.stop()
+        finally:
+            casino.close_all_connections()
+            # Без atexit и обработчиков мастера, унаследованных при fork
+            os._exit(code)
+
+class Master:
+    def __init__(self, sock, args):
+        self.sock = sock
+        self.args = args
+        self.workers = set()
+        self.target = args.workers
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.sock, self.args)
+        self.workers.add(pid)
+
+    def signal_workers(self, signum, pids=None):
+        for pid in list(self.workers if pids is None else pids):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def reload(self, *_):
+        log.info('SIGHUP: перезапуск %d воркеров', self.target)
+        old = list(self.workers)
+        for _ in range(self.target):
+            self.spawn()
+        self.signal_workers(signal.SIGTERM, old)
+
+    def shutdown(self, *_):
+        if self.stopping:
+            return
+        log.info('Остановка: ждем завершения воркеров')
+        self.stopping = True
+        self.signal_workers(signal.SIGTERM)
+        # Воркеры, не успевшие завершиться, останавливаются принудительно
+        signal.alarm(int(self.args.graceful_timeout) + 5)
+
+    def kill(self, *_):
+        log.warning('Принудительная остановка %d воркеров', len(self.workers))
+        self.signal_workers(signal.SIGKILL)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.shutdown)
+        signal.signal(signal.SIGINT, self.shutdown)
+        signal.signal(signal.SIGHUP, self.reload)
+        signal.signal(signal.SIGALRM, self.kill)
+
+        for _ in range(self.target):
+            self.spawn()
+
+        while self.workers:
+            pid, status = os.wait()
+            self.workers.discard(pid)
+            if self.stopping or len(self.workers) >= self.target:
+                continue
+            if os.waitstatus_to_exitcode(status) != 0:
+                log.warning('Воркер %d завершился с ошибкой, перезапуск', pid)
+                # Не перезапускаем падающий воркер в цикле без паузы
+                time.sleep(1)
+            self.spawn()
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description='Запуск казино в несколько процессов')
+    parser.add_argument('--bind', default=os.environ.get('CASINO_BIND', '0.0.0.0:5005'))
+    parser.add_argument('--per-core', type=int, default=1, help='воркеров на ядро процессора')
+    parser.add_argument('--workers', type=int, help=f'число воркеров (по умолчанию per-core * {cores})')
+    parser.add_argument('--max-requests', type=int, default=0,
+                        help='перезапуск воркера после N запросов (0 - без перезапуска)')
+    parser.add_argument('--max-requests-jitter', type=int, default=0)
+    parser.add_argument('--graceful-timeout', type=float, default=30)
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--access-log', action='store_true', help='журнал запросов Werkzeug')
+    args = parser.parse_args()
+    if args.workers is None:
+        args.workers = args.per_core * cores
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(process)d] %(message)s')
+    if not os.environ.get('CASINO_SECRET_KEY'):
+        log.warning('CASINO_SECRET_KEY не задан: сессии не переживут перезапуск мастера')
+    if casino.app.config['STORAGE'] == 'memory' and args.workers > 1:
+        log.warning('Хранилище memory: у каждого воркера свои данные, запускается один воркер')
+        args.workers = 1
+
+    # Миграции - один раз в мастере. Соединения закрываются до fork, чтобы воркеры
+    # не унаследовали открытые дескрипторы SQLite
+    casino.init_db()
+    casino.close_all_connections()
+
+    host, port = parse_bind(args.bind)
+    sock = socket.create_server((host, port), backlog=args.backlog)
+    sock.set_inheritable(True)
+    log.info('Слушаем %s:%d, воркеров: %d', host, port, args.workers)
+
+    Master(sock, args).run()
+    sock.close()
+    log.info('Остановлено')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
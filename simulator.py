@@ -0,0 +1,267 @@
+# Монте-Карло симулятор RTP (возврата игроку) для всех игр казино.
+#
+# Правила выплат берутся из app.py (slots_payout, coinflip_payout, dice_outcome,
+# blackjack_payout, CARD_VALUES) и повторяются здесь в векторизованном виде на NumPy:
+# случайные значения генерируются пакетами по batch раундов. В режиме --workers N
+# раунды делятся между процессами, у каждого свой независимый поток RNG из SeedSequence.
+#
+# Запуск:
+#   python simulator.py --rounds 100000000 --workers 8
+#   python simulator.py --game blackjack --decks 6 --stand-on 17 --json rtp.json
+#   python simulator.py --game blackjack --strategy strategy.json   # таблица из blackjack_analysis.py
+#   python simulator.py --check              # сверка векторных правил с app.py
+import argparse
+import json
+import math
+import multiprocessing
+import time
+
+import numpy as np
+
+from blackjack_analysis import strategy_table
+from app import (app, BlackjackGame, SLOT_SYMBOLS, COIN_SIDES, CARD_NAMES, CARD_VALUES,
+                 slots_payout, coinflip_payout, dice_outcome, blackjack_payout)
+
+GAMES = ['slots', 'coinflip', 'dice', 'blackjack']
+
+# Значения карт шуза: 2..9, 10 (десятки и картинки), 11 (туз) и их число в одной колоде
+CARD_CLASS_VALUES = np.array(sorted(set(CARD_VALUES)), dtype=np.int8)
+CARD_CLASS_COUNTS = np.array([CARD_VALUES.count(int(value)) for value in CARD_CLASS_VALUES], dtype=np.int16)
+DIAMOND = SLOT_SYMBOLS.index('💎')
+
+# Векторные правила. Каждая функция возвращает выплаты для ставки 1
+
+def simulate_slots(rng, n):
+    reels = rng.integers(0, len(SLOT_SYMBOLS), size=(n, 3), dtype=np.int8)
+    three = (reels[:, 0] == reels[:, 1]) & (reels[:, 1] == reels[:, 2])
+    two = (reels[:, 0] == reels[:, 1]) | (reels[:, 1] == reels[:, 2])
+    payout = np.where(two, 2.0, 0.0)
+    payout[three] = np.where(reels[three, 0] == DIAMOND, 10.0, 5.0)
+    return payout, reels
+
+def simulate_coinflip(rng, n):
+    # Игрок всегда выбирает орла: монета симметрична, выбор не влияет на RTP
+    coins = rng.integers(0, len(COIN_SIDES), size=n, dtype=np.int8)
+    return np.where(coins == 0, 2.0, 0.0), coins
+
+def simulate_dice(rng, n):
+    dice = rng.integers(1, 7, size=(n, 4), dtype=np.int8)
+    player = dice[:, 0].astype(np.int16) + dice[:, 1]
+    dealer = dice[:, 2].astype(np.int16) + dice[:, 3]
+    double = dice[:, 0] == dice[:, 1]
+    payout = np.where(player > dealer, np.where(double, 3.0, 2.0), 0.0)
+    payout[player == dealer] = 1.0
+    return payout, dice
+
+# Блэкджек: каждый раунд сдается из свежего шуза без возвращения карт.
+# Карта тянется по остаткам классов карт в шузе этого раунда.
+class BlackjackBatch:
+    def __init__(self, rng, n, decks):
+        self.rng = rng
+        self.counts = np.tile(CARD_CLASS_COUNTS * decks, (n, 1))
+
+    # Тянет по карте в строках active, остальным строкам достается 0
+    def draw(self, active):
+        rows = np.nonzero(active)[0]
+        counts = self.counts[rows]
+        cumulative = np.cumsum(counts, axis=1)
+        target = (self.rng.random(len(rows), dtype=np.float32) * cumulative[:, -1]).astype(np.int16)
+        cls = (cumulative > target[:, None]).argmax(axis=1)
+        self.counts[rows, cls] -= 1
+        values = np.zeros(len(active), dtype=np.int16)
+        values[rows] = CARD_CLASS_VALUES[cls]
+        return values
+
+# Добавление карт к рукам (сумма, мягкие тузы), как BlackjackGame.add_card
+def add_cards(total, soft, values):
+    total = total + values
+    soft = soft + (values == 11)
+    for _ in range(2):
+        reduce = (total > 21) & (soft > 0)
+        total = total - 10 * reduce
+        soft = soft - reduce
+    return total, soft
+
+# strategy: None - игрок берет карту, пока сумма меньше stand_on;
+# иначе таблица решений strategy[(сумма, мягкая ли рука, открытая карта дилера)] -> 'hit'/'stand'
+def simulate_blackjack(rng, n, decks=1, stand_on=17, strategy=None):
+    batch = BlackjackBatch(rng, n, decks)
+    everyone = np.ones(n, dtype=bool)
+    zeros = np.zeros(n, dtype=np.int16)
+
+    player, player_soft = add_cards(zeros, zeros, batch.draw(everyone))
+    player, player_soft = add_cards(player, player_soft, batch.draw(everyone))
+    upcard = batch.draw(everyone)
+    dealer, dealer_soft = add_cards(zeros, zeros, upcard)
+    dealer, dealer_soft = add_cards(dealer, dealer_soft, batch.draw(everyone))
+
+    natural = player == 21
+    if strategy is not None:
+        hit_table = np.zeros((32, 2, 12), dtype=bool)
+        for (total, soft, up), decision in strategy.items():
+            hit_table[total, int(soft), up] = decision == 'hit'
+
+    playing = ~natural
+    while playing.any():
+        if strategy is None:
+            wants = player < stand_on
+        else:
+            wants = hit_table[player, (player_soft > 0).astype(np.int8), upcard]
+        playing &= wants & (player < 21)
+        if not playing.any():
+            break
+        player, player_soft = add_cards(player, player_soft, batch.draw(playing))
+
+    bust = player > 21
+    dealing = ~bust
+    while True:
+        dealing &= dealer < 17
+        if not dealing.any():
+            break
+        dealer, dealer_soft = add_cards(dealer, dealer_soft, batch.draw(dealing))
+
+    payout = np.zeros(n)
+    payout[(player > dealer) | (dealer > 21)] = blackjack_payout('win', 1)
+    payout[player == dealer] = blackjack_payout('push', 1)
+    payout[bust] = blackjack_payout('bust', 1)
+    # Блэкджек с раздачи платит 2.5 (int(bet * 2.5) при целых ставках округляется вниз),
+    # но если дилер добрал до 21 - ничья
+    payout[natural] = np.where(dealer[natural] == 21, 1.0, 2.5)
+    return payout, None
+
+SIMULATORS = {
+    'slots': simulate_slots,
+    'coinflip': simulate_coinflip,
+    'dice': simulate_dice,
+    'blackjack': simulate_blackjack,
+}
+
+# Накопление сумм по пакету: раунды, сумма и сумма квадратов выплат, число выигрышей
+def summarize(payout):
+    return np.array([len(payout), payout.sum(), np.square(payout).sum(), (payout > 1).sum()])
+
+def run_chunk(args):
+    game, rounds, seed_seq, batch, options = args
+    rng = np.random.default_rng(seed_seq)
+    totals = np.zeros(4)
+    done = 0
+    while done < rounds:
+        n = min(batch, rounds - done)
+        payout, _ = SIMULATORS[game](rng, n, **options)
+        totals += summarize(payout)
+        done += n
+    return totals
+
+def report(game, totals, elapsed):
+    rounds, total, total_sq, hits = totals
+    rtp = total / rounds
+    variance = total_sq / rounds - rtp * rtp
+    margin = 1.96 * math.sqrt(variance / rounds)
+    return {
+        'game': game,
+        'rounds': int(rounds),
+        'rtp': rtp,
+        'house_edge': 1 - rtp,
+        'ci95': [rtp - margin, rtp + margin],
+        'std_dev': math.sqrt(variance),
+        'hit_frequency': hits / rounds,
+        'seconds': round(elapsed, 2),
+    }
+
+def simulate(game, rounds, workers=1, seed=None, batch=1000000, **options):
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    share, extra = divmod(rounds, workers)
+    chunks = [(game, share + (i < extra), seeds[i], batch, options) for i in range(workers)]
+
+    started = time.perf_counter()
+    if workers == 1:
+        results = [run_chunk(chunks[0])]
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.map(run_chunk, chunks)
+    return report(game, sum(results), time.perf_counter() - started)
+
+# Сверка векторных правил с функциями выплат из app.py на случайных раундах
+def check_rules(rounds=20000, seed=0):
+    rng = np.random.default_rng(seed)
+
+    payout, reels = simulate_slots(rng, rounds)
+    for row, value in zip(reels, payout):
+        assert slots_payout([SLOT_SYMBOLS[i] for i in row], 1) == value, row
+
+    payout, coins = simulate_coinflip(rng, rounds)
+    for coin, value in zip(coins, payout):
+        assert coinflip_payout(COIN_SIDES[0], COIN_SIDES[coin], 1) == value, coin
+
+    payout, dice = simulate_dice(rng, rounds)
+    for row, value in zip(dice, payout):
+        assert dice_outcome(list(row[:2]), list(row[2:]), 1)[1] == value, row
+
+    # Блэкджек: статистическая сверка с пошаговой игрой через BlackjackGame
+    assert CARD_CLASS_COUNTS.sum() == len(CARD_NAMES)
+    scalar = np.array([play_blackjack_round(rng) for _ in range(rounds)])
+    vector, _ = simulate_blackjack(rng, rounds * 10)
+    margin = 4 * math.sqrt(scalar.var() / len(scalar) + vector.var() / len(vector))
+    assert abs(scalar.mean() - vector.mean()) < margin, (scalar.mean(), vector.mean())
+    print("Правила симулятора совпадают с app.py")
+
+# Один раунд блэкджека по логике blackjack_page (ставка 1, игрок берет до stand_on)
+def play_blackjack_round(rng, stand_on=17):
+    deck = BlackjackGame.new_deck(int(rng.integers(1 << 62)))
+    player_hand, dealer_hand, deck = BlackjackGame.deal_initial_cards(deck)
+    if BlackjackGame.calculate_hand_value(player_hand) == 21:
+        dealer_hand, deck = BlackjackGame.dealer_play(dealer_hand, deck)
+        return 1.0 if BlackjackGame.calculate_hand_value(dealer_hand) == 21 else 2.5
+    while BlackjackGame.calculate_hand_value(player_hand) < stand_on:
+        player_hand, deck = BlackjackGame.hit(player_hand, deck)
+    player_value = BlackjackGame.calculate_hand_value(player_hand)
+    if player_value > 21:
+        return float(blackjack_payout('bust', 1))
+    dealer_hand, deck = BlackjackGame.dealer_play(dealer_hand, deck)
+    winner = BlackjackGame.determine_winner(player_value, BlackjackGame.calculate_hand_value(dealer_hand))
+    return float(blackjack_payout({'player': 'win', 'dealer': 'lose', 'push': 'push'}[winner], 1))
+
+def main():
+    parser = argparse.ArgumentParser(description='Монте-Карло симулятор RTP игр казино')
+    parser.add_argument('--game', choices=GAMES + ['all'], default='all')
+    parser.add_argument('--rounds', type=int, default=10000000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='число процессов (0 - по числу ядер)')
+    parser.add_argument('--batch', type=int, default=1000000, help='раундов в одном пакете NumPy')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--decks', type=int, default=app.config['BLACKJACK_DECKS'])
+    parser.add_argument('--stand-on', type=int, default=17,
+                        help='блэкджек: игрок останавливается на этой сумме')
+    parser.add_argument('--strategy', help='блэкджек: JSON со стратегией из blackjack_analysis.py')
+    parser.add_argument('--check', action='store_true', help='только сверить правила с app.py')
+    parser.add_argument('--json', help='сохранить результаты в JSON-файл')
+    args = parser.parse_args()
+
+    if args.check:
+        check_rules()
+        return
+
+    workers = args.workers or multiprocessing.cpu_count()
+    games = GAMES if args.game == 'all' else [args.game]
+    results = []
+    for game in games:
+        options = {}
+        if game == 'blackjack':
+            options = {'decks': args.decks, 'stand_on': args.stand_on}
+            if args.strategy:
+                with open(args.strategy, encoding='utf-8') as f:
+                    options['strategy'] = strategy_table(json.load(f)['strategy'])
+        # Блэкджек тяжелее остальных игр: пакет меньше, чтобы не раздувать память
+        batch = min(args.batch, 200000) if game == 'blackjack' else args.batch
+        result = simulate(game, args.rounds, workers, args.seed, batch, **options)
+        results.append(result)
+        print(f"{game:<10} RTP {result['rtp']:.5f} ± {(result['ci95'][1] - result['rtp']):.5f}  "
+              f"частота выигрыша {result['hit_frequency']:.4f}  "
+              f"σ {result['std_dev']:.3f}  {result['rounds']} раундов за {result['seconds']} с")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
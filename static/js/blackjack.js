@@ -0,0 +1,96 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const betChips = document.querySelectorAll('.bet-chip');
+    const dealBtn = document.getElementById('dealBtn');
+    const hitBtn = document.getElementById('hitBtn');
+    const standBtn = document.getElementById('standBtn');
+    const newGameBtn = document.getElementById('newGameBtn');
+    const gameMessage = document.getElementById('gameMessage');
+    const playerValue = document.getElementById('playerValue');
+    const dealerValue = document.getElementById('dealerValue');
+    const playerCards = document.getElementById('playerCards');
+    const dealerCards = document.getElementById('dealerCards');
+    const currentBet = document.getElementById('currentBet');
+    
+    // Анимация выбора фишки
+    betChips.forEach(chip => {
+        chip.addEventListener('click', function() {
+            betChips.forEach(c => c.classList.remove('selected'));
+            this.classList.add('selected');
+        });
+    });
+    
+    // Анимация кнопок
+    [dealBtn, hitBtn, standBtn, newGameBtn].forEach(btn => {
+        if (btn) {
+            btn.addEventListener('click', function(e) {
+                this.style.transform = 'scale(0.95)';
+                setTimeout(() => {
+                    this.style.transform = 'scale(1)';
+                }, 100);
+            });
+        }
+    });
+    
+    // Анимация сообщения
+    if (gameMessage) {
+        if (gameMessage.classList.contains('win-message')) {
+            gameMessage.classList.add('win-message');
+        }
+        
+        // Автоматическое скрытие сообщения через 5 секунд
+        setTimeout(() => {
+            if (gameMessage) {
+                gameMessage.style.opacity = '0';
+                gameMessage.style.transition = 'opacity 0.5s';
+                setTimeout(() => {
+                    if (gameMessage && gameMessage.parentNode) {
+                        gameMessage.style.display = 'none';
+                    }
+                }, 500);
+            }
+        }, 5000);
+    }
+    
+    // Анимация изменения значений рук
+    if (playerValue) {
+        const originalPlayerValue = playerValue.textContent;
+        const observerPlayer = new MutationObserver(function() {
+            if (playerValue.textContent !== originalPlayerValue) {
+                playerValue.classList.add('changed');
+                setTimeout(() => {
+                    playerValue.classList.remove('changed');
+                }, 1000);
+            }
+        });
+        
+        observerPlayer.observe(playerValue, {
+            characterData: true,
+            childList: true,
+subtree: true
+        });
+    }
+    
+    if (dealerValue && dealerValue.textContent !== '?') {
+        dealerValue.classList.add('changed');
+        setTimeout(() => {
+            dealerValue.classList.remove('changed');
+        }, 1000);
+    }
+    
+    // Анимация появления текущей ставки
+    if (currentBet) {
+        currentBet.style.animation = 'chipBet 0.5s ease-out';
+    }
+    
+    // Анимация карт при загрузке
+    setTimeout(() => {
+        const cards = document.querySelectorAll('.card');
+        cards.forEach((card, index) => {
+            if (card.classList.contains('new-card')) {
+                setTimeout(() => {
+                    card.style.animation = 'cardDeal 0.5s ease-out forwards';
+                }, index * 100);
+            }
+        });
+    }, 100);
+});
@@ -0,0 +1,110 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const coin = document.getElementById('coin');
+    const flipBtn = document.getElementById('flipBtn');
+    const headsBtn = document.getElementById('headsBtn');
+    const tailsBtn = document.getElementById('tailsBtn');
+    const choiceHeads = document.getElementById('choiceHeads');
+    const choiceTails = document.getElementById('choiceTails');
+    const resultMessage = document.getElementById('resultMessage');
+    const betChips = document.querySelectorAll('.bet-chip');
+    const coinForm = document.getElementById('coinForm');
+// Анимация выбора стороны
+    headsBtn.addEventListener('click', function() {
+        choiceHeads.checked = true;
+        headsBtn.classList.add('selected');
+        tailsBtn.classList.remove('selected');
+    });
+    
+    tailsBtn.addEventListener('click', function() {
+        choiceTails.checked = true;
+        tailsBtn.classList.add('selected');
+        headsBtn.classList.remove('selected');
+    });
+    
+    // Инициализация выбранной кнопки
+    if (choiceHeads.checked) {
+        headsBtn.classList.add('selected');
+    } else if (choiceTails.checked) {
+        tailsBtn.classList.add('selected');
+    }
+    
+    // Анимация выбора фишки
+    betChips.forEach(chip => {
+        chip.addEventListener('click', function() {
+            betChips.forEach(c => c.style.transform = 'scale(1)');
+            this.style.transform = 'scale(1.1)';
+        });
+    });
+    
+    // Анимация при клике на кнопку
+    if (flipBtn) {
+        flipBtn.addEventListener('click', function(e) {
+            if (!coinForm.checkValidity()) {
+                return;
+            }
+            
+            // Анимация кнопки
+            this.style.transform = 'scale(0.95)';
+            setTimeout(() => {
+                this.style.transform = 'scale(1)';
+            }, 100);
+            
+            // Запуск анимации монетки
+            coin.classList.add('flipping');
+            
+            // После анимации показываем результат
+            setTimeout(() => {
+                coin.classList.remove('flipping');
+                
+                // Показываем результат, если он есть
+                if (resultMessage) {
+                    resultMessage.style.display = 'block';
+                    if (resultMessage.classList.contains('win')) {
+                        resultMessage.classList.add('win');
+                    }
+                }
+            }, 1000);
+        });
+    }
+    
+    // Автоматический запуск анимации монетки при загрузке, если есть результат
+    if (coin.dataset.result) {
+        setTimeout(() => {
+            coin.classList.add('flipping');
+            setTimeout(() => {
+                coin.classList.remove('flipping');
+                // Устанавливаем правильную сторону монетки
+                coin.classList.remove('show-heads', 'show-tails');
+                coin.classList.add('show-' + coin.dataset.result);
+            }, 1000);
+        }, 500);
+    }
+    
+    // Анимация сообщения о результате
+    if (resultMessage) {
+        resultMessage.style.opacity = '0';
+        setTimeout(() => {
+            resultMessage.style.transition = 'opacity 0.5s';
+            resultMessage.style.opacity = '1';
+        }, 100);
+        
+        // Автоматическое скрытие сообщения через 5 секунд
+        setTimeout(() => {
+            resultMessage.style.opacity = '0';
+            setTimeout(() => {
+                resultMessage.style.display = 'none';
+            }, 500);
+        }, 5000);
+    }
+    
+    // Анимация баланса
+    const balanceSpan = document.getElementById('balance');
+    if (balanceSpan) {
+        balanceSpan.addEventListener('DOMSubtreeModified', function() {
+            this.style.animation = 'none';
+            setTimeout(() => {
+                this.style.animation = 'choicePulse 0.5s ease';
+            }, 10);
+        });
+    }
+});
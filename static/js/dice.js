@@ -0,0 +1,160 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const rollBtn = document.getElementById('rollBtn');
+    const resultMessage = document.getElementById('resultMessage');
+    const diceForm = document.getElementById('diceForm');
+    const playerDice = [document.getElementById('playerDie1'), document.getElementById('playerDie2')];
+    const dealerDice = [document.getElementById('dealerDie1'), document.getElementById('dealerDie2')];
+    const playerTable = document.getElementById('playerTable');
+    const dealerTable = document.getElementById('dealerTable');
+    const playerScoreValue = document.querySelector('#playerTable .score-value');
+    const dealerScoreValue = document.querySelector('#dealerTable .score-value');
+    const vs = document.getElementById('vs');
+    const betChips = document.querySelectorAll('.bet-chip');
+    const diceContainer = document.querySelector('.dice-container');
+    
+    // Анимация выбора фишки
+    betChips.forEach(chip => {
+        chip.addEventListener('click', function() {
+            betChips.forEach(c => c.style.transform = 'scale(1)');
+            this.style.transform = 'scale(1.1)';
+        });
+    });
+    
+    // Анимация при клике на кнопку
+    if (rollBtn) {
+        rollBtn.addEventListener('click', function(e) {
+            if (!diceForm.checkValidity()) {
+                return;
+            }
+            
+            // Анимация кнопки
+            this.style.transform = 'scale(0.95)';
+            setTimeout(() => {
+                this.style.transform = 'scale(1)';
+            }, 100);
+            
+            // Анимация костей
+            playerDice.forEach((die, index) => {
+                if (die) {
+                    setTimeout(() => {
+                        die.classList.add('rolling');
+                        setTimeout(() => {
+                            die.classList.remove('rolling');
+                        }, 1000);
+                    }, index * 200);
+                }
+            });
+            
+            dealerDice.forEach((die, index) => {
+                if (die) {
+                    setTimeout(() => {
+                        die.classList.add('rolling');
+                        setTimeout(() => {
+                            die.classList.remove('rolling');
+                        }, 1000);
+                    }, index * 200 + 100);
+                }
+            });
+            
+            // Анимация VS
+            if (vs) {
+                vs.style.animation = 'vsPulse 0.5s ease-in-out 2';
+                setTimeout(() => {
+                    vs.style.animation = 'vsPulse 2s ease-in-out infinite';
+                }, 1000);
+            }
+        });
+    }
+    
+    // Автоматическая анимация при загрузке, если игра уже была
+    if (diceContainer && 'rolled' in diceContainer.dataset) {
+        setTimeout(() => {
+            // Анимация костей игрока
+            playerDice.forEach((die, index) => {
+                if (die) {
+                    setTimeout(() => {
+                        die.classList.add('rolling');
+                        setTimeout(() => {
+                            die.classList.remove('rolling');
+                        }, 1000);
+                    }, index * 200);
+                }
+            });
+        
+            // Анимация костей дилера
+            dealerDice.forEach((die, index) => {
+                if (die) {
+                    setTimeout(() => {
+                        die.classList.add('rolling');
+                        setTimeout(() => {
+                            die.classList.remove('rolling');
+                        }, 1000);
+                    }, index * 200 + 100);
+                }
+            });
+        
+            // Показываем победителя
+            setTimeout(() => {
+                const playerScore = parseInt(diceContainer.dataset.playerScore);
+                const dealerScore = parseInt(diceContainer.dataset.dealerScore);
+            
+                if (playerScore > dealerScore) {
+                    playerTable.classList.add('winner');
+                    if (playerScoreValue) {
+                        playerScoreValue.classList.add('winner');
+                    }
+                } else if (dealerScore > playerScore) {
+                    dealerTable.classList.add('winner');
+                    if (dealerScoreValue) {
+                        dealerScoreValue.classList.add('winner');
+                    }
+                }
+            }, 1200);
+        }, 300);
+    }
+    
+    // Анимация сообщения о результате
+    if (resultMessage) {
+        resultMessage.style.opacity = '0';
+        setTimeout(() => {
+            resultMessage.style.transition = 'opacity 0.5s';
+            resultMessage.style.opacity = '1';
+        }, 100);
+        
+        // Автоматическое скрытие сообщения через 5 секунд
+        setTimeout(() => {
+            resultMessage.style.opacity = '0';
+            setTimeout(() => {
+                resultMessage.style.display = 'none';
+            }, 500);
+        }, 5000);
+    }
+    
+    // Анимация баланса
+    const balanceSpan = document.getElementById('balance');
+    if (balanceSpan) {
+        const observer = new MutationObserver(function() {
+            balanceSpan.style.animation = 'none';
+            setTimeout(() => {
+                balanceSpan.style.animation = 'scoreHighlight 0.5s ease';
+            }, 10);
+        });
+        
+        observer.observe(balanceSpan, {
+            characterData: true,
+            childList: true,
+            subtree: true
+        });
+    }
+    
+    // Анимация при наведении на кости
+    document.querySelectorAll('.die').forEach(die => {
+        die.addEventListener('mouseenter', function() {
+            this.style.transform = 'scale(1.1) rotate(5deg)';
+        });
+        
+        die.addEventListener('mouseleave', function() {
+            this.style.transform = 'scale(1) rotate(0deg)';
+        });
+    });
+});
@@ -0,0 +1,12 @@
+// Анимация баланса при изменении
+document.addEventListener('DOMContentLoaded', function() {
+    const balanceEl = document.getElementById('balance');
+    if (balanceEl) {
+        balanceEl.addEventListener('DOMSubtreeModified', function() {
+            this.style.animation = 'none';
+            setTimeout(() => {
+                this.style.animation = 'pulse 0.5s ease';
+            }, 10);
+        });
+    }
+});
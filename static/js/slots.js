@@ -0,0 +1,72 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const spinBtn = document.getElementById('spinBtn');
+    const resultMessage = document.getElementById('resultMessage');
+    const reels = document.querySelectorAll('.reel');
+    const balanceSpan = document.getElementById('balance');
+    
+    // Если есть сообщение о результате, запускаем анимацию
+if (resultMessage) {
+        if (resultMessage.classList.contains('win')) {
+            // Анимация выигрыша
+            setTimeout(() => {
+                reels.forEach(reel => {
+                    reel.classList.add('win');
+                    setTimeout(() => {
+                        reel.classList.remove('win');
+                    }, 1500);
+                });
+            }, 300);
+        } else {
+            // Анимация проигрыша
+            resultMessage.classList.add('lose');
+            setTimeout(() => {
+                resultMessage.classList.remove('lose');
+            }, 1000);
+        }
+    }
+    
+    // Анимация при клике на кнопку
+    if (spinBtn) {
+        spinBtn.addEventListener('click', function(e) {
+            if (!document.getElementById('slotsForm').checkValidity()) {
+                return;
+            }
+            
+            // Анимация кнопки
+            this.style.transform = 'scale(0.95)';
+            setTimeout(() => {
+                this.style.transform = 'scale(1)';
+            }, 100);
+            
+            // Анимация барабанов
+            reels.forEach((reel, index) => {
+                setTimeout(() => {
+                    reel.classList.add('spinning');
+                    setTimeout(() => {
+                        reel.classList.remove('spinning');
+                    }, 900);
+                }, index * 100);
+            });
+        });
+    }
+    
+    // Анимация баланса при изменении
+    if (balanceSpan) {
+        const observer = new MutationObserver(function(mutations) {
+            mutations.forEach(function(mutation) {
+                if (mutation.type === 'characterData' || mutation.type === 'childList') {
+                    balanceSpan.style.animation = 'none';
+                    setTimeout(() => {
+                        balanceSpan.style.animation = 'winGlow 0.5s ease';
+                    }, 10);
+                }
+            });
+        });
+        
+        observer.observe(balanceSpan, {
+            characterData: true,
+            childList: true,
+            subtree: true
+        });
+    }
+});